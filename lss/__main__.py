@@ -1,11 +1,19 @@
 import asyncio
+from typing import Tuple
 
 import click
 from lss.colors import Colors
 
 from lss.devices import DEVICES, DEVICES_NAMES
+from lss.channels_manager import CHANNELS, ChannelsManager
 from lss.devices.launchpad_mk2_12 import LaunchpadMk2_12
+from lss.devices.twister import ControllerGroup, Twister
+from lss.groove import load_groove
+from lss.midi_import import import_midi_file
+from lss.render import chord_script, midi_file_script, render_to_file
 from lss.sequencer import Sequencer
+from lss.state import save_state_file
+from lss.voices import MIDI_CHANNELS
 
 
 @click.group()
@@ -13,10 +21,19 @@ def cli():
     """Launchpad step sequencer"""
 
 
-async def _run_sequencer(device_type: str, **kwargs):
-    launchpad_class = DEVICES[device_type]
-    launchpad = launchpad_class()
-    sequencer = Sequencer(launchpad, **kwargs)
+async def _run_sequencer(
+    device_types: Tuple[str, ...],
+    device_ports: Tuple[str, ...],
+    controller_ports: Tuple[str, ...],
+    rgb: bool = False,
+    **kwargs,
+):
+    launchpads = []
+    for i, device_type in enumerate(device_types):
+        launchpad_class = DEVICES[device_type]
+        launchpads.append(launchpad_class(device_ports[i] if i < len(device_ports) else None, rgb))
+    controllers = [Twister(port_name) for port_name in controller_ports]
+    sequencer = Sequencer(launchpads, controllers, **kwargs)
     await sequencer.run()
 
 
@@ -29,15 +46,175 @@ async def _run_colors():
 @click.command(name="run")
 @click.option(
     "--device-type",
+    "device_types",
+    multiple=True,
+    required=True,
     type=click.Choice(DEVICES_NAMES, case_sensitive=False),
-    help="Name of MiDI device to connect to.",
+    help="Name of MiDI device to connect to. Can be repeated, every grid edits a channel of its own.",
+)
+@click.option(
+    "--device-port",
+    "device_ports",
+    multiple=True,
+    help="Port of the device given at the same position, when it isn't the device's name, "
+    "e.g. for a second device of the same type.",
+)
+@click.option(
+    "--controller",
+    "controller_ports",
+    multiple=True,
+    default=[Twister.name],
+    show_default=True,
+    help="Port of a Midi Fighter Twister. Can be repeated, all controllers change the current channel.",
+)
+@click.option(
+    "--rgb",
+    is_flag=True,
+    help="Shades pads with RGB colors on devices that take RGB SysEx, palette colors otherwise.",
 )
 @click.option(
     "--debug", is_flag=True, help="Allows printing of debug information including MiDI communication."
 )
-def run_sequencer(device_type: str, debug: bool = False):
+@click.option(
+    "--state",
+    "state_path",
+    type=click.Path(dir_okay=False),
+    help="Loads channels and pages from this file on start and saves them on exit. "
+    "Files ending in .json are stored as JSON, anything else as a binary project.",
+)
+@click.option(
+    "--bank",
+    "bank_path",
+    type=click.Path(file_okay=False),
+    help="Directory of patterns that channels can switch to while playing.",
+)
+@click.option("--undo-depth", default=100, show_default=True, help="Number of edits that can be undone.")
+@click.option(
+    "--groove",
+    "groove_paths",
+    multiple=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Groove template as JSON or taken from a MiDI file. Can be repeated, the groove knob picks one.",
+)
+@click.option(
+    "--channels",
+    "channel_count",
+    default=CHANNELS,
+    show_default=True,
+    type=click.IntRange(1),
+    help="Number of channels. Every --channels-per-port channels get another output port.",
+)
+@click.option(
+    "--channels-per-port",
+    default=MIDI_CHANNELS,
+    show_default=True,
+    type=click.IntRange(1, MIDI_CHANNELS),
+    help="MiDI channels used on each output port.",
+)
+@click.option(
+    "--workers",
+    default=0,
+    show_default=True,
+    type=click.IntRange(0),
+    help="Play channels in this many worker processes, output ports are dealt out between them. "
+    "0 plays them in the main process.",
+)
+@click.option(
+    "--shared-store",
+    help="Publishes patterns in a shared memory block of this name, "
+    "other processes can read them and submit edits with lss.shared_store.PatternStoreClient.",
+)
+@click.option(
+    "--control-socket",
+    type=click.Path(dir_okay=False),
+    help="Takes batches of edits and queries as JSON lines on a Unix socket at this path.",
+)
+def run_sequencer(
+    device_types: Tuple[str, ...],
+    device_ports: Tuple[str, ...] = (),
+    controller_ports: Tuple[str, ...] = (),
+    rgb: bool = False,
+    debug: bool = False,
+    state_path: str = None,
+    bank_path: str = None,
+    undo_depth: int = 100,
+    groove_paths: Tuple[str, ...] = (),
+    channel_count: int = CHANNELS,
+    channels_per_port: int = MIDI_CHANNELS,
+    workers: int = 0,
+    shared_store: str = None,
+    control_socket: str = None,
+):
     """Starts step sequencer"""
-    asyncio.run(_run_sequencer(device_type=device_type, debug=debug))
+    asyncio.run(
+        _run_sequencer(
+            device_types=device_types,
+            device_ports=device_ports,
+            controller_ports=controller_ports,
+            rgb=rgb,
+            debug=debug,
+            state_path=state_path,
+            bank_path=bank_path,
+            undo_depth=undo_depth,
+            grooves=[load_groove(path) for path in groove_paths],
+            channel_count=channel_count,
+            channels_per_port=channels_per_port,
+            workers=workers,
+            shared_store=shared_store,
+            control_socket=control_socket,
+        )
+    )
+
+
+@click.command(name="render")
+@click.argument("output", type=click.Path(dir_okay=False))
+@click.option("--state", "state_path", type=click.Path(exists=True, dir_okay=False), help="Saved state to render.")
+@click.option("--bars", default=8, show_default=True, help="Number of bars to render.")
+@click.option("--bpm", default=120.0, show_default=True, help="Tempo of the rendered file.")
+@click.option("--chord", help="Comma separated MiDI notes held during the whole render, e.g. 48,52,55.")
+@click.option(
+    "--input",
+    "input_path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="MiDI file whose notes are played into the sequencer as if they came from the host.",
+)
+@click.option(
+    "--groove",
+    "groove_paths",
+    multiple=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Groove templates for channels whose groove param picks them.",
+)
+def run_render(
+    output: str,
+    state_path: str,
+    bars: int,
+    bpm: float,
+    chord: str,
+    input_path: str,
+    groove_paths: Tuple[str, ...],
+):
+    """Renders channels to a MiDI file faster than realtime"""
+    if input_path:
+        script = midi_file_script(input_path)
+    elif chord:
+        script = chord_script([int(note) for note in chord.split(",")])
+    else:
+        raise click.UsageError("Either --chord or --input is required")
+    grooves = [load_groove(path) for path in groove_paths]
+    render_to_file(output, bars, script, state_path=state_path, bpm=bpm, grooves=grooves)
+
+
+@click.command(name="import")
+@click.argument("midi_file", type=click.Path(exists=True, dir_okay=False))
+@click.argument("output", type=click.Path(dir_okay=False))
+def run_import(midi_file: str, output: str):
+    """Turns a MiDI file into sequencer state, one track per channel"""
+    channels_manager = ChannelsManager(ControllerGroup(), [], False)
+    imported = import_midi_file(channels_manager, midi_file)
+    save_state_file(channels_manager, output)
+    channels_manager.close()
+    print(f"Imported {imported} tracks")
 
 
 @click.command(name="colors")
@@ -62,6 +239,8 @@ def list_devices():
 cli.add_command(devices_group)
 cli.add_command(run_sequencer)
 cli.add_command(run_colors)
+cli.add_command(run_render)
+cli.add_command(run_import)
 
 
 def main():
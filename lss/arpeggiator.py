@@ -0,0 +1,40 @@
+import random
+from typing import List, Tuple
+
+ARP_UP = "up"
+ARP_DOWN = "down"
+ARP_UP_DOWN = "up-down"
+ARP_AS_PLAYED = "as-played"
+ARP_RANDOM = "random"
+ARP_CHORD = "chord"
+ARP_MODES = [ARP_UP, ARP_DOWN, ARP_UP_DOWN, ARP_AS_PLAYED, ARP_RANDOM, ARP_CHORD]
+
+
+def _extend_over_octaves(keys: List[int], octaves: int) -> List[int]:
+    return [key + 12 * octave for octave in range(octaves) for key in keys]
+
+
+def build_arp_sequence(mode: str, keys: List[int], octaves: int = 8, seed: int = 0) -> List[Tuple[int, ...]]:
+    """
+    Lays out the held keys in the order a mode plays them.
+
+    `keys` are in the order they were pressed. Every entry of the result is
+    what one pad row plays: a single note, or all of them in chord mode. Pads
+    index into the sequence, so it is built once when keys or settings change
+    and steps only look notes up.
+    """
+    if not keys:
+        return []
+    if mode == ARP_CHORD:
+        return [tuple(key + 12 * octave for key in sorted(keys)) for octave in range(octaves)]
+    if mode == ARP_AS_PLAYED:
+        notes = _extend_over_octaves(keys, octaves)
+    else:
+        notes = _extend_over_octaves(sorted(keys), octaves)
+    if mode == ARP_DOWN:
+        notes.reverse()
+    elif mode == ARP_UP_DOWN:
+        notes = notes + notes[-2:0:-1]
+    elif mode == ARP_RANDOM:
+        random.Random(seed).shuffle(notes)
+    return [(note,) for note in notes]
@@ -1,54 +1,111 @@
 from copy import copy
+from typing import Dict, List, Optional, Set, Tuple
 from lss.notetype import NoteType
 
 from lss.paddata import PadData
 
-from .page import PadLocation, Page
+from .page import EMPTY_PADS, PadLocation, Page, SparsePages
 from lss.midi import ControlMessage, NoteMessage, ClockMessage
-from lss.clock_math import get_page_for_tick, get_page_position_for_tick
+from lss.clock_math import (
+    CLOCKS_PER_BAR,
+    get_clock_for_song_position,
+    get_page_for_tick,
+    get_page_position_for_tick,
+    get_ratchet_clocks,
+    get_step_for_clock,
+)
+from lss.arpeggiator import ARP_MODES, build_arp_sequence
 from lss.devices.launchpad_layout import LaunchpadLayout
-
+from lss.groove import Groove, build_groove_table
+from lss.legato import LegatoIndex, LegatoNote
+from lss.recorder import Recorder
+from lss.scale import KEYS, SCALES, build_note_table
+from lss.scheduler import LoopTimer, TempoTracker, TickScheduler
+from lss.trig_conditions import build_trig_rolls, needs_roll, trig_passes
+from lss.voices import VoiceTable
+
+import itertools
 import math
 import mido
 import asyncio
 
 PAGES = 4
 STEPS_PER_PAGE = 8
+ROWS = 8
 CLOCKS_PER_EIGHTH = 12
+# Step sizes in clocks at 24 PPQN, slowest first. Dotted steps last 3/2 of
+# the straight step, triplets 2/3 of it.
+RATES = [
+    ('1/1', 96), ('1/2.', 72), ('1/1T', 64),
+    ('1/2', 48), ('1/4.', 36), ('1/2T', 32),
+    ('1/4', 24), ('1/8.', 18), ('1/4T', 16),
+    ('1/8', 12), ('1/16.', 9), ('1/8T', 8),
+    ('1/16', 6), ('1/16T', 4),
+    ('1/32', 3), ('1/32T', 2),
+]
+RATES_TO_STEP_SIZES = {rate: step_size for rate, (_name, step_size) in enumerate(RATES)}
+DEFAULT_RATE = [name for name, _step_size in RATES].index('1/16')
+MAX_RATCHETS = 8
+MAX_GROOVES = 8
+MAX_POLYPHONY = 16
 
 
 class QueueMessage:
-    def __init__(self, channel, note, note_type, velocity):
+    def __init__(self, channel, note, note_type, velocity, ratchets=1):
         self.channel = channel
         self.note = note
         self.note_type = note_type
         self.velocity = velocity
+        self.ratchets = ratchets
 
     def __copy__(self):
-        return QueueMessage(self.channel, self.note, self.note_type, self.velocity)
+        return QueueMessage(self.channel, self.note, self.note_type, self.velocity, self.ratchets)
 
     def __str__(self):
         return f"QueueMessage(channel={self.channel}, note={self.note}, note_type={self.note_type}, velocity={self.velocity})"
 
 
+# Params follow the Twister knobs on channel 0, its buttons send the same controls on channel 1
+KNOB_CHANNEL = 0
+
+
 class Param:
-    def __init__(self, attribute_name, name, control, min_value, max_value):
+    def __init__(self, attribute_name, name, control, min_value, max_value, lockable=False):
         self.attribute_name = attribute_name
+        # Names the param in saved state and projects, where its position in PARAMS may change
+        self.key = attribute_name.lstrip('_')
         self.name = name
         self.control = control
         self.min_value = min_value
         self.max_value = max_value
+        # Can be locked to another value on single steps
+        self.lockable = lockable
 
 
 PARAMS = [
-    Param('_octave_shift', 'Octave', 15, -4, 4),
-    Param('_rate', 'Rate', 14, 1, 3),
-    Param('_gate', 'Gate', 13, 0, 100),
+    Param('_octave_shift', 'Octave', 15, -4, 4, lockable=True),
+    Param('_rate', 'Rate', 14, 0, len(RATES) - 1),
+    Param('_gate', 'Gate', 13, 0, 100, lockable=True),
+    # Longer patterns can be loaded or imported, the knob covers the first 8 pages
+    Param('_length', 'Length', 11, 1, 64),
+    Param('_swing', 'Swing', 6, 50, 75),
+    # 0 plays without a groove, otherwise picks one of the channel's grooves
+    Param('_groove', 'Groove', 4, 0, MAX_GROOVES),
+    # 1 spreads the notes of a column evenly over the step instead of playing them together
+    Param('_quick_arp', 'Quick arp', 10, 0, 1),
+    Param('_arp_mode', 'Arp mode', 9, 0, len(ARP_MODES) - 1),
+    Param('_arp_octaves', 'Arp octaves', 3, 1, 8),
+    # Seeds the random arp mode and the chance conditions of pads
+    Param('_arp_seed', 'Seed', 2, 0, 127),
+    Param('_scale', 'Scale', 8, 0, len(SCALES) - 1),
+    Param('_key', 'Key', 7, 0, len(KEYS) - 1),
+    # Most notes the channel sounds at once, 0 doesn't limit them
+    Param('_polyphony', 'Polyphony', 17, 0, MAX_POLYPHONY),
 ]
-
-
-def shift_octaves(note: int, octaves=0):
-    return note + (octaves * 12)
+LOCKABLE_PARAMS = {param.control: param for param in PARAMS if param.lockable}
+# Knobs that only lock CCs on steps, with the CC each one sends
+CC_LOCKS = {0: 74, 1: 71}
+LOCK_CONTROLS = set(LOCKABLE_PARAMS) | set(CC_LOCKS)
 
 
 def clip_to_range(n, min_val, max_val):
@@ -83,6 +140,16 @@ def snap(number, array):
     return closest_index, closest_value
 
 
+def get_param_value(param: Param, control_value: int):
+    """Turns a knob position into a value of the param"""
+    value = get_value_from_proportion(control_message_to_proportion(control_value),
+                                      param.min_value,
+                                      param.max_value)
+    _snapped_index, snapped_value = snap(
+        value, range(param.min_value, param.max_value + 1))
+    return snapped_value
+
+
 class Channel(Page.Listener):
     class Listener:
         def on_page_updated(self, page: Page):
@@ -91,6 +158,24 @@ class Channel(Page.Listener):
         def on_page_changed(self, pagenum: int):
             raise NotImplementedError
 
+        def on_pad_changed(self, channel: "Channel", page: Page, x: int, y: int):
+            raise NotImplementedError
+
+        def on_param_changed(self, channel: "Channel", param: Param):
+            raise NotImplementedError
+
+        def on_page_copied(self, channel: "Channel", source: int, target: int):
+            raise NotImplementedError
+
+        def on_pages_replaced(self, channel: "Channel"):
+            raise NotImplementedError
+
+        def on_lock_changed(self, channel: "Channel", step: int, control: int):
+            raise NotImplementedError
+
+        def on_legato_changed(self, channel: "Channel", note: LegatoNote, is_added: bool):
+            raise NotImplementedError
+
     @property
     def legato_on(self):
         return self._legato_on
@@ -103,81 +188,79 @@ class Channel(Page.Listener):
         for page in self.pages:
             page.legato_on = value
 
-    def _fill_range(self, start_location: PadLocation, end_location: PadLocation):
-        PAGE_COUNT = 4
-        COLUMNS_COUNT = 8
-        for page in range(PAGE_COUNT):
-            if start_location.page == end_location.page and end_location.x < start_location.x and page == start_location.page:
-                for x in range(0, end_location.x):
-                    self.pages[page].set_pad(x, start_location.y, PadData(
-                        self.launchpad_layout.get_note_from_coords(
-                            x, start_location.y),
-                        True,
-                        127,
-                        NoteType.BRIDGE))
-                for x in range(start_location.x, COLUMNS_COUNT):
-                    self.pages[page].set_pad(x, start_location.y, PadData(
-                        self.launchpad_layout.get_note_from_coords(
-                            x, start_location.y),
-                        True,
-                        127,
-                        NoteType.BRIDGE))
-            else:
-                start_x = 0
-                end_x = 7
-                if page == start_location.page:
-                    start_x = start_location.x
-                if page == end_location.page:
-                    end_x = end_location.x
-                for x in range(start_x, end_x + 1):
-                    # FIXME: I seem to be using y values that count up, and y values that count down
-                    self.pages[page].set_pad(x, start_location.y, PadData(
-                        self.launchpad_layout.get_note_from_coords(
-                            x, start_location.y),
-                        True,
-                        127,
-                        NoteType.BRIDGE))
-        self.pages[start_location.page].set_pad(start_location.x, start_location.y, PadData(
-            # FIXME: I seem to be using y values that count up, and y values that count down
-            self.launchpad_layout.get_note_from_coords(
-                start_location.x, start_location.y),
-            True, 127, NoteType.NOTE_ON))
-        self.pages[end_location.page].set_pad(end_location.x, end_location.y, PadData(
-            self.launchpad_layout.get_note_from_coords(
-                end_location.x, end_location.y),
-            True, 127, NoteType.NOTE_OFF))
-
     def toggle_pad_by_note(self, note: int):
         current_page = self.get_current_page()
-        x, y = self.get_current_page().get_coords_from_note(note)
-        if x is not None and y is not None and self.legato_on:
-            if self.legato_started:
-                # we must be in the same row
-                if y != self._legato_y:
-                    return 'not-changed'
-                current_page.set_pad(x, y, PadData(
-                    note,
-                    not (
-                        current_page.pads[x][y] is not None and current_page.pads[x][y].is_on),
-                    127,
-                    NoteType.NOTE_OFF))
-                end_location = PadLocation(
-                    current_page.channel.number, current_page.number, x, y)
-                self._fill_range(self._last_location, end_location)
-                self.legato_started = False
-                return None
-            else:
-                current_page.set_pad(x, y, PadData(
-                    note, not current_page.pads[x][y].is_on, 127, NoteType.NOTE_ON))
-                self.legato_started = True
-                self._legato_y = y
-                self._last_location = PadLocation(
-                    current_page.channel.number, current_page.number, x, y)
-                return self._last_location
-        elif not self.legato_started:
-            return self.get_current_page().toggle_pad_by_note(note)
+        x, y = current_page.get_coords_from_note(note)
+        if x is None or y is None:
+            return current_page.toggle_pad_by_note(note)
+        step = current_page.number * STEPS_PER_PAGE + x
+        if self.legato_started:
+            # we must be in the same row
+            if y != self._legato_note.row:
+                return 'not-changed'
+            started_note = self._legato_note
+            self.remove_legato_note(started_note)
+            self.legato_started = False
+            if step != started_note.start:
+                # Tapping the start again drops the note instead of ending it there
+                self.add_legato_note(LegatoNote(y, started_note.start, step, started_note.velocity))
+            return None
+        legato_note = self.legato.find(y, step)
+        if legato_note is not None:
+            # A tap anywhere on a legato note removes all of it
+            self.remove_legato_note(legato_note)
+            return None
+        if self.legato_on:
+            # Plays as a one step note until its end is tapped
+            self._legato_note = LegatoNote(y, step, step)
+            self.add_legato_note(self._legato_note)
+            self.legato_started = True
+            return PadLocation(self.number, current_page.number, x, y)
+        return current_page.toggle_pad_by_note(note)
+
+    def add_legato_note(self, note: LegatoNote):
+        """Adds a legato note, the notes and pads it covers on its row are removed"""
+        for other in self.legato.overlapping(note):
+            self.remove_legato_note(other)
+        self._clear_pads_under(note)
+        self.legato.add(note)
+        self._notify_legato_changed(note, True)
+
+    def remove_legato_note(self, note: LegatoNote):
+        if self.legato.remove(note):
+            self._notify_legato_changed(note, False)
+
+    def set_legato_velocity(self, note: LegatoNote, velocity: int):
+        updated = note.with_velocity(velocity)
+        self.remove_legato_note(note)
+        self.add_legato_note(updated)
+        if self.legato_started and self._legato_note == note:
+            self._legato_note = updated
+
+    def _notify_legato_changed(self, note: LegatoNote, is_added: bool):
+        for listener in self.listeners:
+            listener.on_legato_changed(self, note, is_added)
+        self.on_page_updated(self.get_current_page())
+
+    def _clear_pads_under(self, note: LegatoNote):
+        """Turns off the pads a legato note is drawn over, every touched page is updated once"""
+        step_count = len(self.pages) * STEPS_PER_PAGE
+        if note.wraps:
+            steps = itertools.chain(range(note.start, step_count), range(note.end + 1))
         else:
-            return 'not-changed'
+            steps = range(note.start, min(note.end + 1, step_count))
+        pages: Dict[int, List[List[PadData]]] = {}
+        for step in steps:
+            page_number, x = divmod(step, STEPS_PER_PAGE)
+            page = self.pages.get(page_number)
+            if page is None or not page.pads[x][note.row].is_on:
+                continue
+            columns = pages.get(page_number)
+            if columns is None:
+                columns = pages[page_number] = [list(column) for column in page.pads]
+            columns[x][note.row] = EMPTY_PADS[x][note.row]
+        for page_number, columns in pages.items():
+            self.pages[page_number].set_pads(tuple(tuple(column) for column in columns))
 
     def add_listener(self, listener: Listener):
         self.listeners = self.listeners | {listener}
@@ -185,36 +268,94 @@ class Channel(Page.Listener):
     def remove_listener(self, listener: Listener):
         self.listeners = self.listeners - {listener}
 
-    def __init__(self, number, launchpad, midi_outport, debug):
+    def __init__(
+        self,
+        number,
+        controllers,
+        midi_outport,
+        debug,
+        voices: Optional[VoiceTable] = None,
+        midi_channel: Optional[int] = None,
+    ):
         self._done = False
         self.is_active = False
         self.midi_outport = midi_outport
-        self.launchpad = launchpad
+        # Channels past the 16th send on another port, so the MiDI channel can differ from the number
+        self.midi_channel = number if midi_channel is None else midi_channel
+        # Notes are played by a worker process, here the channel only follows the clock
+        self.remote = False
+        # Sounding notes, shared by the channels that send to the same output
+        self.voices = voices or VoiceTable()
+        # Knob feedback of the current channel's params, grids draw channels on their own
+        self.controllers = controllers
         self.launchpad_layout = LaunchpadLayout()
 
-        self.listeners: set[Channel.Listener] = set([])
+        self.listeners: Set[Channel.Listener] = set([])
         self._legato_on = False
         self.legato_started = False
+        # Legato note waiting for its end to be tapped
+        self._legato_note: Optional[LegatoNote] = None
 
         self.number = number
-        self.pages: list[Page] = []
-        for i in range(PAGES):
-            page = Page(self, i)
-            page.add_listener(self)
-            self.pages.append(page)
+        # Pattern length in steps, pages are only stored once they are touched
+        self._length = PAGES * STEPS_PER_PAGE
+        self.pages = SparsePages(self)
         self.current_page = 0
+        # Per-step locks as step -> ((control, value), ...), only locked steps are stored
+        self.locks: Dict[int, Tuple[Tuple[int, int], ...]] = {}
+        # Set while a history snapshot holds `locks`, the next edit copies them first
+        self._locks_shared = False
+        self.legato = LegatoIndex()
 
         # Sequencer state and control
         self._running = True
         self._debug = debug
         self._position = 0
         self._num_clocks = 0
-        self._prev_step = 0
-        self._queued_messages: list[QueueMessage] = []
+        # Play the current step on the next clock even if the position didn't move, e.g. after a seek
+        self._replay_step = True
+        self._scheduler = TickScheduler()
+        # Pending note offs of sounding notes, by MiDI channel and note
+        self._note_offs: Dict[Tuple[int, int], asyncio.TimerHandle] = {}
+        self._queued_messages: List[QueueMessage] = []
         self._octave_shift = 2
-        self._rate = 2
-        self._held_keys_from_host: set[int] = set()
+        self._rate = DEFAULT_RATE
         self._gate = 100
+        self._swing = 50
+        self._groove = 0
+        self._quick_arp = 0
+        self._scale = 0
+        self._key = 0
+        self._polyphony = 0
+        # Output note for every arpeggiator note by scale, key and octave shift, built when first needed
+        self._note_tables: Dict[Tuple[int, int, int], List[int]] = {}
+        self.grooves: List[Groove] = []
+        # Offsets of each step, rebuilt when swing, groove or rate change
+        self._groove_table: List[Tuple[int, float, int]] = []
+        self._groove_table_key: Optional[tuple] = None
+        self._tempo = TempoTracker()
+        # Times note offs and fractions of a clock, the renderer swaps in a virtual timer
+        self.timer = LoopTimer()
+        self._held_keys_from_host: Set[int] = set()
+        self._held_keys_in_order: List[int] = []
+        self._arp_mode = 0
+        self._arp_octaves = 8
+        self._arp_seed = 0
+        # Notes each pad row plays, rebuilt only when held keys or arp params change
+        self._arp_notes: List[Tuple[int, ...]] = []
+        self._arp_notes_key: Optional[tuple] = None
+        # Fill conditions play while this is on
+        self.fill_on = False
+        # Captures host notes into the pattern while the channel records
+        self.recorder: Optional[Recorder] = None
+        # Dice rolls of every pad for the current pattern loop, drawn in one batch when a loop starts
+        self._trig_rolls = b""
+        self._trig_rolls_key: Optional[tuple] = None
+
+        # Pattern bank
+        self.pattern_name: Optional[str] = None
+        self._pattern_bank = None
+        self._queued_pattern: Optional[str] = None
 
         self.init_controller_params()
 
@@ -223,71 +364,161 @@ class Channel(Page.Listener):
         for page in self.pages:
             page.remove_listener(self)
         self._queued_messages = []
+        self._scheduler.clear()
+        self.release_notes()
+
+    def release_notes(self):
+        """Ends every note the channel is sounding, nothing is left hanging in the synth"""
+        for handle in self._note_offs.values():
+            handle.cancel()
+        self._note_offs = {}
+        notes = self.voices.release_all(self.midi_channel)
+        if self.midi_outport is None:
+            return
+        for note in notes:
+            self.midi_outport.send(mido.Message("note_off", channel=self.midi_channel, note=note, velocity=0))
 
     def init_controller_params(self):
         for param in PARAMS:
-            self.launchpad.init_controller_param(
+            self.controllers.init_controller_param(
                 param.control,
                 int(get_value_from_proportion(
                     get_proportion_from_value(
-                        getattr(self, param.attribute_name),
+                        clip_to_range(getattr(self, param.attribute_name),
+                                      param.min_value, param.max_value),
                         param.min_value, param.max_value),
                     0,
                     127)))
 
     def proceess_host_note_message(self, msg: NoteMessage):
-        if msg.type == 'note_on':
+        if msg.type == 'note_on' and msg.note not in self._held_keys_from_host:
             self._held_keys_from_host = self._held_keys_from_host | {msg.note}
-        elif msg.type == 'note_off':
+            self._held_keys_in_order = self._held_keys_in_order + [msg.note]
+        elif msg.type == 'note_off' and msg.note in self._held_keys_from_host:
             self._held_keys_from_host = self._held_keys_from_host - {msg.note}
+            self._held_keys_in_order = [key for key in self._held_keys_in_order if key != msg.note]
+        self._update_arp_notes()
+        if self.recorder is not None:
+            self._capture_host_note(msg)
+
+    @property
+    def recording(self) -> bool:
+        return self.recorder is not None
+
+    def set_recording(self, recording: bool) -> None:
+        if recording and self.recorder is None:
+            self.recorder = Recorder()
+        elif not recording and self.recorder is not None:
+            self._write_recorded_notes()
+            self.recorder = None
+
+    def _capture_host_note(self, msg: NoteMessage) -> None:
+        tick = max(0.0, self._num_clocks - 1 + self._tempo.clocks_since_last(self.timer.now()))
+        if msg.type == 'note_on' and msg.velocity:
+            # Pads pick held keys by arp index, so the key is recorded on the row that plays it now
+            row = next((i for i, notes in enumerate(self._arp_notes) if msg.note in notes), ROWS)
+            if row < ROWS:
+                self.recorder.capture(tick, msg.note, msg.velocity, row)
+        else:
+            self.recorder.release(tick, msg.note)
+
+    def _write_recorded_notes(self) -> None:
+        """Writes captured notes into the pages, every touched page is updated once"""
+        pads, legato = self.recorder.drain(RATES_TO_STEP_SIZES[self._rate], self._length)
+        pages: Dict[int, List[Tuple[PadData, ...]]] = {}
+        for step, y, velocity in pads:
+            page_number, x = divmod(step, STEPS_PER_PAGE)
+            columns = pages.get(page_number)
+            if columns is None:
+                columns = pages[page_number] = list(self.pages[page_number].pads)
+            column = columns[x]
+            columns[x] = column[:y] + (PadData(Page.get_note(x, y), True, velocity),) + column[y + 1:]
+        for page_number, columns in pages.items():
+            self.pages[page_number].set_pads(tuple(columns))
+        for note in legato:
+            self.add_legato_note(note)
+
+    def _update_arp_notes(self):
+        self._arp_notes = build_arp_sequence(
+            ARP_MODES[self._arp_mode], self._held_keys_in_order, self._arp_octaves, self._arp_seed)
+        self._arp_notes_key = (self._arp_mode, self._arp_octaves, self._arp_seed)
 
     def process_host_clock_message(self, msg: ClockMessage) -> None:
         if msg.type == 'clock':
-            # This could be calculated mathematically
-            # TODO: Make rate snap to these values
-            rates_to_step_sizes = {
-                0.25: 48,
-                0.5: 24,
-                1: 12,
-                2: 6,
-                3: 3,
-            }
-            self._position = math.floor(
-                self._num_clocks / rates_to_step_sizes[self._rate])
-            self._num_clocks += 1
+            if self._queued_pattern is not None and self._num_clocks % CLOCKS_PER_BAR == 0:
+                self._switch_to_queued_pattern()
             self._running = True
+            self._tempo.clock(self.timer.now())
+            self._scheduler.run_until(self._num_clocks)
+            position = get_step_for_clock(
+                self._num_clocks, RATES_TO_STEP_SIZES[self._rate])
+            if position != self._position or self._replay_step:
+                self._replay_step = False
+                self._position = position
+                self._play_step(position)
+            if self.recorder is not None:
+                # After the step is out, so recording doesn't delay its notes
+                self._write_recorded_notes()
+            self._num_clocks += 1
         elif msg.type == 'songpos':
-            self._num_clocks = 0
-            # songpos is expressed in 16th notes
-            current_bar_0_indexed = math.floor(msg.pos / 16)
-            next_position_in_16ths = msg.pos - (current_bar_0_indexed * 16)
-            next_position_in_8ths = math.floor(next_position_in_16ths / 2)
-            self._position = next_position_in_8ths
+            self._seek(get_clock_for_song_position(msg.pos))
+        elif msg.type == 'start':
+            self._seek(0)
+            self._running = True
         elif msg.type == 'stop':
-            self._position = 0
-            self._num_clocks = 0
-            self.set_page(0)
             self._running = False
-        elif msg.type == 'continue':
-            self._position = 0
-            self._num_clocks = 0
+            self._tempo.reset()
+            self._seek(0)
+            self.release_notes()
             self.set_page(0)
+        elif msg.type == 'continue':
             self._running = True
         elif self._debug:
             print(f'We don''t know about this clock message type: {msg}')
 
-    async def _sleep(self) -> None:
-        while not self._done and self._prev_step == self._position:
-            await asyncio.sleep(0.001)
-        self._prev_step = self._position
+    def next_busy_clock(self) -> int:
+        """
+        Returns the first clock from the current one on that has work: a step, a repeat or a pattern switch.
+
+        The clocks before it only count, so the renderer skips them with `skip_to_clock`.
+        """
+        clock = self._num_clocks
+        step_size = RATES_TO_STEP_SIZES[self._rate]
+        if self._replay_step or self.recorder is not None or clock // step_size != self._position:
+            return clock
+        busy = -(-clock // step_size) * step_size
+        if self._queued_pattern is not None:
+            busy = min(busy, -(-clock // CLOCKS_PER_BAR) * CLOCKS_PER_BAR)
+        if self._scheduler:
+            busy = min(busy, self._scheduler.next_tick())
+        return busy
+
+    def skip_to_clock(self, clock: int) -> None:
+        """Lets the clocks before `next_busy_clock` pass without handling each one"""
+        if clock > self._num_clocks:
+            self._num_clocks = clock
+            # The skipped clocks are a gap, not tempo
+            self._tempo.reset()
+
+    def _seek(self, clock: int) -> None:
+        """Moves to the step playing at the given clock, pages come from clock math so any jump is O(1)"""
+        if self.recorder is not None:
+            # Captured ticks belong to the old position
+            self._write_recorded_notes()
+            self.recorder.forget_held()
+        self._num_clocks = clock
+        self._position = get_step_for_clock(clock, RATES_TO_STEP_SIZES[self._rate])
+        # Steps start on the clock, so the step at the new position plays as soon as the next one arrives
+        self._replay_step = True
+        self._scheduler.clear()
 
     def _notify_channel_or_page_changed(self):
         for listener in self.listeners:
-            listener.on_page_changed(
-                self.get_current_page().number)
+            listener.on_page_changed(self.current_page)
 
     def set_page(self, page: int):
-        self.current_page = page
+        # Pages past the length don't exist, the last one is shown instead
+        self.current_page = min(page, len(self.pages) - 1)
         self._notify_channel_or_page_changed()
 
     def on_page_updated(self, page: Page):
@@ -295,19 +526,220 @@ class Channel(Page.Listener):
             for listener in self.listeners:
                 listener.on_page_updated(page)
 
+    def on_pad_changed(self, page: Page, x: int, y: int):
+        for listener in self.listeners:
+            listener.on_pad_changed(self, page, x, y)
+
     def get_current_page(self):
         return self.pages[self.current_page]
 
+    def copy_page(self, source: int, target: int):
+        target_page = copy(self.pages[source])
+        target_page.number = target
+        self.pages[target] = target_page
+        offset = (target - source) * STEPS_PER_PAGE
+        all_locks = self._writable_locks()
+        for x in range(STEPS_PER_PAGE):
+            all_locks.pop(target * STEPS_PER_PAGE + x, None)
+            locks = all_locks.get(source * STEPS_PER_PAGE + x)
+            if locks:
+                all_locks[source * STEPS_PER_PAGE + x + offset] = locks
+        # Legato notes that start and end on the source page come along, like its pads
+        first, last = target * STEPS_PER_PAGE, (target + 1) * STEPS_PER_PAGE - 1
+        for note in list(self.legato.in_steps(first, last)):
+            if not note.wraps and first <= note.start and note.end <= last:
+                self.legato.remove(note)
+        first, last = source * STEPS_PER_PAGE, (source + 1) * STEPS_PER_PAGE - 1
+        for note in list(self.legato.in_steps(first, last)):
+            if not note.wraps and first <= note.start and note.end <= last:
+                self.legato.add(LegatoNote(note.row, note.start + offset, note.end + offset, note.velocity))
+        for listener in self.listeners:
+            listener.on_page_copied(self, source, target)
+
     def copy_to_next_page(self):
-        next_index = (self.current_page + 1) % PAGES
-        current_page = self.pages[self.current_page]
-        self.pages[next_index].remove_listener(self)
-        next_page = copy(current_page)
-        next_page.number = next_index
-        next_page.add_listener(self)
-        self.pages[next_index] = next_page
+        next_index = (self.current_page + 1) % len(self.pages)
+        self.copy_page(self.current_page, next_index)
         self.set_page(next_index)
 
+    def queue_pattern(self, pattern_bank, name: str):
+        """Switches to a pattern from the bank when the next bar starts"""
+        self._pattern_bank = pattern_bank
+        self._queued_pattern = name
+        pattern_bank.request(name)
+        if not self._running:
+            self._switch_to_queued_pattern()
+
+    def _switch_to_queued_pattern(self):
+        try:
+            pattern = self._pattern_bank.get(self._queued_pattern)
+        except Exception as e:
+            # Dropped, or the switch would try the broken file again on every bar
+            print(f"Can't load pattern {self._queued_pattern}: {e}")
+            self._queued_pattern = None
+            return
+        if pattern is None:
+            # Still decoding, try again on the next bar instead of holding up this step
+            return
+        self._queued_pattern = None
+        self.load_pattern(pattern)
+
+    def load_pattern(self, pattern):
+        self.release_notes()
+        self.set_params(pattern.params)
+        self.set_locks(pattern.locks)
+        self.set_legato_notes(pattern.legato)
+        pages = SparsePages(self)
+        for page_number, x, y, pad_data in pattern.pads:
+            if page_number < len(pages):
+                pages[page_number].set_pad(x, y, pad_data)
+        for page in self.pages:
+            page.remove_listener(self)
+        self.pages = pages
+        self.current_page = min(self.current_page, len(pages) - 1)
+        self.pattern_name = pattern.name
+        for listener in self.listeners:
+            listener.on_pages_replaced(self)
+        if self.is_active:
+            self.init_controller_params()
+        self._notify_channel_or_page_changed()
+
+    def replace_pads(self, pages: dict) -> None:
+        """Swaps in the pads of many pages at once, listeners hear about it once instead of once per pad"""
+        for number, pads in pages.items():
+            self.pages[number].pads = pads
+        for listener in self.listeners:
+            listener.on_pages_replaced(self)
+        self._notify_channel_or_page_changed()
+
+    def get_params(self) -> tuple:
+        return tuple(getattr(self, param.attribute_name) for param in PARAMS)
+
+    def set_params(self, values) -> None:
+        """Sets params in PARAMS order without notifying listeners, used when loading. None keeps a param"""
+        for param, value in zip(PARAMS, values):
+            if value is not None:
+                setattr(self, param.attribute_name, value)
+        self.current_page = min(self.current_page, len(self.pages) - 1)
+
+    def snapshot(self) -> tuple:
+        """
+        Returns pads, params, locks and legato notes in the form `restore` takes.
+
+        Nothing is copied: pads and legato notes are immutable tuples, and the
+        locks are copied by the first edit after the snapshot.
+        """
+        self._locks_shared = True
+        return (
+            {number: self.pages[number].pads for number in self.pages.numbers()},
+            self.get_params(),
+            self.locks,
+            self.legato.notes(),
+        )
+
+    def restore(
+        self,
+        pages: Optional[dict],
+        params: Optional[tuple],
+        locks: Optional[dict],
+        legato: Optional[tuple],
+        only_given_pages: bool = False,
+    ):
+        """
+        Puts back pads, params, locks and legato notes taken from a history snapshot.
+
+        Parts given as None stay as they are. With `only_given_pages` pages
+        missing from `pages` are kept instead of cleared, workers get only
+        the pages that were edited.
+        """
+        if params is not None:
+            for param, value in zip(PARAMS, params):
+                if getattr(self, param.attribute_name) != value:
+                    self.set_param(param, value)
+        if pages is not None:
+            numbers = set(pages) if only_given_pages else set(pages) | set(self.pages.numbers())
+            for number in numbers:
+                pads = pages.get(number, EMPTY_PADS)
+                page = self.pages.get(number)
+                if page is None and pads is not EMPTY_PADS and number < len(self.pages):
+                    page = self.pages[number]
+                if page is not None and page.pads is not pads:
+                    page.set_pads(pads)
+        if locks is not None and locks is not self.locks:
+            for step in set(locks) | set(self.locks):
+                if locks.get(step) != self.locks.get(step):
+                    previous, current = dict(self.locks.get(step, ())), dict(locks.get(step, ()))
+                    for control in set(previous) | set(current):
+                        if previous.get(control) != current.get(control):
+                            self.set_lock(step, control, current.get(control))
+        if legato is not None and legato is not self.legato.notes():
+            current_legato, snapshot_legato = set(self.legato.notes()), set(legato)
+            for note in current_legato - snapshot_legato:
+                self.remove_legato_note(note)
+            for note in snapshot_legato - current_legato:
+                self.add_legato_note(note)
+        if self.is_active:
+            self.init_controller_params()
+
+    def set_param(self, param: Param, value):
+        setattr(self, param.attribute_name, value)
+        if self.current_page >= len(self.pages):
+            # The length shrank past the shown page
+            self.set_page(self.current_page)
+        for listener in self.listeners:
+            listener.on_param_changed(self, param)
+
+    def set_lock(self, step: int, control: int, value: Optional[int]):
+        """Locks a param or CC to a value on one step, None removes the lock"""
+        locks = tuple((c, v) for c, v in self.locks.get(step, ()) if c != control)
+        if value is not None:
+            locks += ((control, value),)
+        all_locks = self._writable_locks()
+        if locks:
+            all_locks[step] = locks
+        else:
+            all_locks.pop(step, None)
+        for listener in self.listeners:
+            listener.on_lock_changed(self, step, control)
+
+    def _writable_locks(self) -> Dict[int, Tuple[Tuple[int, int], ...]]:
+        """Returns the locks to edit in place, copied first if a history snapshot holds them"""
+        if self._locks_shared:
+            self.locks = dict(self.locks)
+            self._locks_shared = False
+        return self.locks
+
+    def iter_locks(self):
+        """Yields (step, control, value) for every lock"""
+        for step, locks in self.locks.items():
+            for control, value in locks:
+                yield step, control, value
+
+    def set_locks(self, locks) -> None:
+        """Replaces locks with (step, control, value) records without notifying listeners"""
+        self.locks = {}
+        self._locks_shared = False
+        for step, control, value in locks:
+            self.locks[step] = self.locks.get(step, ()) + ((control, value),)
+
+    def set_legato_notes(self, notes) -> None:
+        """Replaces legato notes without notifying listeners"""
+        self.legato.set_notes(notes)
+
+    def clear_locks(self, step: int):
+        for control, _value in self.locks.get(step, ()):
+            self.set_lock(step, control, None)
+
+    def _resolve_locks(self, locks) -> Tuple[dict, List[Tuple[int, int]]]:
+        """Splits a step's locks into param values by attribute name and CCs to send"""
+        params = {}
+        control_changes = []
+        for control, value in locks:
+            if control in CC_LOCKS:
+                control_changes.append((CC_LOCKS[control], value))
+            else:
+                params[LOCKABLE_PARAMS[control].attribute_name] = value
+        return params, control_changes
+
     def __str__(self):
         return f"Channel(number={self.number}, page={self.get_current_page().number})"
 
@@ -315,126 +747,194 @@ class Channel(Page.Listener):
         if self._debug:
             print(f"Processing incoming CONTROLLER message: {msg}")
 
-        if self.is_active and ControlMessage.is_control(msg):
+        if self.is_active and ControlMessage.is_control(msg) and msg.channel == KNOB_CHANNEL:
             control_values = map(lambda p: p.control, PARAMS)
             if msg.control in control_values:
                 param = list(
                     filter(lambda p: p.control == msg.control, PARAMS))[0]
-                value = get_value_from_proportion(control_message_to_proportion(msg.value),
-                                                         param.min_value,
-                                                         param.max_value)
-                _snapped_index, snapped_value = snap(
-                    value, range(param.min_value, param.max_value + 1))
-                setattr(self, param.attribute_name, snapped_value)
+                self.set_param(param, get_param_value(param, msg.value))
 
     def _queue_message(self, msg: QueueMessage):
         self._queued_messages.append(msg)
 
-    async def _send_queued_messages(self):
+    def _get_note_table(self, octave_shift: int) -> List[int]:
+        key = (self._scale, self._key, octave_shift)
+        table = self._note_tables.get(key)
+        if table is None:
+            table = self._note_tables[key] = build_note_table(self._scale, self._key, octave_shift)
+        return table
+
+    def _pop_queued_messages(self, octave_shift: Optional[int] = None) -> List[QueueMessage]:
+        """Returns the queued messages transformed for output and clears the queue"""
+        note_table = self._get_note_table(self._octave_shift if octave_shift is None else octave_shift)
         messages = []
         for msg in self._queued_messages:
             transformed_msg = copy(msg)
-            transformed_msg.note = shift_octaves(msg.note, self._octave_shift)
-            if transformed_msg.note >= 0 and transformed_msg.note < 128:
-                messages.append(transformed_msg)
-        quick_arpeggio_mode = False
-        if quick_arpeggio_mode:
-            # TODO: Calculate note length
-            note_length = 0.1
-            for message in messages:
-                await self.send_note(message, note_length)
-        else:
-            await self.send_notes(messages, max(1, self._gate) / 1000.0)
+            transformed_msg.note = note_table[msg.note]
+            messages.append(transformed_msg)
         self._queued_messages = []
+        return messages
+
+    def _send_queued_messages(self, locks=None):
+        params: dict = {}
+        if locks:
+            params, control_changes = self._resolve_locks(locks)
+            for control, value in control_changes:
+                self.midi_outport.send(mido.Message(
+                    "control_change", channel=self.midi_channel, control=control, value=value))
+        messages = self._pop_queued_messages(params.get('_octave_shift'))
+        gate = max(1, params.get('_gate', self._gate)) / 1000.0
+        full_notes = [message for message in messages if message.note_type == NoteType.FULL]
+        if self._quick_arp and len(full_notes) > 1:
+            self.send_notes([message for message in messages if message.note_type != NoteType.FULL], gate)
+            # Notes take equal parts of the step, timed from the host clock
+            spacing = RATES_TO_STEP_SIZES[self._rate] / len(full_notes)
+            length = min(gate, spacing * self._tempo.seconds_per_clock)
+            for i, message in enumerate(full_notes):
+                self._call_after_clocks(i * spacing, self.send_note, message, length)
+        else:
+            self.send_notes(messages, gate)
+
+    def _call_after_clocks(self, clocks: float, callback, *args) -> None:
+        """Runs a callback after a number of clocks, fractions of a clock are timed from the measured tempo"""
+        whole_clocks = math.floor(clocks)
+        if whole_clocks:
+            self._scheduler.schedule(
+                self._num_clocks + whole_clocks,
+                self._call_after_clocks,
+                clocks - whole_clocks,
+                callback,
+                *args)
+        elif clocks:
+            self.timer.call_later(clocks * self._tempo.seconds_per_clock, callback, *args)
+        else:
+            callback(*args)
 
-    async def send_note(self, message: QueueMessage, length=0.1) -> None:
-        """Send note to virtual MiDI device"""
+    def send_note(self, message: QueueMessage, length=0.1) -> None:
+        """Send note to virtual MiDI device, the note off follows after `length` seconds"""
         # FIXME: Refactor so the QueueMessage doesn't need to capture channel anymore
         # (separate queues per channel now)
+        key = (message.channel, message.note)
+        handle = self._note_offs.pop(key, None)
+        if handle is not None:
+            # Still sounding, end it now so its note off doesn't cut the new note short
+            handle.cancel()
+            self._send_note_off(message)
+        self.send_note_start(message)
+        self._note_offs[key] = self.timer.call_later(length, self._end_note, message)
+
+    def _end_note(self, message: QueueMessage) -> None:
+        self._note_offs.pop((message.channel, message.note), None)
+        self._send_note_off(message)
+
+    def _send_note_off(self, message: QueueMessage) -> None:
+        if not self.voices.note_off(message.channel, message.note):
+            # Already ended, by a release or by giving its voice to a newer note
+            return
         self.midi_outport.send(mido.Message(
-            "note_on", channel=message.channel, note=message.note, velocity=message.velocity))
-        await asyncio.sleep(length)
-        self.midi_outport.send(mido.Message(
-            "note_off", channel=message.channel, note=message.note, velocity=message.velocity))
+            "note_off", skip_checks=True, channel=message.channel, note=message.note,
+            velocity=message.velocity))
 
     def send_note_start(self, message: QueueMessage) -> None:
+        if self.voices.is_active(message.channel, message.note):
+            # A second note on for a sounding note would only stack up in the synth
+            return
+        for note in self.voices.note_on(message.channel, message.note, self._polyphony):
+            handle = self._note_offs.pop((message.channel, note), None)
+            if handle is not None:
+                handle.cancel()
+            self.midi_outport.send(mido.Message(
+                "note_off", skip_checks=True, channel=message.channel, note=note, velocity=0))
+        # Notes come from the note tables and velocities are clipped when queued,
+        # checking them again for every message only costs time
         self.midi_outport.send(mido.Message(
-            "note_on", channel=message.channel, note=message.note, velocity=message.velocity))
+            "note_on", skip_checks=True, channel=message.channel, note=message.note,
+            velocity=message.velocity))
 
     async def send_note_end(self, message: QueueMessage, length=0.1) -> None:
         await asyncio.sleep(length)
-        self.midi_outport.send(mido.Message(
-            "note_on", channel=message.channel, note=message.note, velocity=message.velocity))
-
-    async def send_notes(self, messages: list[QueueMessage], length=0.1) -> None:
-        start_notes = [
-            message for message in messages if message.note_type == NoteType.NOTE_ON]
-        end_notes = [
-            message for message in messages if message.note_type == NoteType.NOTE_OFF]
-        full_notes = [
-            message for message in messages if message.note_type == NoteType.FULL]
-        for message in start_notes:
-            self.send_note_start(message)
-        asyncio.gather(self._do_send_end_notes(end_notes, length),
-                       self._do_send_full_notes(full_notes, length))
-
-    async def _do_send_end_notes(self, end_notes, length):
-        await asyncio.sleep(length)
-        for message in end_notes:
-            self.midi_outport.send(mido.Message(
-                "note_off", channel=message.channel, note=message.note, velocity=message.velocity))
-
-    async def _do_send_full_notes(self, full_notes, length):
-        """Send note to virtual MiDI device"""
-        for message in full_notes:
-            self.midi_outport.send(mido.Message(
-                "note_on", channel=message.channel, note=message.note, velocity=message.velocity))
-        await asyncio.sleep(length)
-        for message in full_notes:
-            self.midi_outport.send(mido.Message(
-                "note_off", channel=message.channel, note=message.note, velocity=message.velocity))
-
-    async def run(self):
-        async for column in self.column_iterator():
-            await self._process_column(column)
-
-    async def _callback(self, pad_number):
-        if self._running and pad_number != None:
-            index_to_pick = self.launchpad_layout.pad_to_arp_index(pad_number)
-            keys = sorted(list(self._held_keys_from_host))
-            if keys:
-                keys_in_octaves: list[int] = []
-                for octaves in range(8):
-                    keys_in_octaves += [shift_octaves(key, octaves)
-                                        for key in keys]
-                out_note = keys_in_octaves[index_to_pick]
-                current_page = self.get_current_page()
-                velocity = current_page.get_velocity_for_pad_number(pad_number)
-                x, y = current_page.get_coords_from_note(pad_number)
-                if x is not None and y is not None:
-                    note_type = current_page.pads[x][y].note_type if current_page.pads[x][y] else None
-                    if note_type is not None:
-                        self._queue_message(QueueMessage(
-                            self.number, out_note, note_type, velocity))
-
-    async def _process_column(self, column: int):
-        self.set_page(get_page_for_tick(column))
-        pads = self.get_current_page().get_pads_in_column(
-            get_page_position_for_tick(column))
-        # TODO: Not sure this needs to be async
-        await asyncio.gather(*[self._callback(p.note if p and p.is_on else None) for p in pads])
-        if self.is_active:
-            # TODO: Refactor so we don't need to know about the launchpad
-            self.launchpad.set_page(self.get_current_page())
-            cursor_pads = map(lambda x: x.note if x else None, pads)
-            self.launchpad.blink_pads(cursor_pads)
-        await self._send_queued_messages()
-        await self._sleep()
-        if self.is_active:
-            cursor_pads = map(lambda x: x.note if x else None, pads)
-            self.launchpad.unblink_pads(cursor_pads)
-
-    async def column_iterator(self):
-        while not self._done:
-            yield self._position
-            await asyncio.sleep(0.001)
+        self._send_note_off(message)
+
+    def send_notes(self, messages: List[QueueMessage], length=0.1) -> None:
+        """Sends the notes of a step, repeats of ratcheted notes are scheduled on the clocks they fall on"""
+        step_size = RATES_TO_STEP_SIZES[self._rate]
+        started = set()
+        for message in messages:
+            if message.note_type == NoteType.NOTE_ON:
+                self.send_note_start(message)
+            elif message.note_type == NoteType.NOTE_OFF:
+                self.timer.call_later(length, self._send_note_off, message)
+            elif message.note_type == NoteType.FULL:
+                if message.note in started:
+                    # Pads of the step that land on the same note play it once
+                    continue
+                started.add(message.note)
+                self.send_note(message, length)
+                for clock in get_ratchet_clocks(step_size, message.ratchets)[1:]:
+                    self._scheduler.schedule(self._num_clocks + clock, self.send_note, message, length)
+
+    def _callback(self, pad_data: PadData, velocity_offset: int = 0):
+        if self._running and pad_data is not None:
+            index_to_pick = self.launchpad_layout.arp_indices[pad_data.note]
+            if self._arp_notes and pad_data.note_type is not None:
+                velocity = clip_to_range(pad_data.velocity + velocity_offset, 1, 127)
+                for out_note in self._arp_notes[index_to_pick % len(self._arp_notes)]:
+                    self._queue_message(QueueMessage(
+                        self.midi_channel, out_note, pad_data.note_type, velocity, pad_data.ratchets))
+
+    def _get_groove_offset(self, column: int) -> Tuple[int, float, int]:
+        """Returns how many clocks, and fraction of a clock, a step is delayed and its velocity offset"""
+        groove = self.grooves[self._groove - 1] if 0 < self._groove <= len(self.grooves) else None
+        key = (groove, self._swing, self._rate)
+        if key != self._groove_table_key:
+            self._groove_table = build_groove_table(groove, self._swing, RATES_TO_STEP_SIZES[self._rate])
+            self._groove_table_key = key
+        return self._groove_table[column % len(self._groove_table)]
+
+    def get_step_locks(self, column: int):
+        """Returns the locks of the step playing at a column, None when it has none"""
+        if not self.locks:
+            return None
+        return self.locks.get(column % self._length)
+
+    def _queue_column(self, column: int, velocity_offset: int = 0) -> List[Optional[PadData]]:
+        """Turns the page to the given step and queues the notes of its active pads"""
+        if self._arp_notes_key != (self._arp_mode, self._arp_octaves, self._arp_seed):
+            self._update_arp_notes()
+        page_number = get_page_for_tick(column, self._length)
+        self.set_page(page_number)
+        page = self.pages.get(page_number)
+        pads = (page.pads if page else EMPTY_PADS)[get_page_position_for_tick(column, self._length)]
+        for y, p in enumerate(pads):
+            if p.is_on and (not p.condition or self._trig_passes(p.condition, column, y)):
+                self._callback(p, velocity_offset)
+        if self.legato:
+            for pad_data in self.legato.events_at(column % self._length):
+                self._callback(pad_data, velocity_offset)
+        return pads
+
+    def _trig_passes(self, condition: int, column: int, y: int) -> bool:
+        loop, step = divmod(column, self._length)
+        roll = 0
+        if needs_roll(condition):
+            key = (self._arp_seed, loop, self._length)
+            if key != self._trig_rolls_key:
+                self._trig_rolls = build_trig_rolls(self._arp_seed, self.number, loop, self._length * ROWS)
+                self._trig_rolls_key = key
+            roll = self._trig_rolls[step * ROWS + y]
+        return trig_passes(condition, loop, roll, self.fill_on)
+
+    def _play_step(self, column: int):
+        """Plays a step, called on the clock it starts on"""
+        if self.remote:
+            self.set_page(get_page_for_tick(column, self._length))
+            return
+        clocks, clock_fraction, velocity_offset = self._get_groove_offset(column)
+        self._queue_column(column, velocity_offset)
+        if self.midi_outport is None:
+            # Nothing to play into, the renderer gives channels ports of its own
+            self._queued_messages = []
+            return
+        locks = self.get_step_locks(column)
+        if self._queued_messages or locks:
+            self._call_after_clocks(clocks + clock_fraction, self._send_queued_messages, locks)
@@ -1,9 +1,25 @@
-import asyncio
-from lss.midi import NoteMessage
-from .channel import Channel
+from typing import List, Optional, Set
+
+from lss.history import History
+from lss.midi import ControlMessage, NoteMessage
+from lss.groove import Groove
+from .channel import (
+    KNOB_CHANNEL,
+    LOCKABLE_PARAMS,
+    MAX_GROOVES,
+    PARAMS,
+    STEPS_PER_PAGE,
+    Channel,
+    Param,
+    get_param_value,
+)
+from .legato import LegatoNote
 from .page import PadLocation, Page
+from .transforms import PatternArray
+from .voices import MIDI_CHANNELS, VoiceTable
 
 CHANNELS = 8
+PARAM_CONTROLS = {param.control for param in PARAMS}
 
 
 class ChannelsManager(Channel.Listener):
@@ -14,6 +30,24 @@ class ChannelsManager(Channel.Listener):
         def on_page_updated(self, page: Page):
             return NotImplementedError
 
+        def on_pad_changed(self, channel: Channel, page: Page, x: int, y: int):
+            return NotImplementedError
+
+        def on_param_changed(self, channel: Channel, param: Param):
+            return NotImplementedError
+
+        def on_page_copied(self, channel: Channel, source: int, target: int):
+            return NotImplementedError
+
+        def on_pages_replaced(self, channel: Channel):
+            return NotImplementedError
+
+        def on_lock_changed(self, channel: Channel, step: int, control: int):
+            return NotImplementedError
+
+        def on_legato_changed(self, channel: Channel, note: LegatoNote, is_added: bool):
+            return NotImplementedError
+
     @property
     def legato_on(self):
         return self._legato_on
@@ -34,15 +68,36 @@ class ChannelsManager(Channel.Listener):
     def remove_listener(self, listener):
         self.listeners = self.listeners - {listener}
 
-    def __init__(self, launchpad, midi_outport, debug):
+    def __init__(
+        self,
+        controllers,
+        midi_outports: list,
+        debug,
+        history_depth: int = 100,
+        channel_count: int = CHANNELS,
+        channels_per_port: int = MIDI_CHANNELS,
+    ):
+        """
+        Channels fill the MiDI channels of the first output port, then go on
+        to the next port. Without ports channels play nothing until they are
+        given one, as the renderer does.
+        """
+        if not 0 < channels_per_port <= MIDI_CHANNELS:
+            raise ValueError(f"A port has 1 to {MIDI_CHANNELS} channels, got {channels_per_port}")
         self._debug = debug
-        self.launchpad = launchpad
+        self.history = History(self, history_depth)
+        self.controllers = controllers
+        self.channels_per_port = channels_per_port
         self._legato_on = False
 
-        self.listeners: set[ChannelsManager.Listener] = set([])
-        self.channels: list[Channel] = []
-        for i in range(CHANNELS):
-            channel = Channel(i, launchpad, midi_outport, debug)
+        self.listeners: Set[ChannelsManager.Listener] = set([])
+        self.channels: List[Channel] = []
+        # Sounding notes of each port, shared by the channels that send to it
+        self.voices = [VoiceTable() for _ in range(-(-channel_count // channels_per_port))]
+        for i in range(channel_count):
+            port, midi_channel = divmod(i, channels_per_port)
+            midi_outport = midi_outports[port] if port < len(midi_outports) else None
+            channel = Channel(i, controllers, midi_outport, debug, self.voices[port], midi_channel)
             channel.add_listener(self)
             self.channels.append(channel)
         self.set_channel(0)
@@ -53,11 +108,85 @@ class ChannelsManager(Channel.Listener):
             channel.close()
 
     def set_velocity(self, pad_location: PadLocation, velocity: int):
+        self.history.record(
+            [pad_location.channel],
+            key=("velocity", pad_location.channel, pad_location.page, pad_location.x, pad_location.y))
         channel = self.channels[pad_location.channel]
+        legato_note = channel.legato.find(pad_location.y, pad_location.page * STEPS_PER_PAGE + pad_location.x)
+        if legato_note is not None:
+            # The whole note takes the velocity
+            channel.set_legato_velocity(legato_note, velocity)
+            return
         page = channel.pages[pad_location.page]
         page.set_velocity(
             pad_location.x, pad_location.y, velocity)
 
+    def set_ratchets(self, pad_location: PadLocation, ratchets: int):
+        self.history.record(
+            [pad_location.channel],
+            key=("ratchets", pad_location.channel, pad_location.page, pad_location.x, pad_location.y))
+        channel = self.channels[pad_location.channel]
+        page = channel.pages[pad_location.page]
+        page.set_ratchets(
+            pad_location.x, pad_location.y, ratchets)
+
+    def set_condition(self, pad_location: PadLocation, condition: int):
+        self.history.record(
+            [pad_location.channel],
+            key=("condition", pad_location.channel, pad_location.page, pad_location.x, pad_location.y))
+        channel = self.channels[pad_location.channel]
+        page = channel.pages[pad_location.page]
+        page.set_condition(
+            pad_location.x, pad_location.y, condition)
+
+    def set_fill(self, fill_on: bool):
+        """Fill conditions play while fill is on, not fill ones while it is off"""
+        for channel in self.channels:
+            channel.fill_on = fill_on
+
+    def toggle_recording(self) -> bool:
+        """Starts or stops recording host notes into the current channel, returns whether it records"""
+        channel = self._get_current_channel_object()
+        if not channel.recording:
+            # Everything recorded in one take is undone at once
+            self.history.record([self.current_channel])
+        channel.set_recording(not channel.recording)
+        return channel.recording
+
+    def set_lock(self, pad_location: PadLocation, control: int, control_value: int):
+        """Locks what a knob controls to its current position on the step of a pad"""
+        self.history.record(
+            [pad_location.channel],
+            key=("lock", pad_location.channel, pad_location.page, pad_location.x, control))
+        channel = self.channels[pad_location.channel]
+        param = LOCKABLE_PARAMS.get(control)
+        value = get_param_value(param, control_value) if param else control_value
+        channel.set_lock(pad_location.page * STEPS_PER_PAGE + pad_location.x, control, value)
+
+    def clear_locks(self, pad_location: PadLocation):
+        self.history.record([pad_location.channel])
+        channel = self.channels[pad_location.channel]
+        channel.clear_locks(pad_location.page * STEPS_PER_PAGE + pad_location.x)
+
+    def transform(self, transform, channels: Optional[List[int]] = None):
+        """
+        Runs `transform` on the pattern of each channel, all channels by default.
+
+        `transform` takes and returns a PatternArray. Every channel is written
+        back in one batch and the whole edit is a single undo step.
+        """
+        self.history.record(channels)
+        for number in range(len(self.channels)) if channels is None else channels:
+            channel = self.channels[number]
+            pages = transform(PatternArray.from_channel(channel)).to_pages(channel)
+            if pages:
+                channel.replace_pads(pages)
+
+    def set_grooves(self, grooves: List[Groove]):
+        """Makes groove templates available to every channel, the groove param picks one"""
+        for channel in self.channels:
+            channel.grooves = grooves[:MAX_GROOVES]
+
     def proceess_host_note_message(self, msg: NoteMessage):
         for channel in self.channels:
             channel.proceess_host_note_message(msg)
@@ -73,6 +202,9 @@ class ChannelsManager(Channel.Listener):
         return self._get_current_channel_object().get_current_page()
 
     def set_page(self, page: int):
+        if page >= len(self._get_current_channel_object().pages):
+            # Page buttons past the channel's length do nothing
+            return
         self._get_current_channel_object().set_page(page)
         if self._debug:
             print(self._get_current_channel_object().get_current_page())
@@ -97,6 +229,30 @@ class ChannelsManager(Channel.Listener):
     def on_page_changed(self, pagenum: int):
         self._notify_channel_or_page_changed()
 
+    def on_pad_changed(self, channel: Channel, page: Page, x: int, y: int):
+        for listener in self.listeners:
+            listener.on_pad_changed(channel, page, x, y)
+
+    def on_param_changed(self, channel: Channel, param: Param):
+        for listener in self.listeners:
+            listener.on_param_changed(channel, param)
+
+    def on_page_copied(self, channel: Channel, source: int, target: int):
+        for listener in self.listeners:
+            listener.on_page_copied(channel, source, target)
+
+    def on_pages_replaced(self, channel: Channel):
+        for listener in self.listeners:
+            listener.on_pages_replaced(channel)
+
+    def on_lock_changed(self, channel: Channel, step: int, control: int):
+        for listener in self.listeners:
+            listener.on_lock_changed(channel, step, control)
+
+    def on_legato_changed(self, channel: Channel, note: LegatoNote, is_added: bool):
+        for listener in self.listeners:
+            listener.on_legato_changed(channel, note, is_added)
+
     def _notify_channel_or_page_changed(self):
         for listener in self.listeners:
             listener.on_channel_or_page_changed(
@@ -104,15 +260,41 @@ class ChannelsManager(Channel.Listener):
                 self.get_current_page().number)
 
     def copy_to_next_page(self):
+        self.history.record([self.current_channel])
         self._get_current_channel_object().copy_to_next_page()
         self._notify_channel_or_page_changed()
 
+    def queue_neighbour_pattern(self, pattern_bank, offset: int):
+        channel = self._get_current_channel_object()
+        name = pattern_bank.neighbour(channel._queued_pattern or channel.pattern_name, offset)
+        if name is not None:
+            channel.queue_pattern(pattern_bank, name)
+
+    def store_pattern(self, pattern_bank):
+        channel = self._get_current_channel_object()
+        if channel.pattern_name is None:
+            channel.pattern_name = pattern_bank.next_name()
+        pattern_bank.store(channel.pattern_name, channel)
+
     def toggle_pad_by_note(self, note: int):
-        return self.channels[self.current_channel].toggle_pad_by_note(note)
+        before = self.history.snapshot([self.current_channel])
+        result = self.channels[self.current_channel].toggle_pad_by_note(note)
+        if result != 'not-changed':
+            # Only real edits are undo steps, a stray tap would throw away the redo steps
+            self.history.push(before)
+        return result
+
+    def undo(self):
+        if self.history.undo():
+            self._notify_channel_or_page_changed()
+
+    def redo(self):
+        if self.history.redo():
+            self._notify_channel_or_page_changed()
 
     async def process_controller_message(self, msg) -> None:
+        if ControlMessage.is_control(msg) and msg.channel == KNOB_CHANNEL and msg.control in PARAM_CONTROLS:
+            self.history.record([self.current_channel], key=("param", self.current_channel, msg.control))
         for channel in self.channels:
             await channel.process_controller_message(msg)
 
-    async def run(self):
-        await asyncio.gather(*[channel.run() for channel in self.channels])
@@ -1,11 +1,26 @@
 PAGES = 4
 STEPS_PER_PAGE = 8
+CLOCKS_PER_BEAT = 24
+CLOCKS_PER_BAR = 4 * CLOCKS_PER_BEAT
+# Song position pointers count 16th notes
+CLOCKS_PER_SONG_POSITION = CLOCKS_PER_BEAT // 4
 
-def get_page_for_tick(tick):
-    return (tick // STEPS_PER_PAGE) % PAGES
+def get_page_for_tick(tick, length=PAGES * STEPS_PER_PAGE):
+    return (tick % length) // STEPS_PER_PAGE
 
-def get_page_position_for_tick(tick):
-    return tick % STEPS_PER_PAGE
+def get_page_position_for_tick(tick, length=PAGES * STEPS_PER_PAGE):
+    return (tick % length) % STEPS_PER_PAGE
+
+def get_clock_for_song_position(pos):
+    return pos * CLOCKS_PER_SONG_POSITION
+
+def get_step_for_clock(clock, step_size):
+    return clock // step_size
+
+def get_ratchet_clocks(step_size, ratchets):
+    """Clocks into the step at which each repeat of a ratcheted step starts, at most one per clock"""
+    ratchets = min(ratchets, step_size)
+    return [i * step_size // ratchets for i in range(ratchets)]
 
 def test():
     # get_page_for_tick
@@ -38,5 +53,33 @@ def test():
     assert get_page_position_for_tick(40) == 0
     assert get_page_position_for_tick(41) == 1
 
+    # Patterns of any length
+    assert get_page_for_tick(12, 12) == 0
+    assert get_page_for_tick(11, 12) == 1
+    assert get_page_position_for_tick(11, 12) == 3
+    assert get_page_position_for_tick(13, 12) == 1
+    assert get_page_for_tick(5, 3) == 0
+    assert get_page_position_for_tick(5, 3) == 2
+    assert get_page_for_tick(1000, 1000) == 0
+    assert get_page_for_tick(999, 1000) == 124
+    assert get_page_position_for_tick(999, 1000) == 7
+
+    # Song position pointers keep the bar
+    assert get_clock_for_song_position(0) == 0
+    assert get_clock_for_song_position(16) == CLOCKS_PER_BAR
+    assert get_step_for_clock(get_clock_for_song_position(17), 12) == 8
+    assert get_step_for_clock(get_clock_for_song_position(17), 6) == 17
+    assert get_step_for_clock(get_clock_for_song_position(17), 48) == 2
+    assert get_page_for_tick(get_step_for_clock(get_clock_for_song_position(16 * 1000 + 4), 12)) == 0
+    assert get_page_for_tick(get_step_for_clock(get_clock_for_song_position(16 * 1001 + 4), 12)) == 1
+
+    # Ratchets land on whole clocks within the step
+    assert get_ratchet_clocks(6, 1) == [0]
+    assert get_ratchet_clocks(6, 2) == [0, 3]
+    assert get_ratchet_clocks(6, 3) == [0, 2, 4]
+    assert get_ratchet_clocks(6, 4) == [0, 1, 3, 4]
+    assert get_ratchet_clocks(8, 4) == [0, 2, 4, 6]
+    assert get_ratchet_clocks(2, 8) == [0, 1]
+
 if __name__ == '__main__':
     test()
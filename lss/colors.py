@@ -5,7 +5,7 @@ from lss.channels_manager import ChannelsManager
 from lss.midi import ControlMessage, NoteMessage, ClockMessage
 from lss.utils import LSS_ASCII, open_output, register_signal_handler
 from .page import Page
-from lss.devices.launchpad_layout import LaunchpadLayout
+from lss.devices.launchpad_layout import MENU_ROLES, LaunchpadLayout
 from lss.devices.launchpad_colours import Color as C
 
 
@@ -102,7 +102,7 @@ class Colors(ChannelsManager.Listener):
             print('CONTROL message: {}'.format(msg))
         if msg.value != 127:
             return
-        if self.launchpad_layout.is_menu_pad(msg.control):
+        if self.launchpad_layout.roles[msg.control] in MENU_ROLES:
             self._process_menu_pad(msg.control)
 
     def next_page(self):
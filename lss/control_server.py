@@ -0,0 +1,298 @@
+import asyncio
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from lss.channel import CC_LOCKS, LOCKABLE_PARAMS, MAX_RATCHETS, PARAMS, ROWS, STEPS_PER_PAGE, Channel
+from lss.channels_manager import ChannelsManager
+from lss.legato import LegatoIndex, LegatoNote
+from lss.notetype import NoteType
+from lss.page import EMPTY_PADS, Page
+from lss.paddata import PadData
+from lss.pattern_bank import Pattern, PatternBank
+from lss.state import channel_to_dict
+from lss.trig_conditions import TRIG_CONDITIONS
+
+PARAMS_BY_KEY = {param.key: param for param in PARAMS}
+
+
+class ControlError(ValueError):
+    pass
+
+
+def _check(condition: bool, message: str) -> None:
+    if not condition:
+        raise ControlError(message)
+
+
+def _number(value, name: str, first: int, last: int) -> int:
+    is_number = isinstance(value, int) and not isinstance(value, bool)
+    _check(is_number, f"'{name}' has to be a number, got {value!r}")
+    _check(first <= value <= last, f"'{name}' has to be between {first} and {last}, got {value}")
+    return value
+
+
+def _int(command: dict, key: str, first: int, last: int, default: Optional[int] = None) -> int:
+    return _number(command.get(key, default), key, first, last)
+
+
+def _page_count(length: int) -> int:
+    return max(1, -(-length // STEPS_PER_PAGE))
+
+
+class _Batch:
+    """
+    Commands of one request, checked before any of them runs.
+
+    Each command is checked against the channel as the commands before it
+    leave it, e.g. a pad after a length change has to fit the new length.
+
+    Pad edits are collected per page and go to the channel in one
+    `replace_pads` call, so listeners and grids hear about a channel once
+    however many pads changed.
+    """
+
+    def __init__(self, channels_manager: ChannelsManager, pattern_bank: Optional[PatternBank]):
+        self.channels_manager = channels_manager
+        self.pattern_bank = pattern_bank
+        # channel -> page -> columns of pads
+        self._pads: Dict[int, Dict[int, List[Tuple[PadData, ...]]]] = {}
+        # channel -> length once a command of the batch changes it
+        self._lengths: Dict[int, int] = {}
+
+    def _channel(self, command: dict) -> Channel:
+        channels = self.channels_manager.channels
+        return channels[_int(command, "channel", 0, len(channels) - 1)]
+
+    def _length(self, channel: Channel) -> int:
+        """Length the channel has when the command being checked runs"""
+        return self._lengths.get(channel.number, channel._length)
+
+    def _columns(self, channel: Channel, page_number: int) -> List[Tuple[PadData, ...]]:
+        pages = self._pads.setdefault(channel.number, {})
+        if page_number not in pages:
+            page = channel.pages.get(page_number)
+            pages[page_number] = list(page.pads if page else EMPTY_PADS)
+        return pages[page_number]
+
+    def flush(self, channel: Optional[Channel] = None) -> None:
+        """Hands collected pad edits to their channels, all of them without a channel"""
+        numbers = [channel.number] if channel else list(self._pads)
+        for number in numbers:
+            pages = self._pads.pop(number, None)
+            if pages:
+                self.channels_manager.channels[number].replace_pads(
+                    {page_number: tuple(columns) for page_number, columns in pages.items()}
+                )
+
+    def prepare(self, command: dict):
+        """Checks a command and returns what runs it, nothing is changed yet"""
+        _check(isinstance(command, dict), f"Commands are objects, got {command!r}")
+        op = command.get("op")
+        if op == "set_pad":
+            return self._prepare_set_pad(command)
+        if op == "clear":
+            return self._prepare_clear(command)
+        if op == "set_param":
+            return self._prepare_set_param(command)
+        if op == "load_pattern":
+            return self._prepare_load_pattern(command)
+        if op == "query":
+            return self._prepare_query(command)
+        raise ControlError(f"Unknown op {op!r}")
+
+    def _prepare_set_pad(self, command: dict):
+        channel = self._channel(command)
+        step = _int(command, "step", 0, _page_count(self._length(channel)) * STEPS_PER_PAGE - 1)
+        y = _int(command, "row", 0, ROWS - 1)
+        is_on = command.get("on", True)
+        velocity = _int(command, "velocity", 1, 127, 127)
+        ratchets = _int(command, "ratchets", 1, MAX_RATCHETS, 1)
+        condition = _int(command, "condition", 0, len(TRIG_CONDITIONS) - 1, 0)
+        note_type = command.get("note_type", NoteType.FULL.name)
+        _check(note_type in NoteType.__members__, f"Unknown note type {note_type!r}")
+        page_number, x = divmod(step, STEPS_PER_PAGE)
+        note = Page.get_note(x, y)
+        pad_data = PadData(note, True, velocity, NoteType[note_type], ratchets, condition) if is_on else None
+
+        def run():
+            columns = self._columns(channel, page_number)
+            column = columns[x]
+            columns[x] = column[:y] + (pad_data or EMPTY_PADS[x][y],) + column[y + 1 :]
+
+        return run
+
+    def _prepare_clear(self, command: dict):
+        channel = self._channel(command)
+
+        def run():
+            for page in channel.pages:
+                self._columns(channel, page.number)[:] = EMPTY_PADS
+            for note in list(channel.legato):
+                channel.remove_legato_note(note)
+
+        return run
+
+    def _prepare_set_param(self, command: dict):
+        channel = self._channel(command)
+        key = command.get("param")
+        _check(key in PARAMS_BY_KEY, f"Unknown param {key!r}, one of {', '.join(PARAMS_BY_KEY)}")
+        param = PARAMS_BY_KEY[key]
+        value = _int(command, "value", param.min_value, param.max_value)
+        if param.attribute_name == "_length":
+            self._lengths[channel.number] = value
+
+        def run():
+            self.flush(channel)
+            channel.set_param(param, value)
+
+        return run
+
+    def _prepare_load_pattern(self, command: dict):
+        channel = self._channel(command)
+        if "pattern" in command:
+            # Inline patterns are written like channels of a JSON state file and switch right away
+            pattern = self._pattern_from_dict(channel, command["pattern"])
+            self._lengths[channel.number] = pattern.params[PARAMS.index(PARAMS_BY_KEY["length"])]
+
+            def run():
+                self.flush(channel)
+                channel.load_pattern(pattern)
+
+            return run
+        name = command.get("name")
+        _check(self.pattern_bank is not None, "No pattern bank, start with --bank")
+        _check(name in self.pattern_bank.names, f"No pattern named {name!r}")
+
+        def run():
+            self.flush(channel)
+            # Like patterns picked on the controller, they switch when the next bar starts
+            channel.queue_pattern(self.pattern_bank, name)
+
+        return run
+
+    def _pattern_from_dict(self, channel: Channel, data: dict) -> Pattern:
+        _check(isinstance(data, dict), f"A pattern is an object, got {data!r}")
+        params = tuple(
+            _int(data, key, param.min_value, param.max_value, getattr(channel, param.attribute_name))
+            for key, param in PARAMS_BY_KEY.items()
+        )
+        steps = params[PARAMS.index(PARAMS_BY_KEY["length"])]
+        try:
+            pads = []
+            for page_number, page_pads in data.get("pages", []):
+                _number(page_number, "page", 0, _page_count(steps) - 1)
+                for x, y, velocity, note_type, ratchets, condition in page_pads:
+                    _check(0 <= x < STEPS_PER_PAGE and 0 <= y < ROWS, f"No pad at {x}, {y}")
+                    _check(note_type in NoteType.__members__, f"Unknown note type {note_type!r}")
+                    note = Page.get_note(x, y)
+                    pad_data = PadData(
+                        note,
+                        True,
+                        _number(velocity, "velocity", 1, 127),
+                        NoteType[note_type],
+                        _number(ratchets, "ratchets", 1, MAX_RATCHETS),
+                        _number(condition, "condition", 0, len(TRIG_CONDITIONS) - 1),
+                    )
+                    pads.append((page_number, x, y, pad_data))
+            locks = []
+            for step, control, value in data.get("locks", []):
+                _number(step, "step", 0, steps - 1)
+                _check(control in LOCKABLE_PARAMS or control in CC_LOCKS, f"No lock for control {control!r}")
+                param = LOCKABLE_PARAMS.get(control)
+                _number(value, "value", *((param.min_value, param.max_value) if param else (0, 127)))
+                locks.append((step, control, value))
+            legato = LegatoIndex()
+            for row, start, end, velocity in data.get("legato", []):
+                note = LegatoNote(
+                    _number(row, "row", 0, ROWS - 1),
+                    _number(start, "start", 0, steps - 1),
+                    _number(end, "end", 0, steps - 1),
+                    _number(velocity, "velocity", 1, 127),
+                )
+                _check(not legato.add(note), f"{note} overlaps another legato note")
+        except ControlError:
+            raise
+        except (TypeError, ValueError, KeyError) as e:
+            raise ControlError(f"Malformed pattern: {e!r}")
+        return Pattern(data.get("name"), params, pads, locks, list(legato))
+
+    def _prepare_query(self, command: dict):
+        if "channel" not in command:
+            return lambda: {
+                "channels": len(self.channels_manager.channels),
+                "current_channel": self.channels_manager.current_channel,
+                "positions": [channel._position for channel in self.channels_manager.channels],
+            }
+        channel = self._channel(command)
+
+        def run():
+            self.flush(channel)
+            data = channel_to_dict(channel)
+            data["position"] = channel._position
+            data["pattern"] = channel.pattern_name
+            return data
+
+        return run
+
+
+class ControlServer:
+    """
+    Takes batches of commands from local tools over a Unix socket.
+
+    Every request is one line of JSON, `{"commands": [...]}`, answered by one
+    line with the result of each command. A batch is checked as a whole and
+    then run without yielding to the event loop, so no clock is handled in
+    the middle of it, and it is a single undo step.
+    """
+
+    def __init__(
+        self, channels_manager: ChannelsManager, path: str, pattern_bank: Optional[PatternBank] = None
+    ):
+        self.channels_manager = channels_manager
+        self.path = path
+        self.pattern_bank = pattern_bank
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        if os.path.exists(self.path):
+            # Left behind by a sequencer that didn't exit cleanly
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle_client, self.path)
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            os.unlink(self.path)
+
+    def run_batch(self, commands: list) -> list:
+        """Runs commands as one edit and returns their results, nothing runs if any command is invalid"""
+        _check(isinstance(commands, list), f"'commands' has to be a list, got {commands!r}")
+        batch = _Batch(self.channels_manager, self.pattern_bank)
+        actions = [batch.prepare(command) for command in commands]
+        edited = {command["channel"] for command in commands if command["op"] != "query"}
+        if edited:
+            self.channels_manager.history.record(sorted(edited))
+        results = [action() for action in actions]
+        batch.flush()
+        return results
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    _check(isinstance(request, dict), "A request is an object with a 'commands' list")
+                    response = {"ok": True, "results": self.run_batch(request.get("commands"))}
+                except (ControlError, json.JSONDecodeError) as e:
+                    response = {"ok": False, "error": str(e)}
+                except Exception as e:
+                    # A bug shouldn't cost the client its connection, it hears what went wrong
+                    response = {"ok": False, "error": f"Internal error: {e!r}"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
@@ -1,11 +1,11 @@
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 import mido
 
 from lss.pad import Pad
-from lss.utils import open_input, open_output, Color
+from lss.utils import open_input, open_output
+from .launchpad_colours import build_palette, build_rgb_palette
 from .launchpad_layout import LaunchpadLayout
-from ..page import Page
 
 
 class BaseLaunchpad:
@@ -14,19 +14,23 @@ class BaseLaunchpad:
 
     name: str
     pads: Dict[int, "Pad"] = {}
-
-    def __init__(self):
-        self._outport = open_output(self.name, autoreset=True)
-        self._controller_outport = open_output('Midi Fighter Twister', autoreset=True)
-        self._inport = open_input(self.name, autoreset=True)
-        self._host_inport = open_input(self.name + " Virtual Input", virtual=True, autoreset=True)
-        # TODO: This has nothing to do with the launchpad, move it to a different class
-        self._controller_inport = open_input('Midi Fighter Twister', autoreset=True)
+    # Start of the SysEx that lights pads with RGB colors, None when the device doesn't take one
+    rgb_sysex: Optional[List[int]] = None
+
+    def __init__(self, port_name: Optional[str] = None, rgb: bool = False):
+        # A second device of the same type shows up under a different port name
+        self.port_name = port_name or self.name
+        # Colors of pads by note type and velocity, RGB ones are sent over SysEx
+        self.rgb = rgb and self.rgb_sysex is not None
+        self.palette = build_rgb_palette() if self.rgb else build_palette()
+        self._outport = open_output(self.port_name, autoreset=True)
+        self._inport = open_input(self.port_name, autoreset=True)
         self.layout = LaunchpadLayout()
         self.reset_all_pads()
-        self.set_channel_number(0)
-        self.set_page_number(0)
-        self.highlighted_row = None
+        # Pads and top row buttons lit by the last frame, with their colors. Unknown until
+        # the first frame, which turns off whatever was left lit before
+        self._lit_notes: Dict[int, int] = dict.fromkeys(self.pads, -1)
+        self._lit_controls: Dict[int, int] = dict.fromkeys(self.layout.top_row, -1)
 
     def hand_shake(self):
         raise NotImplementedError()
@@ -34,13 +38,7 @@ class BaseLaunchpad:
     def close(self):
         self.reset_all_pads()
         self._outport.close()
-        self._controller_outport.close()
         self._inport.close()
-        self._host_inport.close()
-        self._controller_inport.close()
-
-    def init_controller_param(self, control: int, value: int):
-        self._controller_outport.send(mido.Message('control_change', control=control, value=value))
 
     def reset_all_pads(self) -> None:
         self.pads = {}
@@ -50,32 +48,26 @@ class BaseLaunchpad:
                 pad.off()
                 self.pads[pad.note] = pad
 
-    # TODO: This should be a DTO
-    def set_page(self, page: Page):
-        page_column_count, page_row_count = 8, 8
-        for x in range(page_column_count):
-            for y in range(page_row_count):
-                pad_data = page.pads[x][y]
-                pad = Pad(x, y, launchpad=self)
-                self.off(pad_data.note)
-                pad.off()
-        if self.highlighted_row is not None:
-            self._highlight_row(self.highlighted_row)
-        for x in range(page_column_count):
-            for y in range(page_row_count):
-                pad_data = page.pads[x][y]
-                pad = Pad(x, y, launchpad=self)
-                if pad_data.is_on:
-                    self.on(pad_data.note, pad_data.color)
-                    pad.on()
-                self.pads[pad_data.note] = pad
-
-    def blink_pads(self, pads):
-        for pad_number in pads:
-            pad = self.pads.get(pad_number)
-            if pad and not pad._is_on:
-                pad.on()
-                self.on(pad_number, Color.PINK)
+    def show(self, notes: Dict[int, int], controls: Dict[int, int]) -> None:
+        """Lights pads and top row buttons, only what changed since the last frame is sent"""
+        for note in self._lit_notes.keys() - notes.keys():
+            self.off(note)
+        rgb_colors = []
+        for note, color in notes.items():
+            if self._lit_notes.get(note) != color:
+                if type(color) is tuple:
+                    rgb_colors.append((note, color))
+                else:
+                    self.on(note, color)
+        if rgb_colors:
+            self.set_rgb(rgb_colors)
+        for control in self._lit_controls.keys() - controls.keys():
+            self.control_off(control)
+        for control, color in controls.items():
+            if self._lit_controls.get(control) != color:
+                self.control_on(control, color)
+        self._lit_notes = notes
+        self._lit_controls = controls
 
     def unblink_pads(self, pads):
         for pad_number in pads:
@@ -100,6 +92,14 @@ class BaseLaunchpad:
     def on(self, note: int, color: int = 4) -> None:
         self._outport.send(mido.Message("note_on", note=note, velocity=color))
 
+    def set_rgb(self, colors: List[Tuple[int, Tuple[int, int, int]]]) -> None:
+        """Lights pads with (red, green, blue) colors from 0 to 127, all of them in one SysEx message"""
+        data = list(self.rgb_sysex)
+        for note, (red, green, blue) in colors:
+            # 3 sets a pad to an RGB color
+            data += [3, note, red, green, blue]
+        self._outport.send(mido.Message("sysex", data=data))
+
     def off(self, note: int) -> None:
         self._outport.send(mido.Message("note_off", note=note))
 
@@ -111,61 +111,3 @@ class BaseLaunchpad:
 
     def get_pending_messages(self):
         return self._inport.iter_pending()
-
-    def get_pending_messages_from_host(self):
-        return self._host_inport.iter_pending()
-
-    def get_pending_controller_messages(self):
-        return self._controller_inport.iter_pending()
-
-    def _highlight_row(self, rownum):
-        rows = self.layout.rows
-        row = rows[rownum]
-        for note in row:
-            self.on(note, Color.PINK)
-
-    def _reset_channels(self):
-        self.off(self.layout.channel0)
-        self.off(self.layout.channel1)
-        self.off(self.layout.channel2)
-        self.off(self.layout.channel3)
-        self.off(self.layout.channel4)
-        self.off(self.layout.channel5)
-        self.off(self.layout.channel6)
-        self.off(self.layout.channel7)
-
-    def _reset_pages(self):
-        self.control_off(self.layout.page0)
-        self.control_off(self.layout.page1)
-        self.control_off(self.layout.page2)
-        self.control_off(self.layout.page3)
-
-    def set_channel_number(self, channel: int):
-        self._reset_channels()
-        if channel == 0:
-            self.on(self.layout.channel0)
-        elif channel == 1:
-            self.on(self.layout.channel1)
-        elif channel == 2:
-            self.on(self.layout.channel2)
-        elif channel == 3:
-            self.on(self.layout.channel3)
-        elif channel == 4:
-            self.on(self.layout.channel4)
-        elif channel == 5:
-            self.on(self.layout.channel5)
-        elif channel == 6:
-            self.on(self.layout.channel6)
-        elif channel == 7:
-            self.on(self.layout.channel7)
-
-    def set_page_number(self, page: int):
-        self._reset_pages()
-        if page == 0:
-            self.control_on(self.layout.page0)
-        elif page == 1:
-            self.control_on(self.layout.page1)
-        elif page == 2:
-            self.control_on(self.layout.page2)
-        elif page == 3:
-            self.control_on(self.layout.page3)
@@ -1,3 +1,12 @@
+from typing import Dict, List, Tuple
+
+from lss.notetype import NoteType
+
+VELOCITIES = 128
+# Dimmest RGB shade of a note type, so quiet notes stay visible
+MIN_BRIGHTNESS = 0.2
+
+
 class Color:
     GREEN = [24, 20, 25, 26, 22, 21]
     CYAN = [40, 36, 37, 38, 41, 42]
@@ -20,5 +29,48 @@ class Color:
         self.value = value
 
     @staticmethod
-    def get(color: list[int], intensity: int):
+    def get(color: List[int], intensity: int):
         return color[intensity]
+
+
+# Palette colors shaded by velocity, and the RGB color of devices lit with RGB SysEx, for every note type
+NOTE_TYPE_COLORS = {
+    NoteType.FULL: (Color.GREEN, (0, 127, 16)),
+    NoteType.NOTE_ON: (Color.GREEN, (0, 127, 16)),
+    NoteType.NOTE_OFF: (Color.BLUE_PURPLE, (40, 0, 127)),
+    NoteType.BRIDGE: (Color.CYAN, (0, 110, 127)),
+}
+
+
+def get_color_for_velocity(colors: List[int], velocity: int):
+    return colors[int((velocity / 127) * (len(colors) - 1))]
+
+
+def get_rgb_for_velocity(rgb: Tuple[int, int, int], velocity: int) -> Tuple[int, int, int]:
+    brightness = MIN_BRIGHTNESS + (1 - MIN_BRIGHTNESS) * velocity / 127
+    return tuple(round(value * brightness) for value in rgb)
+
+
+def build_palette() -> Dict[NoteType, List[int]]:
+    """
+    Returns the palette color of every note type and velocity.
+
+    Pads are drawn on every frame, so shading is worked out once here and
+    drawing a pad is an index into the table.
+    """
+    return {
+        note_type: [get_color_for_velocity(colors, velocity) for velocity in range(VELOCITIES)]
+        for note_type, (colors, _rgb) in NOTE_TYPE_COLORS.items()
+    }
+
+
+def build_rgb_palette() -> Dict[NoteType, List[Tuple[int, int, int]]]:
+    """Returns the RGB color of every note type and velocity, velocity shades smoothly instead of in steps"""
+    return {
+        note_type: [get_rgb_for_velocity(rgb, velocity) for velocity in range(VELOCITIES)]
+        for note_type, (_colors, rgb) in NOTE_TYPE_COLORS.items()
+    }
+
+
+# For pads drawn without a device
+PALETTE = build_palette()
@@ -22,6 +22,15 @@ TEMPLATE = """
     {} | {} | {} | {} | {} | {} | {} | {} || {}
     {} | {} | {} | {} | {} | {} | {} | {} || {}
 """
+# What a pad or button does, by note or control number in LaunchpadLayout.roles
+ROLE_NONE = 0
+ROLE_GRID = 1
+ROLE_MENU = 2
+ROLE_PAGE = 3
+ROLE_CHANNEL = 4
+MENU_ROLES = (ROLE_MENU, ROLE_PAGE)
+NOTES = 128
+
 
 def transpose(matrix):
     return [[matrix[j][i] for j in range(len(matrix))] for i in range(len(matrix[0]))]
@@ -79,26 +88,26 @@ class LaunchpadLayout:
                             self.channel5,
                             self.channel6,
                             self.channel7]
+        self.page_controls = [self.page0, self.page1, self.page2, self.page3]
 
-    def is_menu_pad(self, pad):
-        return pad in self.top_row
-
-    def is_channel_pad(self, pad):
-        return pad in self.last_column
-
-    def pad_to_arp_index(self, pad):
+        # Tables indexed by note or control number, so handling a pad is a lookup instead of a search
+        self.roles = [ROLE_NONE] * NOTES
+        # Row of grid pads counted from the bottom, picks the arp note a pad plays
+        self.arp_indices = [0] * NOTES
+        # Page of page buttons and channel of channel pads, the first pad of the last column is -1
+        self.indices = [0] * NOTES
         for column in self.columns:
-            if pad in column:
-                reversed_column = column[:]
-                reversed_column.reverse()
-                return reversed_column.index(pad)
-        return 0
-
-    def get_note_from_coords(self, x, y):
-        # FIXME: Clearly, I'm storing the columns in a weird way
-        # (see reverse bullshit in pad_to_arp_index)
-        # That's what that 7 is about.
-        return self.rows[7 - y][x]
+            for y, pad in enumerate(reversed(column)):
+                self.roles[pad] = ROLE_GRID
+                self.arp_indices[pad] = y
+        for pad in (self.up, self.down, self.left, self.right):
+            self.roles[pad] = ROLE_MENU
+        for page, pad in enumerate(self.page_controls):
+            self.roles[pad] = ROLE_PAGE
+            self.indices[pad] = page
+        for channel, pad in enumerate(self.last_column):
+            self.roles[pad] = ROLE_CHANNEL
+            self.indices[pad] = channel - 1
 
     def __str__(self):
         rows = [self.top_row] + self.rows
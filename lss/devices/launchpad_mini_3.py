@@ -5,6 +5,7 @@ from lss.midi import HexMessage
 class LaunchpadMiniMk3(BaseLaunchpad):
     row_count = 9
     column_count = 9
+    rgb_sysex = [0, 32, 41, 2, 13, 3]
 
     name = "Launchpad Mini MK3 LPMiniMK3 MIDI"
 
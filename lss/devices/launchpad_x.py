@@ -5,6 +5,7 @@ from lss.midi import HexMessage
 class LaunchpadX(BaseLaunchpad):
     row_count = 9
     column_count = 9
+    rgb_sysex = [0, 32, 41, 2, 12, 3]
 
     name = "Launchpad X LPX MIDI"
 
@@ -0,0 +1,46 @@
+from typing import Optional
+
+import mido
+
+from lss.utils import open_input, open_output
+
+
+class Twister:
+    """Midi Fighter Twister, its knobs change params and its buttons run sequencer functions"""
+
+    name = "Midi Fighter Twister"
+
+    def __init__(self, port_name: Optional[str] = None):
+        self.port_name = port_name or self.name
+        self._outport = open_output(self.port_name, autoreset=True)
+        self._inport = open_input(self.port_name, autoreset=True)
+
+    def close(self):
+        self._outport.close()
+        self._inport.close()
+
+    def init_controller_param(self, control: int, value: int):
+        self._outport.send(mido.Message("control_change", control=control, value=value))
+
+    def get_pending_messages(self):
+        return self._inport.iter_pending()
+
+
+class ControllerGroup:
+    """
+    Every attached controller, channels talk to it as if it were one.
+
+    Knob positions are only sent when a param or the current channel changes,
+    never per step, so more controllers don't slow down playback.
+    """
+
+    def __init__(self, controllers=()):
+        self.controllers = list(controllers)
+
+    def init_controller_param(self, control: int, value: int):
+        for controller in self.controllers:
+            controller.init_controller_param(control, value)
+
+    def close(self):
+        for controller in self.controllers:
+            controller.close()
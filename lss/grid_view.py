@@ -0,0 +1,69 @@
+import asyncio
+from typing import Dict, Optional, Tuple, Union
+
+from lss.clock_math import get_page_for_tick, get_page_position_for_tick
+from lss.page import EMPTY_PADS
+from lss.utils import Color
+
+# Grids are redrawn at most this often, however many steps play in between
+FRAME_INTERVAL = 1 / 30
+CHANNEL_COLOR = 4
+# Channel pads in the last column, up and down move between banks of this many channels
+CHANNEL_PADS = 8
+PAGE_COLOR = 63
+
+
+class GridView:
+    """
+    What one grid shows and which channel it edits.
+
+    Every grid has its own view, so two grids can edit two channels at the
+    same time. Playing steps never talks to grids: each view draws the shared
+    channels into a frame on its own task and the launchpad only sends the
+    pads that changed since the previous frame.
+    """
+
+    def __init__(self, launchpad, channels_manager, channel: int = 0):
+        self.launchpad = launchpad
+        self.layout = launchpad.layout
+        self.channels_manager = channels_manager
+        self.channel = channel
+        # Row of the legato note being entered, drawn behind the pads
+        self.highlighted_row: Optional[int] = None
+        self._done = False
+
+    def draw(self) -> Tuple[Dict[int, Union[int, tuple]], Dict[int, int]]:
+        """Returns the colors of the pads and of the top row buttons, pads take the device's palette"""
+        channel = self.channels_manager.channels[self.channel]
+        page_number = channel.current_page
+        page = channel.pages.get(page_number)
+        pads = page.display_pads if page else channel.legato.draw(page_number, EMPTY_PADS)
+        palette = self.launchpad.palette
+        notes: Dict[int, Union[int, tuple]] = {}
+        if self.highlighted_row is not None:
+            for note in self.layout.rows[self.highlighted_row]:
+                notes[note] = Color.PINK
+        for column in pads:
+            for pad_data in column:
+                if pad_data.is_on:
+                    notes[pad_data.note] = palette[pad_data.note_type][pad_data.velocity]
+        if get_page_for_tick(channel._position, channel._length) == page_number:
+            for pad_data in pads[get_page_position_for_tick(channel._position, channel._length)]:
+                notes.setdefault(pad_data.note, Color.PINK)
+        # The first pad of the last column is not a channel
+        notes[self.layout.last_column[self.channel % CHANNEL_PADS + 1]] = CHANNEL_COLOR
+        controls = {}
+        if page_number < len(self.layout.page_controls):
+            controls[self.layout.page_controls[page_number]] = PAGE_COLOR
+        return notes, controls
+
+    def render(self) -> None:
+        self.launchpad.show(*self.draw())
+
+    def close(self) -> None:
+        self._done = True
+
+    async def run(self) -> None:
+        while not self._done:
+            self.render()
+            await asyncio.sleep(FRAME_INTERVAL)
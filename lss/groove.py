@@ -0,0 +1,122 @@
+import json
+import math
+from typing import List, Optional, Tuple
+
+from lss.clock_math import CLOCKS_PER_BEAT
+
+# Templates are written on a 16th note grid unless they say otherwise
+GROOVE_STEP_SIZE = 6
+
+
+class Groove:
+    """
+    Timing and velocity offsets for every step of a repeating template.
+
+    Timing is in clocks and may be fractional, velocity is added to the
+    velocity of the pads. Steps are `step_size` clocks apart.
+    """
+
+    def __init__(
+        self, name: str, timing: List[float], velocity: List[int], step_size: int = GROOVE_STEP_SIZE
+    ):
+        self.name = name
+        self.timing = timing
+        self.velocity = velocity
+        self.step_size = step_size
+
+    @property
+    def cycle(self) -> int:
+        """Clocks before the template repeats"""
+        return len(self.timing) * self.step_size
+
+    def offset_at(self, clock: float) -> Tuple[float, float]:
+        """Timing and velocity offset at a clock of the cycle, interpolated between template steps"""
+        position = (clock % self.cycle) / self.step_size
+        index = int(position)
+        following = (index + 1) % len(self.timing)
+        weight = position - index
+        timing = self.timing[index] + (self.timing[following] - self.timing[index]) * weight
+        velocity = self.velocity[index] + (self.velocity[following] - self.velocity[index]) * weight
+        return timing, velocity
+
+    @staticmethod
+    def from_json_file(path: str) -> "Groove":
+        with open(path) as f:
+            data = json.load(f)
+        timing = data["timing"]
+        return Groove(
+            data.get("name", path),
+            timing,
+            data.get("velocity", [0] * len(timing)),
+            data.get("step_size", GROOVE_STEP_SIZE),
+        )
+
+    @staticmethod
+    def from_midi_file(path: str, steps: int = 16) -> "Groove":
+        """Extracts how far notes sit from a 16th grid, averaged per step over all tracks"""
+        # The importer needs channels, which need grooves
+        from lss.midi_import import MidiFileReader
+
+        offsets: List[List[float]] = [[] for _ in range(steps)]
+        velocities: List[List[int]] = [[] for _ in range(steps)]
+        with MidiFileReader(path) as reader:
+            ticks_per_clock = reader.ticks_per_beat / CLOCKS_PER_BEAT
+            for events in reader.tracks():
+                for tick, is_note_on, _note, velocity in events:
+                    if not is_note_on:
+                        continue
+                    clock = tick / ticks_per_clock
+                    step = round(clock / GROOVE_STEP_SIZE)
+                    offsets[step % steps].append(clock - step * GROOVE_STEP_SIZE)
+                    velocities[step % steps].append(velocity)
+        played = [velocity for step_velocities in velocities for velocity in step_velocities]
+        if not played:
+            raise ValueError(f"{path} has no notes to take a groove from")
+        mean_velocity = sum(played) / len(played)
+        return Groove(
+            path,
+            [sum(step_offsets) / len(step_offsets) if step_offsets else 0.0 for step_offsets in offsets],
+            [
+                round(sum(step_velocities) / len(step_velocities) - mean_velocity) if step_velocities else 0
+                for step_velocities in velocities
+            ],
+        )
+
+    def __str__(self):
+        return f"Groove(name={self.name}, steps={len(self.timing)})"
+
+
+def load_groove(path: str) -> Groove:
+    """Loads a groove template from a JSON file or takes one from a MiDI file"""
+    if path.lower().endswith(".json"):
+        return Groove.from_json_file(path)
+    return Groove.from_midi_file(path)
+
+
+def get_swing_clocks(swing: int, step_size: int) -> float:
+    """How late every second step plays, 50 is straight and 66 close to a triplet feel"""
+    return (swing - 50) * 2 * step_size / 100
+
+
+def build_groove_table(groove: Optional[Groove], swing: int, step_size: int) -> List[Tuple[int, float, int]]:
+    """
+    Precomputes (clocks, fraction of a clock, velocity) offsets for the steps of a channel.
+
+    The table covers whole cycles of both the groove and the swing, so a step's
+    offsets are found with `table[step % len(table)]`. Steps are only ever
+    delayed, and never past the start of the next one, because they are played
+    from the clock they start on.
+    """
+    cycle = 2 * step_size
+    if groove is not None:
+        cycle = cycle * groove.cycle // math.gcd(cycle, groove.cycle)
+    swing_clocks = get_swing_clocks(swing, step_size)
+    table = []
+    for step in range(cycle // step_size):
+        timing, velocity = groove.offset_at(step * step_size) if groove is not None else (0.0, 0.0)
+        if step % 2:
+            timing += swing_clocks
+        timing = min(max(0.0, timing), step_size - 1)
+        clocks = math.floor(timing)
+        table.append((clocks, timing - clocks, round(velocity)))
+    return table
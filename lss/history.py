@@ -0,0 +1,64 @@
+from collections import deque
+from typing import Dict, Iterable, Optional
+
+
+class History:
+    """
+    Undo/redo for the pages, params, step locks and legato notes of channels.
+
+    A snapshot holds only the channels an edit touches, and of those only
+    references to the pads of each page. Pads are shared with the live pages
+    until they are edited, so the history costs memory in proportion to what
+    changed, not to the size of the patterns.
+    """
+
+    def __init__(self, channels_manager, depth: int = 100):
+        self.channels_manager = channels_manager
+        self._undo: deque = deque(maxlen=depth)
+        self._redo: list = []
+        self._last_key = None
+
+    def snapshot(self, channels: Optional[Iterable[int]] = None) -> Dict[int, tuple]:
+        """Returns the state of the given channel numbers, all channels by default"""
+        all_channels = self.channels_manager.channels
+        if channels is None:
+            channels = range(len(all_channels))
+        return {number: all_channels[number].snapshot() for number in channels}
+
+    def _restore(self, snapshot: Dict[int, tuple]) -> None:
+        for number, (pages, params, locks, legato) in snapshot.items():
+            self.channels_manager.channels[number].restore(pages, params, locks, legato)
+
+    def record(self, channels: Optional[Iterable[int]] = None, key=None) -> None:
+        """
+        Remembers the state of the channels an edit is about to change, all by default.
+
+        Consecutive edits with the same key, like turning a knob, are one step.
+        """
+        if key is not None and key == self._last_key:
+            return
+        self.push(self.snapshot(channels), key)
+
+    def push(self, snapshot: Dict[int, tuple], key=None) -> None:
+        """Adds a snapshot taken before an edit that turned out to change something"""
+        self._last_key = key
+        self._undo.append(snapshot)
+        self._redo.clear()
+
+    def undo(self) -> bool:
+        if not self._undo:
+            return False
+        snapshot = self._undo.pop()
+        self._redo.append(self.snapshot(snapshot))
+        self._restore(snapshot)
+        self._last_key = None
+        return True
+
+    def redo(self) -> bool:
+        if not self._redo:
+            return False
+        snapshot = self._redo.pop()
+        self._undo.append(self.snapshot(snapshot))
+        self._restore(snapshot)
+        self._last_key = None
+        return True
@@ -0,0 +1,211 @@
+import asyncio
+import os
+import queue
+import struct
+import threading
+import time
+
+from lss.channel import PARAMS, Channel, Param
+from lss.legato import LegatoNote
+from lss.channels_manager import ChannelsManager
+from lss.notetype import NoteType
+from lss.page import Page
+from lss.paddata import PadData
+from lss.project import encode_project, load_project, write_project
+
+# op, channel, page (step for locks, start for legato notes), x, y, a, b, c, d, value
+RECORD = struct.Struct("<BBIBBBBBBi")
+
+OP_PAD = 1
+OP_PARAM = 2
+OP_COPY_PAGE = 3
+OP_LOCK = 4
+OP_LEGATO = 5
+
+_NOTE_TYPES = {note_type.value: note_type for note_type in NoteType}
+
+
+def apply_record(channels_manager: ChannelsManager, record: tuple) -> None:
+    op, channel_number, page_number, x, y, a, b, c, d, value = record
+    channel = channels_manager.channels[channel_number]
+    if op == OP_PAD:
+        page = channel.pages[page_number]
+        note_type = _NOTE_TYPES[b]
+        page.set_pad(x, y, PadData(page.get_note(x, y), bool(a), value, note_type, c, d))
+    elif op == OP_PARAM:
+        channel.set_param(PARAMS[a], value)
+    elif op == OP_COPY_PAGE:
+        channel.copy_page(page_number, a)
+    elif op == OP_LOCK:
+        channel.set_lock(page_number, a, value if b else None)
+    elif op == OP_LEGATO:
+        note = LegatoNote(y, page_number, value, a)
+        if b:
+            channel.add_legato_note(note)
+        else:
+            channel.remove_legato_note(note)
+
+
+def replay(channels_manager: ChannelsManager, snapshot_path: str, journal_path: str) -> int:
+    """
+    Rebuilds state from the last snapshot plus the journal written after it.
+
+    A record cut short by a crash is ignored. Returns the number of replayed records.
+    """
+    if os.path.exists(snapshot_path):
+        load_project(channels_manager, snapshot_path)
+    if not os.path.exists(journal_path):
+        return 0
+    with open(journal_path, "rb") as f:
+        data = f.read()
+    complete = len(data) - len(data) % RECORD.size
+    count = 0
+    for record in RECORD.iter_unpack(data[:complete]):
+        apply_record(channels_manager, record)
+        count += 1
+    return count
+
+
+class _Snapshot:
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+class Journal(ChannelsManager.Listener):
+    """
+    Appends every edit to a journal file from a background thread.
+
+    The event loop only packs a record and puts it on a queue. The writer thread
+    collects everything that arrives within `sync_interval` and writes it with
+    a single fsync. Every `snapshot_every` records the whole state is written
+    as a project snapshot and the journal is truncated.
+    """
+
+    def __init__(
+        self,
+        channels_manager: ChannelsManager,
+        snapshot_path: str,
+        journal_path: str,
+        sync_interval: float = 0.2,
+        snapshot_every: int = 10000,
+    ):
+        self.channels_manager = channels_manager
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self._sync_interval = sync_interval
+        self._snapshot_every = snapshot_every
+        self._records_since_snapshot = 0
+        self._snapshot_pending = False
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write_loop, name="lss-journal", daemon=True)
+        self._thread.start()
+        channels_manager.add_listener(self)
+
+    def close(self):
+        self.channels_manager.remove_listener(self)
+        self._queue.put(None)
+        self._thread.join()
+
+    def snapshot(self):
+        """Queues a snapshot of the current state, the journal is cleared once it is on disk"""
+        self._records_since_snapshot = 0
+        self._snapshot_pending = False
+        self._queue.put(_Snapshot(encode_project(self.channels_manager)))
+
+    def _append(
+        self, op: int, channel: int, page: int, x: int, y: int, a: int, b: int, c: int, d: int, value: int
+    ):
+        self._queue.put(RECORD.pack(op, channel, page, x, y, a, b, c, d, value))
+        self._records_since_snapshot += 1
+        if self._records_since_snapshot >= self._snapshot_every:
+            self.snapshot()
+
+    def on_channel_or_page_changed(self, channel: int, page: int):
+        pass
+
+    def on_page_updated(self, page: Page):
+        pass
+
+    def on_pad_changed(self, channel: Channel, page: Page, x: int, y: int):
+        pad_data = page.pads[x][y]
+        self._append(
+            OP_PAD,
+            channel.number,
+            page.number,
+            x,
+            y,
+            pad_data.is_on,
+            pad_data.note_type.value,
+            pad_data.ratchets,
+            pad_data.condition,
+            pad_data.velocity,
+        )
+
+    def on_param_changed(self, channel: Channel, param: Param):
+        value = getattr(channel, param.attribute_name)
+        self._append(OP_PARAM, channel.number, 0, 0, 0, PARAMS.index(param), 0, 0, 0, value)
+
+    def on_page_copied(self, channel: Channel, source: int, target: int):
+        self._append(OP_COPY_PAGE, channel.number, source, 0, 0, target, 0, 0, 0, 0)
+
+    def on_pages_replaced(self, channel: Channel):
+        # Queued patterns switch in the clock handler, the project is encoded after the step has played
+        if self._snapshot_pending:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.snapshot()
+            return
+        self._snapshot_pending = True
+        loop.call_soon(self._take_pending_snapshot)
+
+    def _take_pending_snapshot(self):
+        # Channels switching on the same bar share one snapshot, or an edit in between already took it
+        if self._snapshot_pending:
+            self.snapshot()
+
+    def on_lock_changed(self, channel: Channel, step: int, control: int):
+        value = dict(channel.locks.get(step, ())).get(control)
+        self._append(OP_LOCK, channel.number, step, 0, 0, control, value is not None, 0, 0, value or 0)
+
+    def on_legato_changed(self, channel: Channel, note: LegatoNote, is_added: bool):
+        self._append(
+            OP_LEGATO, channel.number, note.start, 0, note.row, note.velocity, is_added, 0, 0, note.end
+        )
+
+    def _next_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._sync_interval
+        while batch[-1] is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_loop(self):
+        journal = open(self.journal_path, "ab")
+        try:
+            done = False
+            while not done:
+                records = bytearray()
+                for item in self._next_batch():
+                    if item is None:
+                        done = True
+                    elif isinstance(item, _Snapshot):
+                        # Everything queued before the snapshot is part of it
+                        write_project(self.snapshot_path, item.data)
+                        journal.truncate(0)
+                        records = bytearray()
+                    else:
+                        records += item
+                if records:
+                    journal.write(records)
+                journal.flush()
+                os.fsync(journal.fileno())
+        finally:
+            journal.close()
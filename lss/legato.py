@@ -0,0 +1,192 @@
+import math
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, List, Optional, Set, Tuple
+
+from lss.clock_math import STEPS_PER_PAGE
+from lss.notetype import NoteType
+from lss.page import Page
+from lss.paddata import PadData
+
+ROWS = 8
+
+
+def _pad(step: int, note: "LegatoNote", note_type: NoteType) -> PadData:
+    return PadData(Page.get_note(step % STEPS_PER_PAGE, note.row), True, note.velocity, note_type)
+
+
+class LegatoNote:
+    """
+    A held note on one pad row, from the step of its note on to the step of its note off.
+
+    A note whose end is before its start wraps around the end of the pattern.
+    Instances are shared with history snapshots, so never mutate one, replace it.
+    """
+
+    def __init__(self, row: int, start: int, end: int, velocity: int = 127):
+        self.row = row
+        self.start = start
+        self.end = end
+        self.velocity = velocity
+
+    @property
+    def wraps(self) -> bool:
+        return self.end < self.start
+
+    def contains(self, step: int) -> bool:
+        if self.wraps:
+            return step >= self.start or step <= self.end
+        return self.start <= step <= self.end
+
+    def with_velocity(self, velocity: int) -> "LegatoNote":
+        return LegatoNote(self.row, self.start, self.end, velocity)
+
+    def _key(self) -> tuple:
+        return self.row, self.start, self.end, self.velocity
+
+    def __eq__(self, other):
+        return isinstance(other, LegatoNote) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __lt__(self, other):
+        return self.start < other.start
+
+    def __str__(self):
+        return f"LegatoNote(row={self.row}, start={self.start}, end={self.end}, velocity={self.velocity})"
+
+
+class LegatoIndex:
+    """
+    Legato notes of a channel, kept sorted by start step per row.
+
+    Notes on a row never overlap, so the note under a step is the last one
+    starting at or before it, or the wrapping note at the end of the row.
+    Finding, adding and removing notes bisect instead of walking pads. The pads
+    a note covers are drawn from the notes when a page is shown, and what plays
+    on each step is looked up in a table rebuilt only after edits.
+    """
+
+    def __init__(self):
+        self._rows: List[List[LegatoNote]] = [[] for _ in range(ROWS)]
+        self._starts: List[List[int]] = [[] for _ in range(ROWS)]
+        # step -> pads that play there, None until needed after an edit
+        self._events: Optional[Dict[int, Tuple[PadData, ...]]] = None
+        # All notes as one tuple, shared with history snapshots until the next edit
+        self._notes: Optional[Tuple[LegatoNote, ...]] = None
+
+    def __len__(self):
+        return sum(len(notes) for notes in self._rows)
+
+    def __bool__(self):
+        return any(self._rows)
+
+    def __iter__(self):
+        for notes in self._rows:
+            yield from notes
+
+    def notes(self) -> Tuple[LegatoNote, ...]:
+        """Returns every note, the same tuple is returned until the notes are edited"""
+        if self._notes is None:
+            self._notes = tuple(self)
+        return self._notes
+
+    def find(self, row: int, step: int) -> Optional[LegatoNote]:
+        """Returns the note that covers a step of a row"""
+        notes = self._rows[row]
+        if not notes:
+            return None
+        i = bisect_right(self._starts[row], step) - 1
+        if i >= 0 and notes[i].contains(step):
+            return notes[i]
+        if notes[-1].wraps and notes[-1].contains(step):
+            return notes[-1]
+        return None
+
+    def overlapping(self, note: LegatoNote) -> Set[LegatoNote]:
+        """Returns the notes on the note's row that share a step with it"""
+        starts = self._starts[note.row]
+        notes = self._rows[note.row]
+        ranges = [(note.start, note.end)] if not note.wraps else [(note.start, math.inf), (0, note.end)]
+        found = set()
+        for first, last in ranges:
+            found.update(notes[bisect_left(starts, first) : bisect_right(starts, last)])
+            covering = self.find(note.row, first)
+            if covering is not None:
+                found.add(covering)
+        return found
+
+    def add(self, note: LegatoNote) -> Set[LegatoNote]:
+        """Adds a note, the notes it overlaps are removed and returned"""
+        removed = self.overlapping(note)
+        for other in removed:
+            self.remove(other)
+        i = bisect_right(self._starts[note.row], note.start)
+        self._rows[note.row].insert(i, note)
+        self._starts[note.row].insert(i, note.start)
+        self._events = None
+        self._notes = None
+        return removed
+
+    def remove(self, note: LegatoNote) -> bool:
+        notes = self._rows[note.row]
+        i = bisect_left(self._starts[note.row], note.start)
+        if i < len(notes) and notes[i] == note:
+            del notes[i]
+            del self._starts[note.row][i]
+            self._events = None
+            self._notes = None
+            return True
+        return False
+
+    def set_notes(self, notes) -> None:
+        """Replaces all notes, they are expected not to overlap"""
+        self._rows = [[] for _ in range(ROWS)]
+        for note in notes:
+            insort(self._rows[note.row], note)
+        self._starts = [[note.start for note in row] for row in self._rows]
+        self._events = None
+        self._notes = None
+
+    def in_steps(self, first: int, last: int):
+        """Yields the notes that cover any step from `first` to `last`"""
+        for row in range(ROWS):
+            notes = self._rows[row]
+            found = set(notes[bisect_left(self._starts[row], first) : bisect_right(self._starts[row], last)])
+            covering = self.find(row, first)
+            if covering is not None:
+                found.add(covering)
+            yield from sorted(found)
+
+    def events_at(self, step: int) -> Tuple[PadData, ...]:
+        """Returns the NOTE_ON and NOTE_OFF pads that play on a step"""
+        if self._events is None:
+            events: Dict[int, List[PadData]] = {}
+            for note in self:
+                events.setdefault(note.start, []).append(_pad(note.start, note, NoteType.NOTE_ON))
+                events.setdefault(note.end, []).append(_pad(note.end, note, NoteType.NOTE_OFF))
+            self._events = {step: tuple(pads) for step, pads in events.items()}
+        return self._events.get(step, ())
+
+    def draw(self, page_number: int, pads: Tuple[Tuple[PadData, ...], ...]) -> tuple:
+        """Returns a page's pads with the legato notes that cross it drawn over them"""
+        first = page_number * STEPS_PER_PAGE
+        last = first + STEPS_PER_PAGE - 1
+        columns = None
+        for note in self.in_steps(first, last):
+            if columns is None:
+                columns = [list(column) for column in pads]
+            for x in range(STEPS_PER_PAGE):
+                step = first + x
+                if not note.contains(step):
+                    continue
+                if step == note.start:
+                    note_type = NoteType.NOTE_ON
+                elif step == note.end:
+                    note_type = NoteType.NOTE_OFF
+                else:
+                    note_type = NoteType.BRIDGE
+                columns[x][note.row] = _pad(step, note, note_type)
+        if columns is None:
+            return pads
+        return tuple(tuple(column) for column in columns)
@@ -43,4 +43,4 @@ class ClockMessage(mido.Message):
 
     @staticmethod
     def is_clock(msg):
-        return getattr(msg, "type", None) in ["clock", "songpos", "continue", "stop"]
+        return getattr(msg, "type", None) in ["clock", "songpos", "start", "continue", "stop"]
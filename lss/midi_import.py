@@ -0,0 +1,178 @@
+import struct
+from typing import Dict, List, Tuple
+
+from lss.channel import RATES_TO_STEP_SIZES, STEPS_PER_PAGE
+from lss.clock_math import CLOCKS_PER_BEAT
+from lss.notetype import NoteType
+from lss.legato import LegatoNote
+from lss.page import Page
+from lss.paddata import PadData
+
+ROWS = 8
+
+
+def _read_varlen(data: bytes, offset: int):
+    value = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, offset
+
+
+class MidiFileReader:
+    """
+    Reads a Standard MiDI File one track at a time.
+
+    Only one track's bytes are held in memory and only note events are decoded,
+    so big multi-track files don't turn into millions of message objects.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        chunk_type, length = struct.unpack(">4sI", self._file.read(8))
+        if chunk_type != b"MThd":
+            raise ValueError(f"{path} is not a MiDI file")
+        _format, self.track_count, division = struct.unpack(">HHH", self._file.read(6))
+        self._file.seek(length - 6, 1)
+        if division & 0x8000:
+            raise ValueError("SMPTE time division is not supported")
+        self.ticks_per_beat = division
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def tracks(self):
+        """Yields an iterator of (tick, is_note_on, note, velocity) per track"""
+        while True:
+            header = self._file.read(8)
+            if len(header) < 8:
+                return
+            chunk_type, length = struct.unpack(">4sI", header)
+            if chunk_type != b"MTrk":
+                self._file.seek(length, 1)
+                continue
+            yield self._iter_note_events(self._file.read(length))
+
+    @staticmethod
+    def _iter_note_events(data: bytes):
+        offset = 0
+        tick = 0
+        status = 0
+        size = len(data)
+        while offset < size:
+            delta, offset = _read_varlen(data, offset)
+            tick += delta
+            if data[offset] == 0xFF:
+                # Meta and sysex events leave the running status of channel messages alone
+                length, offset = _read_varlen(data, offset + 2)
+                offset += length
+                continue
+            if data[offset] in (0xF0, 0xF7):
+                length, offset = _read_varlen(data, offset + 1)
+                offset += length
+                continue
+            if data[offset] & 0x80:
+                status = data[offset]
+                offset += 1
+            kind = status & 0xF0
+            if kind in (0xC0, 0xD0):
+                offset += 1
+                continue
+            note, velocity = data[offset], data[offset + 1]
+            offset += 2
+            if kind == 0x90 and velocity > 0:
+                yield tick, True, note, velocity
+            elif kind == 0x80 or kind == 0x90:
+                yield tick, False, note, velocity
+
+
+def _pair_notes(events) -> List[Tuple[int, int, int, int]]:
+    """Matches note ons with note offs into (start, end, note, velocity)"""
+    started: Dict[int, List[Tuple[int, int]]] = {}
+    notes = []
+    for tick, is_note_on, note, velocity in events:
+        if is_note_on:
+            started.setdefault(note, []).append((tick, velocity))
+        elif started.get(note):
+            start, start_velocity = started[note].pop(0)
+            notes.append((start, tick, note, start_velocity))
+    return notes
+
+
+def _rows_for_notes(notes) -> Dict[int, int]:
+    """
+    Maps each pitch to a pad row.
+
+    Rows are arpeggiator indexes, so the lowest pitch goes to the bottom row,
+    the next one above it and so on. Holding the same keys on the host plays
+    the material back as written. Tracks with more than 8 pitches are squeezed
+    so their contour is kept.
+    """
+    pitches = sorted({note for _start, _end, note, _velocity in notes})
+    if len(pitches) <= ROWS:
+        return {pitch: row for row, pitch in enumerate(pitches)}
+    return {pitch: i * ROWS // len(pitches) for i, pitch in enumerate(pitches)}
+
+
+def fill_channel(channel, notes, ticks_per_beat: int) -> None:
+    """
+    Quantizes notes to the channel's step grid and writes them into its pages.
+
+    Notes longer than a step become legato notes. Pads are collected per page
+    first and every touched page is updated once.
+    """
+    ticks_per_step = ticks_per_beat * RATES_TO_STEP_SIZES[channel._rate] / CLOCKS_PER_BEAT
+    rows = _rows_for_notes(notes)
+    steps = []
+    for start, end, note, velocity in notes:
+        start_step = round(start / ticks_per_step)
+        steps.append((start_step, max(start_step, round(end / ticks_per_step) - 1), note, velocity))
+    # Grow the pattern by whole pages until the material fits
+    last_step = max(end_step for _start_step, end_step, _note, _velocity in steps)
+    channel._length = max(channel._length, (last_step // STEPS_PER_PAGE + 1) * STEPS_PER_PAGE)
+
+    for start_step, end_step, note, velocity in steps:
+        if end_step != start_step:
+            channel.legato.add(LegatoNote(rows[note], start_step, end_step, velocity))
+
+    pages: Dict[int, List[List[PadData]]] = {}
+    for start_step, end_step, note, velocity in steps:
+        y = rows[note]
+        if end_step != start_step or channel.legato.find(y, start_step) is not None:
+            continue
+        page_number, x = divmod(start_step, STEPS_PER_PAGE)
+        columns = pages.get(page_number)
+        if columns is None:
+            columns = pages[page_number] = [list(column) for column in channel.pages[page_number].pads]
+        columns[x][y] = PadData(Page.get_note(x, y), True, velocity, NoteType.FULL)
+    for page_number, columns in pages.items():
+        channel.pages[page_number].set_pads(tuple(tuple(column) for column in columns))
+
+
+def import_midi_file(channels_manager, path: str) -> int:
+    """
+    Fills channels with the notes of a MiDI file, one track per channel.
+
+    Tracks without notes are skipped. Returns the number of imported tracks.
+    """
+    channels = iter(channels_manager.channels)
+    imported = 0
+    with MidiFileReader(path) as reader:
+        for events in reader.tracks():
+            notes = _pair_notes(events)
+            if not notes:
+                continue
+            channel = next(channels, None)
+            if channel is None:
+                break
+            fill_channel(channel, notes, reader.ticks_per_beat)
+            imported += 1
+    return imported
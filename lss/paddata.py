@@ -1,37 +1,38 @@
+from lss.devices.launchpad_colours import PALETTE
 from lss.notetype import NoteType
 
 
-def _get_color_intensity_for_velocity(colors: list[int], velocity: int):
-    return int((velocity / 127) * (len(colors) - 1))
-
-
-def get_color_for_velocity(colors: list[int], velocity: int):
-    return colors[_get_color_intensity_for_velocity(colors, velocity)]
-
-
 class PadData:
-    def __init__(self, note, is_on, velocity=127, note_type=NoteType.FULL):
+    """State of a single pad. Instances are shared between pages, so never mutate one, replace it."""
+
+    def __init__(self, note, is_on, velocity=127, note_type=NoteType.FULL, ratchets=1, condition=0):
         self.note = note
         self.is_on = is_on
         self.velocity = velocity
         self.note_type = note_type
+        # How many times the note is retriggered within its step
+        self.ratchets = ratchets
+        # Index into TRIG_CONDITIONS, 0 always plays
+        self.condition = condition
 
     def __copy__(self):
-        return PadData(self.note, self.is_on, self.velocity, self.note_type)
+        return PadData(self.note, self.is_on, self.velocity, self.note_type, self.ratchets, self.condition)
+
+    def with_velocity(self, velocity: int) -> "PadData":
+        return PadData(self.note, self.is_on, velocity, self.note_type, self.ratchets, self.condition)
+
+    def with_ratchets(self, ratchets: int) -> "PadData":
+        return PadData(self.note, self.is_on, self.velocity, self.note_type, ratchets, self.condition)
+
+    def with_condition(self, condition: int) -> "PadData":
+        return PadData(self.note, self.is_on, self.velocity, self.note_type, self.ratchets, condition)
 
     @property
     def color(self):
-        from lss.devices.launchpad_colours import Color
-        if self.note_type == NoteType.NOTE_ON:
-            return get_color_for_velocity(Color.GREEN, self.velocity)
-        elif self.note_type == NoteType.NOTE_OFF:
-            return get_color_for_velocity(Color.BLUE_PURPLE, self.velocity)
-        elif self.note_type == NoteType.FULL:
-            return get_color_for_velocity(Color.GREEN, self.velocity)
-        elif self.note_type == NoteType.BRIDGE:
-            return get_color_for_velocity(Color.CYAN, self.velocity)
-        # RED means something went wrong
-        return get_color_for_velocity(Color.RED_ORANGE, 127)
+        return PALETTE[self.note_type][self.velocity]
 
     def __str__(self):
-        return f"PadData(note={self.note}, is_on={self.is_on}, velocity={self.velocity}, note_type={self.note_type})"
+        return (
+            f"PadData(note={self.note}, is_on={self.is_on}, velocity={self.velocity}, "
+            f"note_type={self.note_type}, ratchets={self.ratchets}, condition={self.condition})"
+        )
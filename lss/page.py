@@ -1,7 +1,7 @@
-from typing import List
+from typing import Dict, List, Optional, Set, Tuple
 from abc import ABC
-from copy import copy
 
+from lss.clock_math import STEPS_PER_PAGE
 from lss.notetype import NoteType
 from lss.paddata import PadData
 
@@ -17,12 +17,22 @@ class PadLocation:
         return f"PadLocation(channel={self.channel}, page={self.page}, x={self.x}, y={self.y})"
 
 
-# FIXME: This class holds duplicate state which causes all kinds of evils
 class Page:
+    """
+    One page of 8x8 pads.
+
+    Pads are stored as a tuple of column tuples and PadData is never mutated,
+    so copies of a page share everything and an edit only allocates the column
+    it touches. This makes copying pages and keeping undo history cheap.
+    """
+
     class Listener(ABC):
         def on_page_updated(self, page: "Page"):
             raise NotImplementedError
 
+        def on_pad_changed(self, page: "Page", x: int, y: int):
+            raise NotImplementedError
+
     @property
     def legato_on(self):
         return self._legato_on
@@ -35,20 +45,14 @@ class Page:
         self._debug = False
         self.channel = channel
         self.number = number
-        self.note_map: dict[int, PadData] = {}
         self._legato_on = False
-        page_column_count, page_row_count = 8, 8
-        row = [PadData(i, False) for i in range(page_row_count)]
-        self.pads = [row[:] for _ in range(page_column_count)]
-        for x in range(page_column_count):
-            for y in range(page_row_count):
-                note = Page.get_note(x, y)
-                self.pads[x][y] = PadData(note, False)
-                self.note_map[note] = self.pads[x][y]
-        for row in self.pads:
-            for pad_data in row:
-                self.note_map[pad_data.note] = pad_data
-        self.listeners: set[Page.Listener] = set([])
+        self.pads: Tuple[Tuple[PadData, ...], ...] = EMPTY_PADS
+        self.listeners: Set[Page.Listener] = set([])
+
+    @property
+    def display_pads(self) -> Tuple[Tuple[PadData, ...], ...]:
+        """Pads as shown, with the channel's legato notes drawn over them"""
+        return self.channel.legato.draw(self.number, self.pads)
 
     @staticmethod
     def get_note(x: int, y: int) -> int:
@@ -64,20 +68,43 @@ class Page:
         for listener in self.listeners:
             listener.on_page_updated(self)
 
+    def notify_pad_changed(self, x: int, y: int):
+        for listener in self.listeners:
+            listener.on_pad_changed(self, x, y)
+
     def set_pad(self, x, y, padData: PadData):
-        self.pads[x][y] = padData
-        self.note_map[padData.note] = padData
+        column = self.pads[x]
+        column = column[:y] + (padData,) + column[y + 1:]
+        self.pads = self.pads[:x] + (column,) + self.pads[x + 1:]
+        self.notify_pad_changed(x, y)
         self.notify_update()
 
-    def get_coords_from_note(self, note):
+    def set_pads(self, pads: Tuple[Tuple[PadData, ...], ...]):
+        """Replaces all pads at once, e.g. with pads from a history snapshot"""
+        old_pads, self.pads = self.pads, pads
         for x in range(8):
-            for y in range(8):
-                if self.pads[x][y].note == note:
-                    return x, y
+            # Unchanged columns are shared, so comparing identities is enough
+            if old_pads[x] is not pads[x]:
+                for y in range(8):
+                    if old_pads[x][y] is not pads[x][y]:
+                        self.notify_pad_changed(x, y)
+        self.notify_update()
+
+    @staticmethod
+    def get_coords_from_note(note):
+        x, y = note % 10 - 1, note // 10 - 1
+        if 0 <= x < 8 and 0 <= y < 8:
+            return x, y
         return None, None
 
+    def get_pad_by_note(self, note) -> Optional[PadData]:
+        x, y = self.get_coords_from_note(note)
+        if x is None:
+            return None
+        return self.pads[x][y]
+
     def get_velocity_for_pad_number(self, pad_number):
-        return self.note_map[pad_number].velocity
+        return self.get_pad_by_note(pad_number).velocity
 
     def toggle_pad_by_note(self, note):
         if self._debug:
@@ -96,22 +123,21 @@ class Page:
             return None
 
     def set_velocity(self, x: int, y: int, velocity: int):
-        self.pads[x][y].velocity = velocity
-        self.note_map[self.pads[x][y].note].velocity = velocity
-        self.notify_update()
+        self.set_pad(x, y, self.pads[x][y].with_velocity(velocity))
+
+    def set_ratchets(self, x: int, y: int, ratchets: int):
+        self.set_pad(x, y, self.pads[x][y].with_ratchets(ratchets))
 
-    def get_pads_in_column(self, x: int) -> List[PadData | None]:
+    def set_condition(self, x: int, y: int, condition: int):
+        self.set_pad(x, y, self.pads[x][y].with_condition(condition))
+
+    def get_pads_in_column(self, x: int) -> List[Optional[PadData]]:
         """Returns single column of pads, include functional buttons for better UX"""
-        pads_ids = [Page.get_note(x, y) for y in range(8)]
-        return [self.note_map.get(idx) for idx in pads_ids]
+        return list(self.pads[x])
 
     def __copy__(self):
         new_page = Page(self.channel, self.number)
-        new_page.pads = []
-        for row in self.pads:
-            new_page.pads.append([copy(pad_data) for pad_data in row])
-        new_page.note_map = dict(
-            [(key, copy(value)) for key, value in self.note_map.items()])
+        new_page.pads = self.pads
         return new_page
 
     def __str__(self):
@@ -119,3 +145,54 @@ class Page:
         for row in self.pads:
             pads.append([str(pad_data) for pad_data in row])
         return f'Page(channel={self.channel}, number={self.number})\n{pads}'
+
+
+EMPTY_PADS = tuple(tuple(PadData(Page.get_note(x, y), False) for y in range(8)) for x in range(8))
+
+
+class SparsePages:
+    """
+    Pages of a channel.
+
+    The number of pages follows the channel's length. A page is only stored
+    once it is accessed, so the blank pages of long patterns cost nothing.
+    Iterating goes over stored pages only; the playhead uses `get`, which
+    doesn't create pages.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self._pages: Dict[int, Page] = {}
+
+    def __len__(self):
+        return max(1, -(-self.channel._length // STEPS_PER_PAGE))
+
+    def __getitem__(self, number: int) -> Page:
+        if not 0 <= number < len(self):
+            raise IndexError(f"Page {number} is out of range")
+        page = self._pages.get(number)
+        if page is None:
+            page = Page(self.channel, number)
+            page.legato_on = self.channel.legato_on
+            page.add_listener(self.channel)
+            self._pages[number] = page
+        return page
+
+    def __setitem__(self, number: int, page: Page):
+        previous = self._pages.get(number)
+        if previous is not None:
+            previous.remove_listener(self.channel)
+        page.legato_on = self.channel.legato_on
+        page.add_listener(self.channel)
+        self._pages[number] = page
+
+    def __iter__(self):
+        return iter([self._pages[number] for number in self.numbers()])
+
+    def get(self, number: int) -> Optional[Page]:
+        return self._pages.get(number) if number < len(self) else None
+
+    def numbers(self) -> List[int]:
+        """Numbers of the stored pages within the channel's length"""
+        count = len(self)
+        return sorted(number for number in self._pages if number < count)
@@ -0,0 +1,136 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, OrderedDict, Tuple
+
+from lss.legato import LegatoNote
+from lss.paddata import PadData
+from lss.project import ProjectFile, encode_channels, write_project
+
+PATTERN_SUFFIX = ".lsp"
+
+
+class Pattern:
+    """Decoded contents of one channel: params, step locks, legato notes and the pads that are on"""
+
+    def __init__(
+        self,
+        name: str,
+        params: tuple,
+        pads: List[Tuple[int, int, int, PadData]],
+        locks: List[Tuple[int, int, int]] = (),
+        legato: List[LegatoNote] = (),
+    ):
+        self.name = name
+        self.params = params
+        self.pads = pads
+        self.locks = locks
+        self.legato = legato
+
+    def __str__(self):
+        return f"Pattern(name={self.name}, pads={len(self.pads)})"
+
+
+class PatternBank:
+    """
+    Named patterns stored on disk, one file per pattern.
+
+    Only names are read up front. Patterns are decoded on a worker thread
+    when requested and the most recently used ones stay decoded in an LRU
+    cache, so `get` never touches the disk.
+    """
+
+    def __init__(self, directory: str, cache_size: int = 64):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._names = sorted(
+            name[: -len(PATTERN_SUFFIX)] for name in os.listdir(directory) if name.endswith(PATTERN_SUFFIX)
+        )
+        self._cache_size = cache_size
+        self._cache: OrderedDict[str, Pattern] = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._errors: Dict[str, Exception] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lss-pattern-bank")
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    @property
+    def names(self) -> List[str]:
+        return self._names
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name + PATTERN_SUFFIX)
+
+    def _decode(self, name: str) -> Pattern:
+        try:
+            with ProjectFile(self._path(name)) as project:
+                pattern = Pattern(
+                    name,
+                    project.channel_params(0),
+                    list(project.iter_pads(0)),
+                    list(project.iter_locks(0)),
+                    list(project.iter_legato(0)),
+                )
+        except Exception as e:
+            with self._lock:
+                self._errors[name] = e
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(name, None)
+        with self._lock:
+            self._cache[name] = pattern
+            self._cache.move_to_end(name)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return pattern
+
+    def request(self, name: str) -> None:
+        """Starts decoding a pattern in the background unless it is cached or on its way"""
+        with self._lock:
+            if name in self._cache or name in self._pending:
+                return
+            # A new request tries a pattern that failed before again
+            self._errors.pop(name, None)
+            self._pending[name] = self._executor.submit(self._decode, name)
+
+    def get(self, name: str) -> Optional[Pattern]:
+        """
+        Returns the decoded pattern, or None while it is still loading.
+
+        When decoding failed the error is raised here, once.
+        """
+        with self._lock:
+            error = self._errors.pop(name, None)
+            if error is not None:
+                raise error
+            pattern = self._cache.get(name)
+            if pattern is not None:
+                self._cache.move_to_end(name)
+            return pattern
+
+    def store(self, name: str, channel) -> None:
+        """Saves a channel as a pattern, the file is written on the worker thread"""
+        data = encode_channels([channel])
+        with self._lock:
+            self._cache.pop(name, None)
+        if name not in self._names:
+            self._names.append(name)
+            self._names.sort()
+        self._executor.submit(write_project, self._path(name), data)
+
+    def next_name(self) -> str:
+        index = len(self._names)
+        while f"pattern-{index:04d}" in self._names:
+            index += 1
+        return f"pattern-{index:04d}"
+
+    def neighbour(self, name: Optional[str], offset: int) -> Optional[str]:
+        """Returns the name `offset` places away from `name` in the bank, wrapping around"""
+        if not self._names:
+            return None
+        if name not in self._names:
+            return self._names[0]
+        return self._names[(self._names.index(name) + offset) % len(self._names)]
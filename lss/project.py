@@ -0,0 +1,231 @@
+import asyncio
+import mmap
+import os
+import struct
+
+from lss.channel import PARAMS
+from lss.legato import LegatoNote
+from lss.notetype import NoteType
+from lss.page import EMPTY_PADS, Page
+from lss.paddata import PadData
+
+MAGIC = b"LSSP"
+# Raised once a released format changes, changes before a release keep the number
+PROJECT_VERSION = 1
+
+# magic, version, channel count, params per channel, steps per page, rows per step
+HEADER = struct.Struct("<4sHHHHH")
+# key of each stored param, in the order channel blocks store them, follows the header
+PARAM_KEY = struct.Struct("<16s")
+# offset of each channel's block
+CHANNEL_OFFSET = struct.Struct("<I")
+# number of stored pages, locks and legato notes, params follow as PARAM in PARAM_KEY order, then LOCK
+# and LEGATO records
+CHANNEL_HEADER = struct.Struct("<III")
+PARAM = struct.Struct("<i")
+# step, control, value
+LOCK = struct.Struct("<IBh")
+# row, start step, end step, velocity
+LEGATO = struct.Struct("<BIIB")
+# page number, pads follow as PAD records
+PAGE_HEADER = struct.Struct("<I")
+# is on, note type, velocity, ratchets, condition
+PAD = struct.Struct("<BBBBB")
+
+STEPS = 8
+ROWS = 8
+
+_NOTE_TYPES = {note_type.value: note_type for note_type in NoteType}
+
+
+def _is_blank(pads) -> bool:
+    return pads is EMPTY_PADS or not any(pad_data.is_on for column in pads for pad_data in column)
+
+
+def encode_channels(channels) -> bytes:
+    """
+    Packs channels, their pages and params into the project format.
+
+    Only pages with pads that are on are written, so long sparse patterns stay small.
+    """
+    param_count = len(PARAMS)
+    pad_block_size = STEPS * ROWS * PAD.size
+    blocks = []
+    for channel in channels:
+        pages = [page for page in channel.pages if not _is_blank(page.pads)]
+        locks = list(channel.iter_locks())
+        legato = list(channel.legato)
+        block = bytearray(
+            CHANNEL_HEADER.size
+            + param_count * PARAM.size
+            + len(locks) * LOCK.size
+            + len(legato) * LEGATO.size
+            + len(pages) * (PAGE_HEADER.size + pad_block_size)
+        )
+        CHANNEL_HEADER.pack_into(block, 0, len(pages), len(locks), len(legato))
+        offset = CHANNEL_HEADER.size
+        for value in channel.get_params():
+            PARAM.pack_into(block, offset, value)
+            offset += PARAM.size
+        for lock in locks:
+            LOCK.pack_into(block, offset, *lock)
+            offset += LOCK.size
+        for note in legato:
+            LEGATO.pack_into(block, offset, note.row, note.start, note.end, note.velocity)
+            offset += LEGATO.size
+        for page in pages:
+            PAGE_HEADER.pack_into(block, offset, page.number)
+            offset += PAGE_HEADER.size
+            for column in page.pads:
+                for pad_data in column:
+                    if pad_data.is_on:
+                        PAD.pack_into(
+                            block,
+                            offset,
+                            1,
+                            pad_data.note_type.value,
+                            pad_data.velocity,
+                            pad_data.ratchets,
+                            pad_data.condition,
+                        )
+                    offset += PAD.size
+        blocks.append(block)
+    data = bytearray(HEADER.pack(MAGIC, PROJECT_VERSION, len(channels), param_count, STEPS, ROWS))
+    for param in PARAMS:
+        data += PARAM_KEY.pack(param.key.encode())
+    offset = len(data) + len(channels) * CHANNEL_OFFSET.size
+    for block in blocks:
+        data += CHANNEL_OFFSET.pack(offset)
+        offset += len(block)
+    for block in blocks:
+        data += block
+    return bytes(data)
+
+
+def encode_project(channels_manager) -> bytes:
+    return encode_channels(channels_manager.channels)
+
+
+def write_project(path: str, data: bytes) -> None:
+    """Writes the file next to the target and swaps it in so a crash never leaves half a project"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def save_project(channels_manager, path: str) -> None:
+    write_project(path, encode_project(channels_manager))
+
+
+async def save_project_async(channels_manager, path: str) -> None:
+    """
+    Saves without blocking the event loop.
+
+    State is packed on the loop, between steps, so the snapshot is consistent;
+    only the disk write happens in a worker thread.
+    """
+    data = encode_project(channels_manager)
+    await asyncio.get_event_loop().run_in_executor(None, write_project, path, data)
+
+
+class ProjectFile:
+    """Memory-mapped project file, pages are decoded straight from the mapping"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.channel_count, self.param_count, self.steps, self.rows = HEADER.unpack_from(
+            self._mmap, 0
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an LSS project")
+        if version != PROJECT_VERSION:
+            raise ValueError(f"Unsupported project version: {version}")
+        stored_keys = [
+            key.rstrip(b"\0").decode() for (key,) in PARAM_KEY.iter_unpack(
+                self._mmap[HEADER.size : HEADER.size + self.param_count * PARAM_KEY.size])
+        ]
+        # Where each of PARAMS is stored, params the file doesn't have are None
+        self._param_positions = [
+            stored_keys.index(param.key) if param.key in stored_keys else None for param in PARAMS
+        ]
+        self._offsets_start = HEADER.size + self.param_count * PARAM_KEY.size
+        self._page_size = PAGE_HEADER.size + self.steps * self.rows * PAD.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._mmap.close()
+
+    def _channel_offset(self, number: int) -> int:
+        return CHANNEL_OFFSET.unpack_from(self._mmap, self._offsets_start + number * CHANNEL_OFFSET.size)[0]
+
+    def channel_params(self, number: int) -> tuple:
+        """Returns the params of a channel in PARAMS order, None for params the file doesn't have"""
+        offset = self._channel_offset(number) + CHANNEL_HEADER.size
+        return tuple(
+            None if position is None else PARAM.unpack_from(self._mmap, offset + position * PARAM.size)[0]
+            for position in self._param_positions
+        )
+
+    def iter_locks(self, number: int):
+        """Yields (step, control, value) for every lock of a channel"""
+        offset = self._channel_offset(number)
+        _page_count, lock_count, _legato_count = CHANNEL_HEADER.unpack_from(self._mmap, offset)
+        offset += CHANNEL_HEADER.size + self.param_count * PARAM.size
+        for i in range(lock_count):
+            yield LOCK.unpack_from(self._mmap, offset + i * LOCK.size)
+
+    def iter_legato(self, number: int):
+        """Yields every legato note of a channel"""
+        offset = self._channel_offset(number)
+        _page_count, lock_count, legato_count = CHANNEL_HEADER.unpack_from(self._mmap, offset)
+        offset += CHANNEL_HEADER.size + self.param_count * PARAM.size + lock_count * LOCK.size
+        for i in range(legato_count):
+            yield LegatoNote(*LEGATO.unpack_from(self._mmap, offset + i * LEGATO.size))
+
+    def iter_pads(self, number: int):
+        """Yields (page, x, y, pad data) for every pad of a channel that is on"""
+        offset = self._channel_offset(number)
+        page_count, lock_count, legato_count = CHANNEL_HEADER.unpack_from(self._mmap, offset)
+        offset += (
+            CHANNEL_HEADER.size
+            + self.param_count * PARAM.size
+            + lock_count * LOCK.size
+            + legato_count * LEGATO.size
+        )
+        for _ in range(page_count):
+            (page_number,) = PAGE_HEADER.unpack_from(self._mmap, offset)
+            start = offset + PAGE_HEADER.size
+            with memoryview(self._mmap)[start : offset + self._page_size] as pads:
+                for i, (is_on, note_type, velocity, ratchets, condition) in enumerate(PAD.iter_unpack(pads)):
+                    if is_on:
+                        x, y = divmod(i, self.rows)
+                        yield page_number, x, y, PadData(
+                            Page.get_note(x, y), True, velocity, _NOTE_TYPES[note_type], ratchets, condition
+                        )
+            offset += self._page_size
+
+    def load_channel(self, channel, number: int) -> None:
+        channel.set_params(self.channel_params(number))
+        channel.set_locks(self.iter_locks(number))
+        channel.set_legato_notes(self.iter_legato(number))
+        for page_number, x, y, pad_data in self.iter_pads(number):
+            if page_number < len(channel.pages):
+                channel.pages[page_number].set_pad(x, y, pad_data)
+
+    def load_into(self, channels_manager) -> None:
+        for number, channel in enumerate(channels_manager.channels[: self.channel_count]):
+            self.load_channel(channel, number)
+
+
+def load_project(channels_manager, path: str) -> None:
+    with ProjectFile(path) as project:
+        project.load_into(channels_manager)
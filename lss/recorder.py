@@ -0,0 +1,55 @@
+from collections import deque
+from typing import Dict, List, Tuple
+
+from lss.legato import LegatoNote
+
+
+class Recorder:
+    """
+    Host notes captured while a channel records.
+
+    Notes are appended to a deque with the clock tick they arrived on, which
+    takes no lock, and are only quantized to steps when the channel drains it
+    after playing a clock, so recording never holds up the notes of a step.
+    """
+
+    def __init__(self):
+        # (tick, note, velocity, row), the row is None for note offs
+        self._captured: deque = deque()
+        # Notes held down as note -> (tick, row, velocity), their length is known when they are released
+        self._held: Dict[int, Tuple[float, int, int]] = {}
+
+    def capture(self, tick: float, note: int, velocity: int, row: int) -> None:
+        self._captured.append((tick, note, velocity, row))
+
+    def release(self, tick: float, note: int) -> None:
+        self._captured.append((tick, note, 0, None))
+
+    def forget_held(self) -> None:
+        """Drops held notes, e.g. when the host jumps and their ticks no longer line up"""
+        self._held = {}
+
+    def drain(self, step_size: int, length: int) -> Tuple[List[Tuple[int, int, int]], List[LegatoNote]]:
+        """
+        Returns (step, row, velocity) of started notes and the legato notes of released ones.
+
+        Notes snap to the nearest step. A note held past the step it started
+        on becomes a legato note up to the step it was released on.
+        """
+        pads = []
+        legato = []
+        while self._captured:
+            tick, note, velocity, row = self._captured.popleft()
+            if row is not None:
+                self._held[note] = (tick, row, velocity)
+                pads.append((int(tick / step_size + 0.5) % length, row, velocity))
+                continue
+            held = self._held.pop(note, None)
+            if held is None:
+                continue
+            start_tick, row, velocity = held
+            start = int(start_tick / step_size + 0.5)
+            end = min(int(tick / step_size + 0.5) - 1, start + length - 1)
+            if end > start:
+                legato.append(LegatoNote(row, start % length, end % length, velocity))
+        return pads, legato
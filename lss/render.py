@@ -0,0 +1,141 @@
+import math
+from typing import Dict, List, Optional, Tuple
+
+import mido
+
+from lss.channels_manager import ChannelsManager
+from lss.clock_math import CLOCKS_PER_BAR, CLOCKS_PER_BEAT
+from lss.devices.twister import ControllerGroup
+from lss.groove import Groove
+from lss.scheduler import TempoTracker, VirtualTimer
+from lss.state import load_state_file
+
+TICKS_PER_BEAT = 960
+TICKS_PER_CLOCK = TICKS_PER_BEAT // CLOCKS_PER_BEAT
+
+
+def chord_script(notes: List[int]) -> Dict[int, List[mido.Message]]:
+    """Holds the given notes for the whole render"""
+    return {0: [mido.Message("note_on", note=note) for note in notes]}
+
+
+def midi_file_script(path: str) -> Dict[int, List[mido.Message]]:
+    """Reads host note input from a MIDI file, keyed by clock tick"""
+    midi_file = mido.MidiFile(path)
+    script: Dict[int, List[mido.Message]] = {}
+    for track in midi_file.tracks:
+        ticks = 0
+        for msg in track:
+            ticks += msg.time
+            if msg.type == "note_on" and msg.velocity == 0:
+                msg = mido.Message("note_off", note=msg.note)
+            if msg.type in ("note_on", "note_off"):
+                clock = round(ticks * CLOCKS_PER_BEAT / midi_file.ticks_per_beat)
+                script.setdefault(clock, []).append(msg)
+    return script
+
+
+class _RecordingPort:
+    """Output port of a rendered channel, keeps what is sent with the time it was sent at"""
+
+    def __init__(self, timer: VirtualTimer):
+        self.timer = timer
+        self.messages: List[Tuple[float, mido.Message]] = []
+
+    def send(self, message: mido.Message) -> None:
+        self.messages.append((self.timer.now(), message))
+
+
+class Renderer:
+    """
+    Runs channels against a virtual clock and collects their output.
+
+    Channels play into ports of the renderer with a virtual timer, so steps,
+    grooves, ratchets, note offs and voice limits run through the same code
+    as live playback, but no time passes between clock ticks and rendering
+    runs as fast as the CPU allows.
+    """
+
+    def __init__(self, channels_manager: ChannelsManager, bpm: float = 120.0):
+        self.channels_manager = channels_manager
+        self.bpm = bpm
+
+    def render(self, bars: int, script: Dict[int, List[mido.Message]]) -> mido.MidiFile:
+        clocks = bars * CLOCKS_PER_BAR
+        ports = [self._render_channel(channel, clocks, script) for channel in self.channels_manager.channels]
+        return self._to_midi_file(ports)
+
+    def _render_channel(self, channel, clocks: int, script: Dict[int, List[mido.Message]]) -> _RecordingPort:
+        """
+        Plays one channel for a number of clocks, channels don't share anything while playing.
+
+        Only clocks with work are handled: steps, repeats, host notes and the
+        clocks that end with a note off or a delayed step due.
+        """
+        seconds_per_clock = 60.0 / self.bpm / CLOCKS_PER_BEAT
+        timer = VirtualTimer()
+        port = _RecordingPort(timer)
+        channel.midi_outport = port
+        channel.timer = timer
+        channel._tempo = TempoTracker(self.bpm)
+        script_clocks = sorted(clock for clock in script if clock < clocks)
+        next_script = 0
+        clock_message = mido.Message("clock")
+        clock = 0
+        while clock < clocks:
+            # Callbacks due since the last clock see the clock count they would see live
+            channel.skip_to_clock(clock)
+            timer.run_until(clock * seconds_per_clock)
+            if next_script < len(script_clocks) and script_clocks[next_script] == clock:
+                for msg in script[clock]:
+                    channel.proceess_host_note_message(msg)
+                next_script += 1
+            if channel.next_busy_clock() == clock:
+                channel.process_host_clock_message(clock_message)
+            following = min(channel.next_busy_clock(), clocks)
+            if next_script < len(script_clocks):
+                following = min(following, script_clocks[next_script])
+            due = timer.next_time()
+            if due is not None:
+                following = min(following, max(clock + 1, math.ceil(due / seconds_per_clock)))
+            clock = following
+        channel.skip_to_clock(clocks)
+        timer.run_until(clocks * seconds_per_clock)
+        # Legato notes and long gates still sounding at the end are ended there
+        channel.release_notes()
+        return port
+
+    def _to_midi_file(self, ports: List[_RecordingPort]) -> mido.MidiFile:
+        ticks_per_second = TICKS_PER_BEAT * self.bpm / 60.0
+        midi_file = mido.MidiFile(type=1, ticks_per_beat=TICKS_PER_BEAT)
+        tempo_track = mido.MidiTrack()
+        tempo_track.append(mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(self.bpm)))
+        midi_file.tracks.append(tempo_track)
+        for channel, port in zip(self.channels_manager.channels, ports):
+            track = mido.MidiTrack()
+            track.append(mido.MetaMessage("track_name", name=f"Channel {channel.number + 1}"))
+            previous = 0
+            for seconds, message in port.messages:
+                # Messages were sent in time order, rounding to ticks keeps it. Nothing else holds them
+                ticks = round(seconds * ticks_per_second)
+                message.time = ticks - previous
+                track.append(message)
+                previous = ticks
+            midi_file.tracks.append(track)
+        return midi_file
+
+
+def render_to_file(
+    output_path: str,
+    bars: int,
+    script: Dict[int, List[mido.Message]],
+    state_path=None,
+    bpm: float = 120.0,
+    grooves: Optional[List[Groove]] = None,
+) -> None:
+    channels_manager = ChannelsManager(ControllerGroup(), [], False)
+    channels_manager.set_grooves(grooves or [])
+    if state_path:
+        load_state_file(channels_manager, state_path)
+    Renderer(channels_manager, bpm).render(bars, script).save(output_path)
+    channels_manager.close()
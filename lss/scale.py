@@ -0,0 +1,57 @@
+from typing import List, Tuple
+
+SCALES = [
+    ("Chromatic", (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11)),
+    ("Major", (0, 2, 4, 5, 7, 9, 11)),
+    ("Minor", (0, 2, 3, 5, 7, 8, 10)),
+    ("Dorian", (0, 2, 3, 5, 7, 9, 10)),
+    ("Phrygian", (0, 1, 3, 5, 7, 8, 10)),
+    ("Lydian", (0, 2, 4, 6, 7, 9, 11)),
+    ("Mixolydian", (0, 2, 4, 5, 7, 9, 10)),
+    ("Locrian", (0, 1, 3, 5, 6, 8, 10)),
+    ("Harmonic minor", (0, 2, 3, 5, 7, 8, 11)),
+    ("Melodic minor", (0, 2, 3, 5, 7, 9, 11)),
+    ("Major pentatonic", (0, 2, 4, 7, 9)),
+    ("Minor pentatonic", (0, 3, 5, 7, 10)),
+    ("Blues", (0, 3, 5, 6, 7, 10)),
+]
+KEYS = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+
+MIDI_NOTES = 128
+# The arpeggiator stacks held keys up to 8 octaves, tables cover all of them
+NOTE_TABLE_SIZE = MIDI_NOTES + 8 * 12
+
+
+def fold_note(note: int) -> int:
+    """Moves a note by octaves until it is a valid MiDI note"""
+    while note >= MIDI_NOTES:
+        note -= 12
+    while note < 0:
+        note += 12
+    return note
+
+
+def quantize_note(note: int, intervals: Tuple[int, ...], key: int) -> int:
+    """Returns the nearest note of the scale, the lower one when two are as near"""
+    degrees = {(key + interval) % 12 for interval in intervals}
+    for distance in range(7):
+        if (note - distance) % 12 in degrees:
+            return note - distance
+        if (note + distance) % 12 in degrees:
+            return note + distance
+    return note
+
+
+def build_note_table(scale: int, key: int, octave_shift: int) -> List[int]:
+    """
+    Maps every note the arpeggiator can produce to the note that is sent.
+
+    Notes are shifted by octaves, snapped to the scale and folded into the
+    MiDI range, so turning a note into output is a single index.
+    """
+    _name, intervals = SCALES[scale]
+    table = []
+    for note in range(NOTE_TABLE_SIZE):
+        out_note = quantize_note(fold_note(note + octave_shift * 12), intervals, key)
+        table.append(fold_note(out_note))
+    return table
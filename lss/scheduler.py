@@ -0,0 +1,128 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Optional
+
+from lss.clock_math import CLOCKS_PER_BEAT
+
+# How much each clock interval moves the tempo estimate
+TEMPO_SMOOTHING = 0.1
+# Longer gaps between clocks are pauses, not tempo
+MAX_CLOCK_INTERVAL = 0.5
+
+
+class TickScheduler:
+    """
+    Runs callbacks on host clock ticks.
+
+    Events wait in a heap keyed by tick, so each clock only touches the events
+    that are due and nothing has to sleep and poll in between.
+    """
+
+    def __init__(self):
+        self._events: list = []
+        # Keeps events on the same tick in the order they were scheduled
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._events)
+
+    def schedule(self, tick: int, callback, *args) -> None:
+        heapq.heappush(self._events, (tick, next(self._counter), callback, args))
+
+    def next_tick(self) -> Optional[int]:
+        return self._events[0][0] if self._events else None
+
+    def run_until(self, tick: int) -> None:
+        """Runs every event scheduled for `tick` or earlier"""
+        while self._events and self._events[0][0] <= tick:
+            _tick, _count, callback, args = heapq.heappop(self._events)
+            callback(*args)
+
+    def clear(self) -> None:
+        self._events = []
+
+
+class LoopTimer:
+    """Runs callbacks some seconds from now on the event loop, how channels time notes when playing live"""
+
+    @staticmethod
+    def now() -> float:
+        return time.monotonic()
+
+    @staticmethod
+    def call_later(seconds: float, callback, *args) -> asyncio.TimerHandle:
+        return asyncio.get_event_loop().call_later(seconds, callback, *args)
+
+
+class _VirtualTimerHandle:
+    def __init__(self, callback, args: tuple):
+        self._callback = callback
+        self._args = args
+        self._cancelled = False
+
+    def cancel(self) -> None:
+        self._cancelled = True
+
+    def run(self) -> None:
+        if not self._cancelled:
+            self._callback(*self._args)
+
+
+class VirtualTimer:
+    """
+    Stands in for `LoopTimer` when rendering offline.
+
+    Time only moves when `run_until` is called, callbacks wait in a heap until
+    then, so channels play the same code as live without waiting for it.
+    """
+
+    def __init__(self):
+        self._now = 0.0
+        self._events: list = []
+        self._counter = itertools.count()
+
+    def now(self) -> float:
+        return self._now
+
+    def next_time(self) -> Optional[float]:
+        """Returns when the next callback is due, None without callbacks"""
+        return self._events[0][0] if self._events else None
+
+    def call_later(self, seconds: float, callback, *args) -> _VirtualTimerHandle:
+        handle = _VirtualTimerHandle(callback, args)
+        heapq.heappush(self._events, (self._now + seconds, next(self._counter), handle))
+        return handle
+
+    def run_until(self, seconds: float) -> None:
+        """Runs every callback due by `seconds`, each one sees the time it was due at"""
+        while self._events and self._events[0][0] <= seconds:
+            self._now, _count, handle = heapq.heappop(self._events)
+            handle.run()
+        self._now = seconds
+
+
+class TempoTracker:
+    """Measures the host tempo from the time between clock messages"""
+
+    def __init__(self, bpm: float = 120.0):
+        self.seconds_per_clock = 60.0 / bpm / CLOCKS_PER_BEAT
+        self._last_clock: Optional[float] = None
+
+    def clock(self, now: float) -> None:
+        if self._last_clock is not None:
+            interval = now - self._last_clock
+            if interval < MAX_CLOCK_INTERVAL:
+                self.seconds_per_clock += (interval - self.seconds_per_clock) * TEMPO_SMOOTHING
+        self._last_clock = now
+
+    def clocks_since_last(self, now: float) -> float:
+        """Returns how far into the current clock `now` is, as a fraction of a clock"""
+        if self._last_clock is None:
+            return 0.0
+        return min(1.0, (now - self._last_clock) / self.seconds_per_clock)
+
+    def reset(self) -> None:
+        """Forgets the last clock so the gap of a pause isn't measured"""
+        self._last_clock = None
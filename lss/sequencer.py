@@ -1,92 +1,268 @@
 import asyncio
+import os
 import time
+from functools import partial
+from typing import List, Optional
 
-from lss.channels_manager import ChannelsManager
+from lss.channel import LOCK_CONTROLS, MAX_RATCHETS
+from lss.channels_manager import CHANNELS, ChannelsManager
+from lss.control_server import ControlServer
+from lss.groove import Groove
 from lss.midi import ControlMessage, NoteMessage, ClockMessage
-from lss.utils import LSS_ASCII, open_output, register_signal_handler
-from .page import Page, PadLocation
-from lss.devices.launchpad_layout import LaunchpadLayout
+from lss.journal import Journal, replay
+from lss.pattern_bank import PatternBank
+from lss.shared_store import SharedPatternStore
+from lss.state import is_json_state, load_state_file, save_state_file, save_state_file_async
+from lss.trig_conditions import TRIG_CONDITIONS
+from lss.voices import MIDI_CHANNELS
+from lss.workers import WorkerPool
+from lss.grid_view import CHANNEL_PADS, GridView
+from lss.utils import LSS_ASCII, Color, open_input, open_output, register_signal_handler
+from .page import PadLocation
+from lss.devices.launchpad_layout import ROLE_CHANNEL, LaunchpadLayout
+from lss.devices.twister import ControllerGroup
 
 # TODO: Move this into a config file (that is shared across features, see PARAMS constant in lss/channel.py)
 VELOCITY_CC = 12
 VELOCITY_CHANNEL = 0
+RATCHETS_CC = 5
+RATCHETS_CHANNEL = 0
+# Second bank of the Twister, every knob of the first one is taken
+CONDITION_CC = 16
+CONDITION_CHANNEL = 0
+FILL_CC = 9
+FILL_CHANNEL = 1
 LEGATO_CC = 12
 LEGATO_CHANNEL = 1
 PRINT_CC = 8
 PRINT_CHANNEL = 1
+SAVE_CC = 0
+SAVE_CHANNEL = 1
+PATTERN_PREVIOUS_CC = 4
+PATTERN_NEXT_CC = 5
+PATTERN_STORE_CC = 6
+PATTERN_CHANNEL = 1
+PATTERN_CONTROLS = {PATTERN_PREVIOUS_CC, PATTERN_NEXT_CC, PATTERN_STORE_CC}
+UNDO_CC = 1
+REDO_CC = 2
+HISTORY_CHANNEL = 1
+LOCK_CC = 3
+CLEAR_LOCKS_CC = 7
+LOCK_CHANNEL = 1
+LOCK_KNOB_CHANNEL = 0
+RECORD_CC = 10
+RECORD_CHANNEL = 1
+OUTPUT_PORT_NAME = "Launchpad Step Sequencer"
+# How often every input port is checked for new messages
+POLL_INTERVAL = 0.001
 
 
-class Sequencer(ChannelsManager.Listener):
-    def __init__(self, launchpad, debug: bool = False):
+class Sequencer:
+    def __init__(
+        self,
+        launchpads: list,
+        controllers: list,
+        debug: bool = False,
+        state_path: Optional[str] = None,
+        bank_path: Optional[str] = None,
+        undo_depth: int = 100,
+        grooves: Optional[List[Groove]] = None,
+        channel_count: int = CHANNELS,
+        channels_per_port: int = MIDI_CHANNELS,
+        workers: int = 0,
+        shared_store: Optional[str] = None,
+        control_socket: Optional[str] = None,
+    ):
         self._debug = debug
+        self._state_path = state_path
+        self.pattern_bank = PatternBank(bank_path) if bank_path else None
         self._done = False
 
-        # Create virtual MiDI device where sequencer sends signals
-        self.midi_outport = open_output(
-            "Launchpad Step Sequencer", virtual=True, autoreset=True)
+        # Create virtual MiDI devices where sequencer sends signals, one per channels_per_port channels
+        port_names = [
+            OUTPUT_PORT_NAME if i == 0 else f"{OUTPUT_PORT_NAME} {i + 1}"
+            for i in range(-(-channel_count // channels_per_port))
+        ]
+        # With workers the ports are opened by the worker processes
+        self.midi_outports = [] if workers else [
+            open_output(name, virtual=True, autoreset=True) for name in port_names]
+        # Host clock and notes come in through one port, named after the first grid
+        self._host_inport = open_input(launchpads[0].name + " Virtual Input", virtual=True, autoreset=True)
         register_signal_handler(self._sig_handler)
 
-        # Setup launchpad
-        self.launchpad = launchpad
-        self.launchpad.hand_shake()
+        # Setup launchpads and controllers, all of them edit the same channels
+        self.launchpads = launchpads
+        for launchpad in self.launchpads:
+            launchpad.hand_shake()
         self._show_lss()
+        self.controllers = ControllerGroup(controllers)
         self.launchpad_layout = LaunchpadLayout()
+        # What each top row button does, by control number
+        self._menu_handlers = self._build_menu_handlers()
         self.channels_manager = ChannelsManager(
-            launchpad, self.midi_outport, debug)
-        self.channels_manager.add_listener(self)
-        self.launchpad.set_page(self.channels_manager.get_current_page())
-        self.last_pad_location: PadLocation | None = None
+            self.controllers, self.midi_outports, debug, undo_depth, channel_count, channels_per_port)
+        self.channels_manager.set_grooves(grooves or [])
+        self.journal: Optional[Journal] = None
+        if state_path and not is_json_state(state_path):
+            # Binary projects are autosaved: edits go to a journal next to the project
+            journal_path = state_path + ".journal"
+            replayed = replay(self.channels_manager, state_path, journal_path)
+            self.journal = Journal(self.channels_manager, state_path, journal_path)
+            if replayed:
+                self.journal.snapshot()
+        elif state_path and os.path.exists(state_path):
+            load_state_file(self.channels_manager, state_path)
+        self.workers: Optional[WorkerPool] = None
+        if workers:
+            self.workers = WorkerPool(self.channels_manager, port_names, workers, grooves, debug)
+        # Patterns are published for other processes to read and edit
+        self.shared_store = SharedPatternStore(self.channels_manager, shared_store) if shared_store else None
+        # Local tools send batches of edits through a Unix socket, it is opened when running
+        self.control_server = None
+        if control_socket:
+            self.control_server = ControlServer(self.channels_manager, control_socket, self.pattern_bank)
+        # Every grid starts on its own channel, as far as there are channels
+        self.views = [
+            GridView(launchpad, self.channels_manager, i % len(self.channels_manager.channels))
+            for i, launchpad in enumerate(self.launchpads)
+        ]
+        self.last_pad_location: Optional[PadLocation] = None
         self.legato_on = False
         self.print_mode_on = False
-
-    def on_channel_or_page_changed(self, channel: int, page: int):
-        self.launchpad.reset_all_pads()
-        self.launchpad.set_channel_number(channel)
-        self.launchpad.set_page_number(page)
-        self.launchpad.set_page(self.channels_manager.get_current_page())
-
-    def on_page_updated(self, page: Page):
-        self.launchpad.set_page(page)
+        # While on, lockable knobs lock the step of the last touched pad instead of changing the channel
+        self.lock_mode_on = False
 
     def _sig_handler(self, signum, frame):
         print("\nExiting...")
         self._done = True
+        if self.journal:
+            self.journal.snapshot()
+            self.journal.close()
+        elif self._state_path:
+            save_state_file(self.channels_manager, self._state_path)
+        if self.pattern_bank:
+            self.pattern_bank.close()
+        if self.workers:
+            self.workers.close()
+        if self.shared_store:
+            self.shared_store.close()
+        if self.control_server:
+            self.control_server.close()
         self.channels_manager.close()
-        self.channels_manager.remove_listener(self)
-        self.launchpad.close()
+        for view in self.views:
+            view.close()
+        for launchpad in self.launchpads:
+            launchpad.close()
+        self.controllers.close()
+        self._host_inport.close()
         self._running = False
-        self.midi_outport.close()
+        for midi_outport in self.midi_outports:
+            midi_outport.close()
+
+    def _save(self) -> None:
+        if not self._state_path:
+            print("No state file to save to, start with --state")
+            return
+        if self.journal:
+            self.journal.snapshot()
+        else:
+            # Saving while playing, the write and fsync would hold up the clock
+            asyncio.get_event_loop().create_task(
+                save_state_file_async(self.channels_manager, self._state_path))
 
     def _show_lss(self) -> None:
         """Show LSS when starting sequencer"""
-        self.launchpad.reset_all_pads()
         pads = [61, 51, 41, 31, 32, 65, 54, 45, 34, 68, 57, 48, 37]
-        self.launchpad.blink_pads(pads)
+        for launchpad in self.launchpads:
+            launchpad.show(dict.fromkeys(pads, Color.PINK), {})
         time.sleep(1.5)
-        self.launchpad.reset_all_pads()
 
     async def _process_controller_message(self, msg) -> None:
-        if msg.control == PRINT_CC and msg.channel == PRINT_CHANNEL and msg.value != 0:
-            self.print_mode_on = not self.print_mode_on
+        if msg.control == PRINT_CC and msg.channel == PRINT_CHANNEL:
+            # The release stops here too, the scale knob sends the same control
+            if msg.value != 0:
+                self.print_mode_on = not self.print_mode_on
             return
         if self.print_mode_on:
             print(f"Controller message: {msg}")
             return
+        self._drop_stale_pad_location()
+        if msg.control == SAVE_CC and msg.channel == SAVE_CHANNEL and msg.value != 0:
+            self._save()
+            return
+        if msg.channel == HISTORY_CHANNEL and msg.control in (UNDO_CC, REDO_CC):
+            # Releases stop here too, redo shares its control with the seed knob
+            if msg.value != 0 and msg.control == UNDO_CC:
+                self.channels_manager.undo()
+            elif msg.value != 0:
+                self.channels_manager.redo()
+            return
+        if msg.channel == PATTERN_CHANNEL and msg.control in PATTERN_CONTROLS:
+            # Releases and presses without --bank stop here too, they share controls with knobs
+            if self.pattern_bank and msg.value != 0:
+                if msg.control == PATTERN_PREVIOUS_CC:
+                    self.channels_manager.queue_neighbour_pattern(self.pattern_bank, -1)
+                elif msg.control == PATTERN_NEXT_CC:
+                    self.channels_manager.queue_neighbour_pattern(self.pattern_bank, 1)
+                else:
+                    self.channels_manager.store_pattern(self.pattern_bank)
+            return
+        if msg.control == FILL_CC and msg.channel == FILL_CHANNEL:
+            # Fill lasts while the button is held
+            self.channels_manager.set_fill(msg.value != 0)
+            if self.workers:
+                self.workers.set_fill(msg.value != 0)
+            return
+        if msg.control == RECORD_CC and msg.channel == RECORD_CHANNEL:
+            # The release stops here too, quick arp's knob sends the same control
+            if msg.value != 0:
+                recording = self.channels_manager.toggle_recording()
+                print(f"Recording {'on' if recording else 'off'}")
+            return
+        if msg.control == LOCK_CC and msg.channel == LOCK_CHANNEL:
+            # The release stops here too, the arp octaves knob sends the same control
+            if msg.value != 0:
+                self.lock_mode_on = not self.lock_mode_on
+            return
+        if msg.control == CLEAR_LOCKS_CC and msg.channel == LOCK_CHANNEL:
+            # Releases and presses without a selected pad stop here too, the key knob sends the same control
+            if msg.value != 0 and self.last_pad_location:
+                self.channels_manager.clear_locks(self.last_pad_location)
+            return
+        if (
+            self.lock_mode_on
+            and self.last_pad_location
+            and msg.channel == LOCK_KNOB_CHANNEL
+            and msg.control in LOCK_CONTROLS
+        ):
+            self.channels_manager.set_lock(self.last_pad_location, msg.control, msg.value)
+            return
         if msg.control == VELOCITY_CC and msg.channel == VELOCITY_CHANNEL and self.last_pad_location:
             self.channels_manager.set_velocity(
                 self.last_pad_location, msg.value)
+        if msg.control == RATCHETS_CC and msg.channel == RATCHETS_CHANNEL and self.last_pad_location:
+            self.channels_manager.set_ratchets(
+                self.last_pad_location, 1 + msg.value * (MAX_RATCHETS - 1) // 127)
+        if msg.control == CONDITION_CC and msg.channel == CONDITION_CHANNEL and self.last_pad_location:
+            self.channels_manager.set_condition(
+                self.last_pad_location, msg.value * (len(TRIG_CONDITIONS) - 1) // 127)
         if msg.control == LEGATO_CC and msg.channel == LEGATO_CHANNEL and msg.value != 0:
             self.legato_on = not self.legato_on
             self.channels_manager.legato_on = self.legato_on
         await self.channels_manager.process_controller_message(msg)
 
-    def _process_control_message(self, msg: ControlMessage) -> None:
+    def _drop_stale_pad_location(self) -> None:
+        """Forgets the last touched pad once its page is past the length of its channel"""
+        location = self.last_pad_location
+        if location and location.page >= len(self.channels_manager.channels[location.channel].pages):
+            self.last_pad_location = None
+
+    def _process_control_message(self, msg: ControlMessage, view: GridView) -> None:
         if self._debug:
             print('CONTROL message: {}'.format(msg))
         if msg.value != 127:
             return
-        if self.launchpad_layout.is_menu_pad(msg.control):
-            self._process_menu_pad(msg.control)
+        self._process_menu_pad(msg.control, view)
 
     async def _process_host_msg(self, msg) -> None:
         if self._debug:
@@ -105,92 +281,111 @@ class Sequencer(ChannelsManager.Listener):
 
     def _process_host_note_message(self, msg: NoteMessage) -> None:
         self.channels_manager.proceess_host_note_message(msg)
+        if self.workers:
+            self.workers.send_host_note(msg)
 
     def _process_host_clock_message(self, msg: ClockMessage) -> None:
+        # Pattern switches happen here, so workers get the new patterns before the clock
         self.channels_manager.process_host_clock_message(msg)
+        if self.workers:
+            self.workers.send_clock(msg)
 
-    def _process_menu_pad(self, pad):
-        if pad == self.launchpad_layout.up:
-            print('UP')
-        if pad == self.launchpad_layout.down:
-            print('DOWN')
-        if pad == self.launchpad_layout.left:
-            print('LEFT')
-        if pad == self.launchpad_layout.right:
-            self.channels_manager.copy_to_next_page()
-        if pad == self.launchpad_layout.page0:
-            self.channels_manager.set_page(0)
-        if pad == self.launchpad_layout.page1:
-            self.channels_manager.set_page(1)
-        if pad == self.launchpad_layout.page2:
-            self.channels_manager.set_page(2)
-        if pad == self.launchpad_layout.page3:
-            self.channels_manager.set_page(3)
-
-    def _process_channel_pad(self, pad):
+    def _focus(self, view: GridView) -> bool:
+        """Makes the grid's channel the one edited, fails while a legato note waits for its end"""
+        if view.channel == self.channels_manager.current_channel:
+            return True
         if self.channels_manager.legato_started:
+            return False
+        self.channels_manager.set_channel(view.channel)
+        return True
+
+    def _build_menu_handlers(self) -> list:
+        layout = self.launchpad_layout
+        handlers = [None] * len(layout.roles)
+        handlers[layout.up] = lambda view: self._set_view_channel(view, view.channel - CHANNEL_PADS)
+        handlers[layout.down] = lambda view: self._set_view_channel(view, view.channel + CHANNEL_PADS)
+        handlers[layout.left] = lambda view: print('LEFT')
+        handlers[layout.right] = lambda view: self.channels_manager.copy_to_next_page()
+        for page, pad in enumerate(layout.page_controls):
+            handlers[pad] = lambda view, page=page: self.channels_manager.set_page(page)
+        return handlers
+
+    def _process_menu_pad(self, pad, view: GridView):
+        handler = self._menu_handlers[pad]
+        if handler is not None and self._focus(view):
+            handler(view)
+
+    def _set_view_channel(self, view: GridView, channel: int):
+        if self.channels_manager.legato_started or not 0 <= channel < len(self.channels_manager.channels):
+            return
+        view.channel = channel
+        self.channels_manager.set_channel(channel)
+
+    def _process_channel_pad(self, pad, view: GridView):
+        # The first pad of the last column is not a channel
+        index = self.launchpad_layout.indices[pad]
+        if index < 0:
             return
-        if pad == self.launchpad_layout.channel0:
-            self.channels_manager.set_channel(0)
-        if pad == self.launchpad_layout.channel1:
-            self.channels_manager.set_channel(1)
-        if pad == self.launchpad_layout.channel2:
-            self.channels_manager.set_channel(2)
-        if pad == self.launchpad_layout.channel3:
-            self.channels_manager.set_channel(3)
-        if pad == self.launchpad_layout.channel4:
-            self.channels_manager.set_channel(4)
-        if pad == self.launchpad_layout.channel5:
-            self.channels_manager.set_channel(5)
-        if pad == self.launchpad_layout.channel6:
-            self.channels_manager.set_channel(6)
-        if pad == self.launchpad_layout.channel7:
-            self.channels_manager.set_channel(7)
-
-    def _process_pad_message(self, msg: NoteMessage) -> None:
+        self._set_view_channel(view, view.channel - view.channel % CHANNEL_PADS + index)
+
+    def _process_pad_message(self, msg: NoteMessage, view: GridView) -> None:
         if msg.velocity == 0:
             return
+        if self.launchpad_layout.roles[msg.note] == ROLE_CHANNEL:
+            self._process_channel_pad(msg.note, view)
+            return
+        if not self._focus(view):
+            return
         if self.print_mode_on:
             print(
-                self.channels_manager.get_current_page().note_map[msg.note]
+                self.channels_manager.get_current_page().get_pad_by_note(msg.note)
             )
             return
-        if self.launchpad_layout.is_channel_pad(msg.note):
-            self._process_channel_pad(msg.note)
-        else:
-            location_or_other_stuff = self.channels_manager.toggle_pad_by_note(
-                msg.note)
-            if location_or_other_stuff != 'not-changed':
-                self.last_pad_location = location_or_other_stuff
-                self.launchpad.highlighted_row = 7 - \
-                    self.last_pad_location.y if self.legato_on and self.last_pad_location else None
-                current_page = self.channels_manager.get_current_page()
-                # TODO: I'm calling this twice here
-                self.launchpad.set_page(current_page)
-                self.launchpad.init_controller_param(VELOCITY_CC, 127)
-
-    async def _process_msg(self, msg) -> None:
+        location_or_other_stuff = self.channels_manager.toggle_pad_by_note(
+            msg.note)
+        if location_or_other_stuff != 'not-changed':
+            self.last_pad_location = location_or_other_stuff
+            view.highlighted_row = 7 - \
+                self.last_pad_location.y if self.legato_on and self.last_pad_location else None
+            view.render()
+            self.controllers.init_controller_param(VELOCITY_CC, 127)
+            self.controllers.init_controller_param(RATCHETS_CC, 0)
+            self.controllers.init_controller_param(CONDITION_CC, 0)
+
+    async def _process_msg(self, msg, view: GridView) -> None:
         if self._debug:
-            print(f"Processing incoming message: {msg}")
+            print(f"Processing incoming message from {view.launchpad.port_name}: {msg}")
 
         if ControlMessage.is_control(msg):
-            self._process_control_message(msg)
+            self._process_control_message(msg, view)
             return
 
         if NoteMessage.is_note(msg):
-            self._process_pad_message(msg)
+            self._process_pad_message(msg, view)
             return
 
-    async def _process_signals(self) -> None:
+    async def _read_port(self, get_pending_messages, process) -> None:
+        """Handles the messages of one input port, every port is read by its own task"""
         while not self._done:
-            await asyncio.gather(*[self._process_msg(m) for m in self.launchpad.get_pending_messages()])
-            await asyncio.gather(*[self._process_host_msg(m) for m in self.launchpad.get_pending_messages_from_host()])
-            await asyncio.gather(*[self._process_controller_message(m) for m in self.launchpad.get_pending_controller_messages()])
-            await asyncio.sleep(0.001)
+            for msg in get_pending_messages():
+                await process(msg)
+            await asyncio.sleep(POLL_INTERVAL)
 
     async def run(self) -> None:
         print(LSS_ASCII)
+        names = ", ".join(launchpad.port_name for launchpad in self.launchpads)
         print(
-            f"Launchpad Step Sequencer is running using {self.launchpad.name}")
-        asyncio.get_event_loop().create_task(self._process_signals())
-        await self.channels_manager.run()
+            f"Launchpad Step Sequencer is running using {names}")
+        if self.control_server:
+            await self.control_server.start()
+        # Steps are played from the host clock messages read here
+        tasks = [self._read_port(self._host_inport.iter_pending, self._process_host_msg)]
+        for view in self.views:
+            process = partial(self._process_msg, view=view)
+            tasks.append(self._read_port(view.launchpad.get_pending_messages, process))
+            tasks.append(view.run())
+        for controller in self.controllers.controllers:
+            tasks.append(self._read_port(controller.get_pending_messages, self._process_controller_message))
+        if self.shared_store:
+            tasks.append(self.shared_store.run())
+        await asyncio.gather(*tasks)
@@ -0,0 +1,432 @@
+import asyncio
+import struct
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Tuple
+
+import numpy as np
+
+from lss.channel import CC_LOCKS, LOCKABLE_PARAMS, MAX_RATCHETS, PARAMS, STEPS_PER_PAGE, Channel, Param
+from lss.channels_manager import ChannelsManager
+from lss.journal import OP_COPY_PAGE, OP_LEGATO, OP_LOCK, OP_PAD, OP_PARAM, RECORD, apply_record
+from lss.legato import LegatoNote
+from lss.notetype import NoteType
+from lss.page import Page
+from lss.project import LEGATO, LOCK, PARAM
+from lss.transforms import ROWS, PatternArray
+from lss.trig_conditions import TRIG_CONDITIONS
+
+DEFAULT_NAME = "lss-patterns"
+LAYOUT_MAGIC = b"LSSM"
+LAYOUT_VERSION = 1
+MAX_STEPS = 256
+MAX_LEGATO = 256
+MAX_LOCKS = 256
+COMMAND_RINGS = 4
+RING_SLOTS = 256
+# How often edits are published and commands are applied
+PUBLISH_INTERVAL = 0.01
+
+# magic, layout version, channel count, params per channel, max steps, rows, max legato notes, max locks,
+# command rings, slots per ring, then a counter bumped after every publish
+HEADER = struct.Struct("<4sHHHHHHHHHQ")
+# step, current page, per channel, written without the seqlock
+PLAYHEAD = struct.Struct("<II")
+# seqlock sequence, odd while the channel is being written, then length, legato note and lock counts.
+# Params follow as PARAM in PARAMS order, then the pad arrays, then LEGATO and LOCK slots
+CHANNEL_HEADER = struct.Struct("<IIII")
+# head, written by the client, and tail, written by the sequencer. Slots follow as journal records
+RING_HEADER = struct.Struct("<II")
+
+_PAD_FIELDS = 5
+_NOTE_TYPE_VALUES = {note_type.value for note_type in NoteType}
+
+
+def _layout(channel_count: int) -> Tuple[int, int, int, int]:
+    """Returns where the playheads, the channel blocks and the rings start, and the size of a channel block"""
+    playheads = HEADER.size
+    channels = playheads + channel_count * PLAYHEAD.size
+    channel_size = (
+        CHANNEL_HEADER.size
+        + len(PARAMS) * PARAM.size
+        + _PAD_FIELDS * MAX_STEPS * ROWS
+        + MAX_LEGATO * LEGATO.size
+        + MAX_LOCKS * LOCK.size
+    )
+    rings = channels + channel_count * channel_size
+    return playheads, channels, rings, channel_size
+
+
+def _is_valid_record(channels_manager: ChannelsManager, record: tuple) -> bool:
+    """Checks a record from a client before it is applied, any field out of range would raise mid-batch"""
+    op, channel_number, page_number, x, y, a, b, c, d, value = record
+    if channel_number >= len(channels_manager.channels):
+        return False
+    channel = channels_manager.channels[channel_number]
+    pages = len(channel.pages)
+    steps = pages * STEPS_PER_PAGE
+    if op == OP_PAD:
+        return (
+            page_number < pages
+            and x < STEPS_PER_PAGE
+            and y < ROWS
+            and b in _NOTE_TYPE_VALUES
+            and 1 <= c <= MAX_RATCHETS
+            and d < len(TRIG_CONDITIONS)
+            and 0 <= value <= 127
+        )
+    if op == OP_PARAM:
+        return a < len(PARAMS) and PARAMS[a].min_value <= value <= PARAMS[a].max_value
+    if op == OP_COPY_PAGE:
+        return page_number < pages and a < pages
+    if op == OP_LOCK:
+        if page_number >= steps or (a not in LOCKABLE_PARAMS and a not in CC_LOCKS):
+            return False
+        if not b:
+            return True
+        param = LOCKABLE_PARAMS.get(a)
+        return param.min_value <= value <= param.max_value if param else 0 <= value <= 127
+    if op == OP_LEGATO:
+        return y < ROWS and page_number < steps and 0 <= value < steps and 1 <= a <= 127
+    return False
+
+
+def _ring_size() -> int:
+    return RING_HEADER.size + RING_SLOTS * RECORD.size
+
+
+class _Layout:
+    """Offsets of one store, shared by the sequencer side and by clients"""
+
+    def __init__(self, buffer, channel_count: int):
+        self.buffer = buffer
+        self.channel_count = channel_count
+        self.playheads, self.channels, self.rings, self.channel_size = _layout(channel_count)
+
+    def channel_offset(self, number: int) -> int:
+        return self.channels + number * self.channel_size
+
+    def pad_arrays(self, number: int) -> List[np.ndarray]:
+        """Views of a channel's on, velocity, note type, ratchets and condition arrays, step x row"""
+        offset = self.channel_offset(number) + CHANNEL_HEADER.size + len(PARAMS) * PARAM.size
+        return [
+            np.ndarray(
+                (MAX_STEPS, ROWS), dtype=np.uint8, buffer=self.buffer, offset=offset + i * MAX_STEPS * ROWS
+            )
+            for i in range(_PAD_FIELDS)
+        ]
+
+    def legato_offset(self, number: int) -> int:
+        return (
+            self.channel_offset(number)
+            + CHANNEL_HEADER.size
+            + len(PARAMS) * PARAM.size
+            + _PAD_FIELDS * MAX_STEPS * ROWS
+        )
+
+    def locks_offset(self, number: int) -> int:
+        return self.legato_offset(number) + MAX_LEGATO * LEGATO.size
+
+    def ring_offset(self, ring: int) -> int:
+        return self.rings + ring * _ring_size()
+
+
+class SharedPatternStore(ChannelsManager.Listener):
+    """
+    Publishes the patterns of every channel in a shared memory block.
+
+    Other processes read it without talking to the sequencer, see
+    PatternStoreClient. Edits mark channels, which are written out together
+    by a task on the event loop between clocks, each inside its own seqlock so
+    readers never see half a channel. Commands submitted by clients are
+    journal records; they are drained in the same task and applied as one
+    undo step per batch.
+    """
+
+    def __init__(self, channels_manager: ChannelsManager, name: str = DEFAULT_NAME):
+        self.channels_manager = channels_manager
+        channel_count = len(channels_manager.channels)
+        _playheads, _channels, rings, _channel_size = _layout(channel_count)
+        size = rings + COMMAND_RINGS * _ring_size()
+        try:
+            self._memory = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a sequencer that didn't exit cleanly
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self._memory = shared_memory.SharedMemory(name, create=True, size=size)
+        self.name = name
+        self._layout = _Layout(self._memory.buf, channel_count)
+        self._pad_arrays = [self._layout.pad_arrays(number) for number in range(channel_count)]
+        HEADER.pack_into(
+            self._memory.buf,
+            0,
+            LAYOUT_MAGIC,
+            LAYOUT_VERSION,
+            channel_count,
+            len(PARAMS),
+            MAX_STEPS,
+            ROWS,
+            MAX_LEGATO,
+            MAX_LOCKS,
+            COMMAND_RINGS,
+            RING_SLOTS,
+            0,
+        )
+        self._version = 0
+        self._done = False
+        self._dirty = set(range(channel_count))
+        channels_manager.add_listener(self)
+
+    def close(self):
+        self._done = True
+        self.channels_manager.remove_listener(self)
+        self._pad_arrays = []
+        self._layout = None
+        self._memory.close()
+        self._memory.unlink()
+
+    def _publish_channel(self, channel: Channel) -> None:
+        buffer = self._memory.buf
+        offset = self._layout.channel_offset(channel.number)
+        (sequence,) = struct.unpack_from("<I", buffer, offset)
+        sequence = (sequence + 1) & 0xFFFFFFFF
+        struct.pack_into("<I", buffer, offset, sequence)
+        pattern = PatternArray.from_channel(channel)
+        steps = min(len(pattern.on), MAX_STEPS)
+        legato = list(channel.legato)[:MAX_LEGATO]
+        locks = list(channel.iter_locks())[:MAX_LOCKS]
+        CHANNEL_HEADER.pack_into(buffer, offset, sequence, channel._length, len(legato), len(locks))
+        param_offset = offset + CHANNEL_HEADER.size
+        for i, value in enumerate(channel.get_params()):
+            PARAM.pack_into(buffer, param_offset + i * PARAM.size, value)
+        for target, source in zip(self._pad_arrays[channel.number], pattern._fields()):
+            target[:steps] = source[:steps]
+            target[steps:] = 0
+        legato_offset = self._layout.legato_offset(channel.number)
+        for i, note in enumerate(legato):
+            LEGATO.pack_into(
+                buffer, legato_offset + i * LEGATO.size, note.row, note.start, note.end, note.velocity
+            )
+        locks_offset = self._layout.locks_offset(channel.number)
+        for i, lock in enumerate(locks):
+            LOCK.pack_into(buffer, locks_offset + i * LOCK.size, *lock)
+        struct.pack_into("<I", buffer, offset, (sequence + 1) & 0xFFFFFFFF)
+
+    def _publish_playheads(self) -> None:
+        for channel in self.channels_manager.channels:
+            PLAYHEAD.pack_into(
+                self._memory.buf,
+                self._layout.playheads + channel.number * PLAYHEAD.size,
+                channel._position,
+                channel.current_page,
+            )
+
+    def _drain_commands(self) -> List[tuple]:
+        buffer = self._memory.buf
+        records = []
+        for ring in range(COMMAND_RINGS):
+            offset = self._layout.ring_offset(ring)
+            head, tail = RING_HEADER.unpack_from(buffer, offset)
+            while tail != head:
+                slot = offset + RING_HEADER.size + tail % RING_SLOTS * RECORD.size
+                records.append(RECORD.unpack_from(buffer, slot))
+                tail = (tail + 1) & 0xFFFFFFFF
+            # Only the tail is ours to write, the client may have moved the head meanwhile
+            struct.pack_into("<I", buffer, offset + 4, tail)
+        return records
+
+    def apply_commands(self) -> int:
+        """Applies what clients submitted since the last call as one undo step, returns the applied count"""
+        records = self._drain_commands()
+        channel_count = len(self.channels_manager.channels)
+        history = self.channels_manager.history
+        before = history.snapshot({record[1] for record in records if record[1] < channel_count})
+        applied = 0
+        for record in records:
+            # Checked against the state left by the records before it, e.g. after a length change
+            if not _is_valid_record(self.channels_manager, record):
+                continue
+            apply_record(self.channels_manager, record)
+            applied += 1
+        if applied:
+            history.push(before)
+        return applied
+
+    def publish(self) -> None:
+        """Writes out the edited channels and the playheads"""
+        for number in sorted(self._dirty):
+            self._publish_channel(self.channels_manager.channels[number])
+        self._dirty.clear()
+        self._publish_playheads()
+        self._version += 1
+        struct.pack_into("<Q", self._memory.buf, HEADER.size - 8, self._version)
+
+    async def run(self) -> None:
+        while not self._done:
+            self.apply_commands()
+            self.publish()
+            await asyncio.sleep(PUBLISH_INTERVAL)
+
+    def on_channel_or_page_changed(self, channel: int, page: int):
+        pass
+
+    def on_page_updated(self, page: Page):
+        pass
+
+    def on_pad_changed(self, channel: Channel, page: Page, x: int, y: int):
+        self._dirty.add(channel.number)
+
+    def on_param_changed(self, channel: Channel, param: Param):
+        self._dirty.add(channel.number)
+
+    def on_page_copied(self, channel: Channel, source: int, target: int):
+        self._dirty.add(channel.number)
+
+    def on_pages_replaced(self, channel: Channel):
+        self._dirty.add(channel.number)
+
+    def on_lock_changed(self, channel: Channel, step: int, control: int):
+        self._dirty.add(channel.number)
+
+    def on_legato_changed(self, channel: Channel, note: LegatoNote, is_added: bool):
+        self._dirty.add(channel.number)
+
+
+class SharedChannel:
+    """A consistent copy of one channel read from the store"""
+
+    def __init__(self, number: int, params: tuple, pattern: PatternArray, legato: list, locks: list):
+        self.number = number
+        self.params = params
+        self.pattern = pattern
+        self.legato = legato
+        self.locks = locks
+
+    def __str__(self):
+        return f"SharedChannel(number={self.number}, length={self.pattern.length}, legato={len(self.legato)})"
+
+
+class PatternStoreClient:
+    """
+    Reads a running sequencer's patterns and submits edits to it.
+
+    Reads retry while the sequencer is writing the channel, so they never
+    block it. Every client writing commands has to use a ring of its own:
+    a ring has a single writer, which is what keeps it free of locks.
+    """
+
+    def __init__(self, name: str = DEFAULT_NAME, ring: int = 0):
+        self._memory = shared_memory.SharedMemory(name)
+        # Attaching registers the block for cleanup as if this process owned it, the sequencer does
+        resource_tracker.unregister(self._memory._name, "shared_memory")
+        magic, version, channel_count, *limits, _version = HEADER.unpack_from(self._memory.buf, 0)
+        if magic != LAYOUT_MAGIC:
+            raise ValueError(f"{name} is not an LSS pattern store")
+        if (version, *limits) != (
+            LAYOUT_VERSION,
+            len(PARAMS),
+            MAX_STEPS,
+            ROWS,
+            MAX_LEGATO,
+            MAX_LOCKS,
+            COMMAND_RINGS,
+            RING_SLOTS,
+        ):
+            raise ValueError(f"{name} was written by a different version of the sequencer")
+        if not 0 <= ring < COMMAND_RINGS:
+            raise ValueError(f"Ring has to be between 0 and {COMMAND_RINGS - 1}, got {ring}")
+        self._layout = _Layout(self._memory.buf, channel_count)
+        self._pad_arrays = [self._layout.pad_arrays(number) for number in range(channel_count)]
+        self._ring = ring
+        self.channel_count = channel_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._pad_arrays = []
+        self._layout = None
+        self._memory.close()
+
+    @property
+    def version(self) -> int:
+        """Changes every time the sequencer publishes, poll it to find out when to read again"""
+        return struct.unpack_from("<Q", self._memory.buf, HEADER.size - 8)[0]
+
+    def playhead(self, number: int) -> Tuple[int, int]:
+        """Returns the step a channel is playing and the page it shows"""
+        return PLAYHEAD.unpack_from(self._memory.buf, self._layout.playheads + number * PLAYHEAD.size)
+
+    def pad_arrays(self, number: int) -> List[np.ndarray]:
+        """
+        Views straight into the shared pads of a channel, without copying.
+
+        They may change while being read; check that `sequence` is even and
+        didn't change around the read, or use `read_channel`.
+        """
+        return self._pad_arrays[number]
+
+    def sequence(self, number: int) -> int:
+        return struct.unpack_from("<I", self._memory.buf, self._layout.channel_offset(number))[0]
+
+    def read_channel(self, number: int) -> SharedChannel:
+        buffer = self._memory.buf
+        offset = self._layout.channel_offset(number)
+        while True:
+            sequence, length, legato_count, lock_count = CHANNEL_HEADER.unpack_from(buffer, offset)
+            if sequence % 2:
+                continue
+            params = tuple(
+                PARAM.unpack_from(buffer, offset + CHANNEL_HEADER.size + i * PARAM.size)[0]
+                for i in range(len(PARAMS))
+            )
+            pattern = PatternArray(length, MAX_STEPS)
+            for target, source in zip(pattern._fields(), self._pad_arrays[number]):
+                target[:] = source
+            legato_offset = self._layout.legato_offset(number)
+            legato = [
+                LegatoNote(*LEGATO.unpack_from(buffer, legato_offset + i * LEGATO.size))
+                for i in range(min(legato_count, MAX_LEGATO))
+            ]
+            locks_offset = self._layout.locks_offset(number)
+            locks = [
+                LOCK.unpack_from(buffer, locks_offset + i * LOCK.size)
+                for i in range(min(lock_count, MAX_LOCKS))
+            ]
+            if self.sequence(number) == sequence:
+                return SharedChannel(number, params, pattern, legato, locks)
+
+    def submit(self, op: int, channel: int, page: int, x: int, y: int, a=0, b=0, c=0, d=0, value=0) -> bool:
+        """Queues a journal record for the sequencer, returns False when the ring is full"""
+        buffer = self._memory.buf
+        offset = self._layout.ring_offset(self._ring)
+        head, tail = RING_HEADER.unpack_from(buffer, offset)
+        if (head - tail) & 0xFFFFFFFF >= RING_SLOTS:
+            return False
+        slot = offset + RING_HEADER.size + head % RING_SLOTS * RECORD.size
+        RECORD.pack_into(buffer, slot, op, channel, page, x, y, a, b, c, d, value)
+        # The record is in place before the sequencer can see the new head
+        struct.pack_into("<I", buffer, offset, (head + 1) & 0xFFFFFFFF)
+        return True
+
+    def set_pad(
+        self,
+        channel: int,
+        page: int,
+        x: int,
+        y: int,
+        is_on: bool,
+        velocity: int = 127,
+        note_type: NoteType = NoteType.FULL,
+        ratchets: int = 1,
+        condition: int = 0,
+    ) -> bool:
+        return self.submit(OP_PAD, channel, page, x, y, is_on, note_type.value, ratchets, condition, velocity)
+
+    def set_param(self, channel: int, param_index: int, value: int) -> bool:
+        """Sets a param, `param_index` is its position in PARAMS"""
+        return self.submit(OP_PARAM, channel, 0, 0, 0, param_index, value=value)
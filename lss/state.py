@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+from lss.channel import PARAMS
+from lss.legato import LegatoNote
+from lss.notetype import NoteType
+from lss.paddata import PadData
+from lss.project import load_project, save_project, save_project_async
+
+# Like PROJECT_VERSION, only raised when a released format changes
+STATE_VERSION = 1
+
+
+def channel_to_dict(channel) -> dict:
+    pages = []
+    for page in channel.pages:
+        pads = []
+        for x in range(8):
+            for y in range(8):
+                pad_data = page.pads[x][y]
+                if pad_data.is_on:
+                    note_type = pad_data.note_type.name
+                    pads.append([x, y, pad_data.velocity, note_type, pad_data.ratchets, pad_data.condition])
+        if pads:
+            pages.append([page.number, pads])
+    data = {
+        "number": channel.number,
+        "pages": pages,
+        "locks": [list(lock) for lock in channel.iter_locks()],
+        "legato": [[note.row, note.start, note.end, note.velocity] for note in channel.legato],
+    }
+    for param in PARAMS:
+        data[param.key] = getattr(channel, param.attribute_name)
+    return data
+
+
+def load_channel_from_dict(channel, data: dict) -> None:
+    for param in PARAMS:
+        value = data.get(param.key, getattr(channel, param.attribute_name))
+        setattr(channel, param.attribute_name, value)
+    channel.set_locks(data.get("locks", []))
+    channel.set_legato_notes(LegatoNote(*note) for note in data.get("legato", []))
+    for page_number, pads in data.get("pages", []):
+        page = channel.pages[page_number]
+        for x, y, velocity, note_type, ratchets, condition in pads:
+            page.set_pad(
+                x, y, PadData(page.get_note(x, y), True, velocity, NoteType[note_type], ratchets, condition)
+            )
+
+
+def encode_state(channels_manager) -> str:
+    """Returns channels, pages and per-channel params as JSON"""
+    data = {
+        "version": STATE_VERSION,
+        "channels": [channel_to_dict(channel) for channel in channels_manager.channels],
+    }
+    return json.dumps(data)
+
+
+def _write_state(path: str, text: str) -> None:
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def save_state(channels_manager, path: str) -> None:
+    _write_state(path, encode_state(channels_manager))
+
+
+def load_state(channels_manager, path: str) -> None:
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("version") != STATE_VERSION:
+        raise ValueError(f"Unsupported state version: {data.get('version')}")
+    for channel, channel_data in zip(channels_manager.channels, data["channels"]):
+        load_channel_from_dict(channel, channel_data)
+
+
+def is_json_state(path: str) -> bool:
+    return path.lower().endswith(".json")
+
+
+def load_state_file(channels_manager, path: str) -> None:
+    """Loads JSON state or a binary project depending on the file extension"""
+    if is_json_state(path):
+        load_state(channels_manager, path)
+    else:
+        load_project(channels_manager, path)
+
+
+def save_state_file(channels_manager, path: str) -> None:
+    if is_json_state(path):
+        save_state(channels_manager, path)
+    else:
+        save_project(channels_manager, path)
+
+
+async def save_state_file_async(channels_manager, path: str) -> None:
+    """Like `save_state_file`, the state is encoded on the loop and written from a worker thread"""
+    if is_json_state(path):
+        text = encode_state(channels_manager)
+        await asyncio.get_event_loop().run_in_executor(None, _write_state, path, text)
+    else:
+        await save_project_async(channels_manager, path)
@@ -0,0 +1,159 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from lss.clock_math import STEPS_PER_PAGE
+from lss.notetype import NoteType
+from lss.page import EMPTY_PADS, Page
+from lss.paddata import PadData
+
+ROWS = 8
+
+_NOTE_TYPES = {note_type.value: note_type for note_type in NoteType}
+FULL = NoteType.FULL.value
+
+
+class PatternArray:
+    """
+    A channel's pads as step x row arrays.
+
+    Step `page * 8 + x` holds the pads of column x on that page. Transforms work
+    on whole arrays at once and only the first `length` steps, the ones the
+    channel plays, are moved around. Legato notes live in the channel's legato
+    index, not in pads, and are left where they are.
+    """
+
+    def __init__(self, length: int, steps: int):
+        self.length = length
+        self.on = np.zeros((steps, ROWS), dtype=bool)
+        self.velocity = np.full((steps, ROWS), 127, dtype=np.int16)
+        self.note_type = np.full((steps, ROWS), FULL, dtype=np.uint8)
+        self.ratchets = np.ones((steps, ROWS), dtype=np.uint8)
+        self.condition = np.zeros((steps, ROWS), dtype=np.uint8)
+
+    @staticmethod
+    def from_channel(channel) -> "PatternArray":
+        pattern = PatternArray(channel._length, len(channel.pages) * STEPS_PER_PAGE)
+        for page in channel.pages:
+            for x, column in enumerate(page.pads):
+                step = page.number * STEPS_PER_PAGE + x
+                for y, pad_data in enumerate(column):
+                    if pad_data.is_on:
+                        pattern.on[step, y] = True
+                        pattern.velocity[step, y] = pad_data.velocity
+                        pattern.note_type[step, y] = pad_data.note_type.value
+                        pattern.ratchets[step, y] = pad_data.ratchets
+                        pattern.condition[step, y] = pad_data.condition
+        return pattern
+
+    def _fields(self) -> List[np.ndarray]:
+        return [self.on, self.velocity, self.note_type, self.ratchets, self.condition]
+
+    def copy(self) -> "PatternArray":
+        pattern = PatternArray(self.length, len(self.on))
+        for source, target in zip(self._fields(), pattern._fields()):
+            target[:] = source
+        return pattern
+
+    def to_pages(self, channel) -> Dict[int, Tuple[Tuple[PadData, ...], ...]]:
+        """
+        Builds the pads of every page that differs from the channel.
+
+        Columns that didn't change keep their pads, so history snapshots keep
+        sharing them with the live pages.
+        """
+        current = PatternArray.from_channel(channel)
+        changed = np.zeros(len(self.on), dtype=bool)
+        for field, current_field in zip(self._fields(), current._fields()):
+            changed |= ((field != current_field) & (self.on | current.on)).any(axis=1)
+        pages = {}
+        for page_number in np.unique(np.flatnonzero(changed) // STEPS_PER_PAGE):
+            page_number = int(page_number)
+            pads = channel.pages[page_number].pads
+            columns = []
+            for x in range(STEPS_PER_PAGE):
+                step = page_number * STEPS_PER_PAGE + x
+                columns.append(self._column(step, x) if changed[step] else pads[x])
+            pages[page_number] = tuple(columns)
+        return pages
+
+    def _column(self, step: int, x: int) -> Tuple[PadData, ...]:
+        return tuple(
+            PadData(
+                Page.get_note(x, y),
+                True,
+                int(self.velocity[step, y]),
+                _NOTE_TYPES[int(self.note_type[step, y])],
+                int(self.ratchets[step, y]),
+                int(self.condition[step, y]),
+            )
+            if self.on[step, y]
+            else EMPTY_PADS[x][y]
+            for y in range(ROWS)
+        )
+
+
+def rotate(pattern: PatternArray, steps: int) -> PatternArray:
+    """Moves every pad `steps` later, pads past the end come back at the start"""
+    result = pattern.copy()
+    for field in result._fields():
+        field[: pattern.length] = np.roll(field[: pattern.length], steps, axis=0)
+    return result
+
+
+def reverse(pattern: PatternArray) -> PatternArray:
+    result = pattern.copy()
+    for field in result._fields():
+        field[: pattern.length] = field[pattern.length - 1 :: -1]
+    return result
+
+
+def transpose_rows(pattern: PatternArray, rows: int) -> PatternArray:
+    """Moves pads up by `rows`, or down when negative, pads moved off the grid are dropped"""
+    result = pattern.copy()
+    for field in result._fields():
+        field[:] = np.roll(field, rows, axis=1)
+    if rows > 0:
+        result.on[:, :rows] = False
+    elif rows < 0:
+        result.on[:, rows:] = False
+    return result
+
+
+def scale_velocity(pattern: PatternArray, factor: float) -> PatternArray:
+    result = pattern.copy()
+    result.velocity[:] = np.clip(np.rint(pattern.velocity * factor), 1, 127)
+    return result
+
+
+def humanize_velocity(pattern: PatternArray, amount: int, seed: int = 0) -> PatternArray:
+    """Moves velocities by up to `amount` either way, the same seed always gives the same result"""
+    result = pattern.copy()
+    offsets = np.random.default_rng(seed).integers(-amount, amount + 1, size=pattern.velocity.shape)
+    result.velocity[:] = np.clip(pattern.velocity + offsets, 1, 127)
+    return result
+
+
+def thin(pattern: PatternArray, density: float, seed: int = 0) -> PatternArray:
+    """Keeps about `density` of the notes, the same seed always drops the same ones"""
+    result = pattern.copy()
+    result.on &= np.random.default_rng(seed).random(pattern.on.shape) < density
+    return result
+
+
+def euclidean_rhythm(steps: int, pulses: int, rotation: int = 0) -> np.ndarray:
+    """Spreads `pulses` hits as evenly as possible over `steps` steps"""
+    hits = (np.arange(steps) * pulses) % steps < pulses
+    return np.roll(hits, rotation)
+
+
+def fill_row(pattern: PatternArray, row: int, hits: np.ndarray, velocity: int = 127) -> PatternArray:
+    """Replaces a row with single step notes where `hits` is set, repeating it over the pattern"""
+    result = pattern.copy()
+    repeated = np.resize(hits, pattern.length)
+    result.on[: pattern.length, row] = repeated
+    result.velocity[: pattern.length, row] = velocity
+    result.note_type[: pattern.length, row] = FULL
+    result.ratchets[: pattern.length, row] = 1
+    result.condition[: pattern.length, row] = 0
+    return result
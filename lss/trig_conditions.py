@@ -0,0 +1,66 @@
+import random
+
+ALWAYS = "always"
+CHANCE = "chance"
+LOOP = "loop"
+FIRST = "first"
+NOT_FIRST = "not-first"
+FILL = "fill"
+NOT_FILL = "not-fill"
+
+# name, kind, and the percentage of a chance or the A and B of an A:B condition
+TRIG_CONDITIONS = [
+    ("Always", ALWAYS, 0, 0),
+    ("90%", CHANCE, 90, 0),
+    ("75%", CHANCE, 75, 0),
+    ("50%", CHANCE, 50, 0),
+    ("33%", CHANCE, 33, 0),
+    ("25%", CHANCE, 25, 0),
+    ("10%", CHANCE, 10, 0),
+    ("1:2", LOOP, 1, 2),
+    ("2:2", LOOP, 2, 2),
+    ("1:3", LOOP, 1, 3),
+    ("2:3", LOOP, 2, 3),
+    ("3:3", LOOP, 3, 3),
+    ("1:4", LOOP, 1, 4),
+    ("2:4", LOOP, 2, 4),
+    ("3:4", LOOP, 3, 4),
+    ("4:4", LOOP, 4, 4),
+    ("First", FIRST, 0, 0),
+    ("Not first", NOT_FIRST, 0, 0),
+    ("Fill", FILL, 0, 0),
+    ("Not fill", NOT_FILL, 0, 0),
+]
+
+
+def build_trig_rolls(seed: int, channel: int, loop: int, size: int) -> bytes:
+    """
+    Draws the dice rolls, 0 to 255, of every pad for one loop of a pattern.
+
+    All rolls of a loop come from one call, and the generator is seeded from
+    the loop number, so a seed plays the same trigs on every run and after
+    any seek.
+    """
+    return random.Random(f"{seed}:{channel}:{loop}").getrandbits(8 * size).to_bytes(size, "little")
+
+
+def trig_passes(condition: int, loop: int, roll: int, fill: bool) -> bool:
+    """Tells if a pad with a condition plays on a loop of its pattern"""
+    _name, kind, a, b = TRIG_CONDITIONS[condition]
+    if kind == CHANCE:
+        return roll < a * 256 // 100
+    if kind == LOOP:
+        return loop % b == a - 1
+    if kind == FIRST:
+        return loop == 0
+    if kind == NOT_FIRST:
+        return loop != 0
+    if kind == FILL:
+        return fill
+    if kind == NOT_FILL:
+        return not fill
+    return True
+
+
+def needs_roll(condition: int) -> bool:
+    return TRIG_CONDITIONS[condition][1] == CHANCE
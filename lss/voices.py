@@ -0,0 +1,65 @@
+from typing import List
+
+MIDI_CHANNELS = 16
+
+
+def _iter_notes(bits: int):
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+class VoiceTable:
+    """
+    Notes sounding on each MiDI channel of an output.
+
+    Every channel is one 128 bit int with a bit per note, so checking a note is
+    a shift and forgetting all notes of a channel is a single assignment.
+    Start order is kept next to it to pick the voice to steal when a channel
+    plays more notes than its polyphony allows.
+    """
+
+    def __init__(self):
+        self._active = [0] * MIDI_CHANNELS
+        # Sounding notes of each channel, oldest first
+        self._order: List[List[int]] = [[] for _ in range(MIDI_CHANNELS)]
+
+    def is_active(self, channel: int, note: int) -> bool:
+        return bool(self._active[channel] >> note & 1)
+
+    def count(self, channel: int) -> int:
+        return bin(self._active[channel]).count("1")
+
+    def note_on(self, channel: int, note: int, polyphony: int = 0) -> List[int]:
+        """
+        Marks a note as sounding and returns the notes it steals.
+
+        With a polyphony above 0 the oldest notes give up their voice until
+        the channel fits.
+        """
+        self._active[channel] |= 1 << note
+        order = self._order[channel]
+        order.append(note)
+        stolen = []
+        if polyphony:
+            while len(order) > polyphony:
+                oldest = order.pop(0)
+                self._active[channel] &= ~(1 << oldest)
+                stolen.append(oldest)
+        return stolen
+
+    def note_off(self, channel: int, note: int) -> bool:
+        """Marks a note as silent, returns False when it wasn't sounding"""
+        if not self._active[channel] >> note & 1:
+            return False
+        self._active[channel] &= ~(1 << note)
+        self._order[channel].remove(note)
+        return True
+
+    def release_all(self, channel: int) -> List[int]:
+        """Forgets every sounding note of a channel and returns them so they can be ended"""
+        notes = list(_iter_notes(self._active[channel]))
+        self._active[channel] = 0
+        self._order[channel] = []
+        return notes
@@ -0,0 +1,248 @@
+import asyncio
+import multiprocessing
+import signal
+from typing import Dict, List, Optional, Set
+
+from lss.channel import MAX_GROOVES, Channel
+from lss.channels_manager import ChannelsManager
+from lss.devices.twister import ControllerGroup
+from lss.groove import Groove
+from lss.page import Page
+from lss.utils import open_output
+from lss.voices import VoiceTable
+
+# Messages to workers are (kind, payload) pairs
+CLOCK = "clock"
+HOST_NOTE = "host-note"
+CHANNEL_CHANGES = "channel-changes"
+FILL = "fill"
+CLOSE = "close"
+
+
+def _run_worker(connection, port_numbers, port_names, channel_count, channels_per_port, grooves, debug):
+    # Ctrl+C reaches the whole process group, the main process tells workers when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker = ChannelWorker(
+        connection, port_numbers, port_names, channel_count, channels_per_port, grooves, debug
+    )
+    asyncio.run(worker.run())
+
+
+class ChannelWorker:
+    """
+    Plays the channels of some output ports in a process of its own.
+
+    The worker owns those ports. It gets the edited parts of a channel after
+    every edit and each host clock and note as the main process receives
+    them, so its channels play exactly what they would in the main process.
+    """
+
+    def __init__(
+        self,
+        connection,
+        port_numbers: List[int],
+        port_names: List[str],
+        channel_count: int,
+        channels_per_port: int,
+        grooves: List[Groove],
+        debug: bool,
+    ):
+        self._connection = connection
+        self._closed: Optional[asyncio.Future] = None
+        self.ports = [open_output(name, virtual=True, autoreset=True) for name in port_names]
+        self.channels: Dict[int, Channel] = {}
+        controllers = ControllerGroup()
+        for port_number, port in zip(port_numbers, self.ports):
+            voices = VoiceTable()
+            first = port_number * channels_per_port
+            for number in range(first, min(first + channels_per_port, channel_count)):
+                channel = Channel(number, controllers, port, debug, voices, number - first)
+                channel.grooves = grooves[:MAX_GROOVES]
+                self.channels[number] = channel
+
+    def _receive(self) -> None:
+        try:
+            while self._connection.poll():
+                kind, payload = self._connection.recv()
+                self._handle(kind, payload)
+        except EOFError:
+            # The main process is gone
+            self._close()
+
+    def _handle(self, kind: str, payload) -> None:
+        if kind == CLOCK:
+            for channel in self.channels.values():
+                channel.process_host_clock_message(payload)
+        elif kind == HOST_NOTE:
+            for channel in self.channels.values():
+                channel.proceess_host_note_message(payload)
+        elif kind == CHANNEL_CHANGES:
+            number, everything, pages, params, locks, legato = payload
+            self.channels[number].restore(pages, params, locks, legato, only_given_pages=not everything)
+        elif kind == FILL:
+            for channel in self.channels.values():
+                channel.fill_on = payload
+        elif kind == CLOSE:
+            self._close()
+
+    def _close(self) -> None:
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._closed = loop.create_future()
+        # Messages are handled as soon as they arrive instead of on a polling interval
+        loop.add_reader(self._connection.fileno(), self._receive)
+        await self._closed
+        loop.remove_reader(self._connection.fileno())
+        for channel in self.channels.values():
+            channel.close()
+        for port in self.ports:
+            port.close()
+        self._connection.close()
+
+
+class _Changes:
+    """Parts of a channel edited since it was last sent to its worker"""
+
+    def __init__(self, everything: bool = False):
+        self.everything = everything
+        self.pages: Set[int] = set()
+        self.params = everything
+        self.locks = everything
+        self.legato = everything
+
+
+class WorkerPool(ChannelsManager.Listener):
+    """
+    Worker processes that play the channels, output ports are dealt out between them.
+
+    Channels in the main process are still edited and drawn there, they only
+    follow the clock to move their playheads. The edited parts of channels
+    are sent to their worker before the next clock, and every clock is
+    broadcast to all workers, so channels on different ports fire on
+    different cores.
+    """
+
+    def __init__(
+        self,
+        channels_manager: ChannelsManager,
+        port_names: List[str],
+        workers: int,
+        grooves: Optional[List[Groove]] = None,
+        debug: bool = False,
+    ):
+        self.channels_manager = channels_manager
+        channel_count = len(channels_manager.channels)
+        channels_per_port = channels_manager.channels_per_port
+        workers = min(workers, len(port_names))
+        # Workers have to import the sequencer themselves, forking would copy open MiDI ports
+        context = multiprocessing.get_context("spawn")
+        self._connections = []
+        self._processes = []
+        # Connection to the worker playing each channel
+        self._owners = {}
+        for worker in range(workers):
+            port_numbers = list(range(worker, len(port_names), workers))
+            connection, worker_connection = context.Pipe()
+            process = context.Process(
+                target=_run_worker,
+                args=(
+                    worker_connection,
+                    port_numbers,
+                    [port_names[number] for number in port_numbers],
+                    channel_count,
+                    channels_per_port,
+                    grooves or [],
+                    debug,
+                ),
+                name=f"lss-worker-{worker}",
+                daemon=True,
+            )
+            process.start()
+            worker_connection.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+            for number in range(channel_count):
+                if number // channels_per_port in port_numbers:
+                    self._owners[number] = connection
+        for channel in channels_manager.channels:
+            channel.remote = True
+        # Workers start blank, every channel goes out whole before the first clock
+        self._changes: Dict[int, _Changes] = {
+            number: _Changes(everything=True) for number in range(channel_count)
+        }
+        channels_manager.add_listener(self)
+
+    def close(self):
+        self.channels_manager.remove_listener(self)
+        for connection in self._connections:
+            connection.send((CLOSE, None))
+        for process in self._processes:
+            process.join(timeout=1)
+        for connection in self._connections:
+            connection.close()
+
+    def _broadcast(self, kind: str, payload) -> None:
+        for connection in self._connections:
+            connection.send((kind, payload))
+
+    def send_clock(self, msg) -> None:
+        """Sends the edited parts of channels to their workers, then the clock to all of them"""
+        for number, changes in self._changes.items():
+            channel = self.channels_manager.channels[number]
+            numbers = channel.pages.numbers() if changes.everything else changes.pages
+            pages = {}
+            for page_number in numbers:
+                page = channel.pages.get(page_number)
+                if page is not None:
+                    pages[page_number] = page.pads
+            payload = (
+                number,
+                changes.everything,
+                pages,
+                channel.get_params() if changes.params else None,
+                channel.locks if changes.locks else None,
+                channel.legato.notes() if changes.legato else None,
+            )
+            self._owners[number].send((CHANNEL_CHANGES, payload))
+        self._changes.clear()
+        self._broadcast(CLOCK, msg)
+
+    def _changes_of(self, channel: Channel) -> _Changes:
+        changes = self._changes.get(channel.number)
+        if changes is None:
+            changes = self._changes[channel.number] = _Changes()
+        return changes
+
+    def send_host_note(self, msg) -> None:
+        self._broadcast(HOST_NOTE, msg)
+
+    def set_fill(self, fill_on: bool) -> None:
+        self._broadcast(FILL, fill_on)
+
+    def on_channel_or_page_changed(self, channel: int, page: int):
+        pass
+
+    def on_page_updated(self, page: Page):
+        pass
+
+    def on_pad_changed(self, channel: Channel, page: Page, x: int, y: int):
+        self._changes_of(channel).pages.add(page.number)
+
+    def on_param_changed(self, channel: Channel, param):
+        self._changes_of(channel).params = True
+
+    def on_page_copied(self, channel: Channel, source: int, target: int):
+        self._changes_of(channel).pages.add(target)
+
+    def on_pages_replaced(self, channel: Channel):
+        # Loaded patterns set params, locks and legato notes without telling listeners
+        self._changes[channel.number] = _Changes(everything=True)
+
+    def on_lock_changed(self, channel: Channel, step: int, control: int):
+        self._changes_of(channel).locks = True
+
+    def on_legato_changed(self, channel: Channel, note, is_added: bool):
+        self._changes_of(channel).legato = True